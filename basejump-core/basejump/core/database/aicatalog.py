@@ -1,7 +1,12 @@
 """Catalog of all of the AIs Basejump uses"""
 
-from typing import Optional
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
 
+import boto3
+import httpx
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.models import schemas as sch
 from llama_index.core import Settings
@@ -14,6 +19,111 @@ from llama_index.llms.bedrock_converse import BedrockConverse
 
 logger = set_logging(handler_option="stream", name=__name__)
 
+AI_CLIENT_POOL_MAX_SIZE = 256  # Max number of LLM and embedding objects to keep
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_TIMEOUT = 60  # seconds
+
+
+class AIClientPool:
+    """Shares the LLM and embedding objects and their HTTP connection pools across the process
+
+    Models are keyed by endpoint, deployment, model and max tokens, so the same object is returned for
+    the same settings. Callback managers are created for every prompt, so they are not part of the key
+    and AICatalog attaches them to a copy of the pooled model. Models for different settings still share
+    one HTTP client per endpoint, so TLS connections are reused either way.
+
+    The async HTTP clients are tied to the event loop they are used in, so everything is reset if the
+    running event loop changes. The old clients are closed on their own loop.
+    """
+
+    def __init__(self, max_size: int = AI_CLIENT_POOL_MAX_SIZE):
+        self.max_size = max_size
+        self._models: OrderedDict[tuple, Any] = OrderedDict()
+        self._http_clients: dict[str, httpx.Client] = {}
+        self._async_http_clients: dict[str, httpx.AsyncClient] = {}
+        self._boto_clients: dict[tuple, Any] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closer: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    def _check_loop(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Called outside of an event loop, such as from a thread
+            return
+        if loop is not self._loop:
+            if self._loop is not None and self._closer is not None:
+                logger.debug("Event loop changed, resetting the AI client pool")
+                if not self._loop.is_closed():
+                    # Otherwise asyncio.run already cancelled the closer when it shut down the old loop
+                    self._loop.call_soon_threadsafe(self._closer.cancel)
+            self._loop = loop
+            self._models.clear()
+            self._async_http_clients = {}
+            self._closer = loop.create_task(self._close_on_shutdown(http_clients=self._async_http_clients))
+
+    @staticmethod
+    async def _close_on_shutdown(http_clients: dict[str, httpx.AsyncClient]) -> None:
+        """Close the async HTTP clients of a loop once this is cancelled, such as by asyncio.run at shutdown"""
+        try:
+            await asyncio.Future()
+        finally:
+            for http_client in http_clients.values():
+                await http_client.aclose()
+
+    @staticmethod
+    def _get_limits() -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+        )
+
+    def get_http_client(self, endpoint: str) -> httpx.Client:
+        http_client = self._http_clients.get(endpoint)
+        if not http_client:
+            http_client = httpx.Client(limits=self._get_limits(), timeout=HTTP_TIMEOUT)
+            self._http_clients[endpoint] = http_client
+        return http_client
+
+    def get_async_http_client(self, endpoint: str) -> httpx.AsyncClient:
+        http_client = self._async_http_clients.get(endpoint)
+        if not http_client:
+            http_client = httpx.AsyncClient(limits=self._get_limits(), timeout=HTTP_TIMEOUT)
+            self._async_http_clients[endpoint] = http_client
+        return http_client
+
+    def get_bedrock_client(self, region_name: str, access_key: str, secret_access_key: str) -> Any:
+        """Get a bedrock runtime client. Boto3 clients are thread safe, so they can be shared."""
+        key = (region_name, access_key)
+        client = self._boto_clients.get(key)
+        if not client:
+            client = boto3.client(
+                "bedrock-runtime",
+                region_name=region_name,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_access_key,
+            )
+            self._boto_clients[key] = client
+        return client
+
+    def get_model(self, key: tuple, factory: Callable[[], Any]) -> Any:
+        """Get the model for the key, creating it with the factory if it isn't in the pool"""
+        with self._lock:
+            self._check_loop()
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+            model = factory()
+            self._models[key] = model
+            if len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+            return model
+
+
+ai_client_pool = AIClientPool()
+
 
 class AICatalog:
     """Organizes all of the LLMs being used into one location"""
@@ -21,13 +131,26 @@ class AICatalog:
     def __init__(self, callback_manager: Optional[CallbackManager] = None):
         self.callback_manager = callback_manager
 
-    def get_llm(self, model_info: sch.ModelInfo) -> FunctionCallingLLM:
-        """An LLM used for tasks requiring higher accuracy such as decomposing a question"""
+    def _with_callback_manager(self, model: Any) -> Any:
+        """Copy the pooled model with this catalog's callback manager
+
+        The copy is shallow, so it shares the pooled model's clients.
+        """
+        return model.model_copy(update={"callback_manager": self.callback_manager or CallbackManager([])})
+
+    def get_llm(self, model_info: sch.ModelInfo, max_tokens: Optional[int] = None) -> FunctionCallingLLM:
+        """An LLM used for tasks requiring higher accuracy such as decomposing a question
+
+        Parameters
+        ----------
+        max_tokens
+            Overrides the max tokens from the model info
+        """
 
         if isinstance(model_info, sch.AzureModelInfo):
-            return self.get_azure_llm(model_info=model_info)
+            return self.get_azure_llm(model_info=model_info, max_tokens=max_tokens)
         elif isinstance(model_info, sch.AWSModelInfo):
-            return self.get_aws_llm(model_info=model_info)
+            return self.get_aws_llm(model_info=model_info, max_tokens=max_tokens)
         else:
             raise NotImplementedError("The provided LLM Info type has not been implemented.")
 
@@ -37,14 +160,28 @@ class AICatalog:
         Currently only AzureOpenAI embedding is supported.
         """
         assert model_info.endpoint_info, "Missing endpoint info - the pydantic schema should be validating this"
-        return AzureOpenAIEmbedding(
-            model=model_info.model_name.value,
-            deployment_name=model_info.endpoint_info.deployment_name,
-            api_key=model_info.endpoint_info.api_key,
-            azure_endpoint=model_info.endpoint_info.endpoint,
-            api_version=model_info.api_version,
-            callback_manager=self.callback_manager,
+        endpoint_info = model_info.endpoint_info
+        key = (
+            AzureOpenAIEmbedding,
+            endpoint_info.endpoint,
+            endpoint_info.deployment_name,
+            endpoint_info.api_key,
+            model_info.model_name.value,
+            model_info.api_version,
         )
+        model = ai_client_pool.get_model(
+            key=key,
+            factory=lambda: AzureOpenAIEmbedding(
+                model=model_info.model_name.value,
+                deployment_name=endpoint_info.deployment_name,
+                api_key=endpoint_info.api_key,
+                azure_endpoint=endpoint_info.endpoint,
+                api_version=model_info.api_version,
+                http_client=ai_client_pool.get_http_client(endpoint=endpoint_info.endpoint),
+                async_http_client=ai_client_pool.get_async_http_client(endpoint=endpoint_info.endpoint),
+            ),
+        )
+        return self._with_callback_manager(model)
 
     def get_settings(
         self, llm: FunctionCallingLLM, embedding_model_info: sch.AzureModelInfo
@@ -62,26 +199,59 @@ class AICatalog:
         Settings.embed_model = self.get_embedding_model(model_info=embedding_model_info)
         return Settings
 
-    def get_aws_llm(self, model_info: sch.AWSModelInfo) -> FunctionCallingLLM:
+    def get_aws_llm(self, model_info: sch.AWSModelInfo, max_tokens: Optional[int] = None) -> FunctionCallingLLM:
         assert model_info.endpoint_info, "Missing endpoint info - the pydantic schema should be validating this"
-        return BedrockConverse(
-            model=model_info.model_name.value,
-            max_tokens=model_info.max_tokens,
-            aws_access_key_id=model_info.endpoint_info.access_key,
-            aws_secret_access_key=model_info.endpoint_info.secret_access_key,
-            region_name=model_info.endpoint_info.deployment_region,
-            callback_manager=self.callback_manager,
+        endpoint_info = model_info.endpoint_info
+        max_tokens = max_tokens or model_info.max_tokens
+        key = (
+            BedrockConverse,
+            endpoint_info.deployment_region,
+            endpoint_info.access_key,
+            model_info.model_name.value,
+            max_tokens,
+        )
+        model = ai_client_pool.get_model(
+            key=key,
+            factory=lambda: BedrockConverse(
+                model=model_info.model_name.value,
+                max_tokens=max_tokens,
+                aws_access_key_id=endpoint_info.access_key,
+                aws_secret_access_key=endpoint_info.secret_access_key,
+                region_name=endpoint_info.deployment_region,
+                client=ai_client_pool.get_bedrock_client(
+                    region_name=endpoint_info.deployment_region,
+                    access_key=endpoint_info.access_key,
+                    secret_access_key=endpoint_info.secret_access_key,
+                ),
+            ),
         )
+        return self._with_callback_manager(model)
 
-    def get_azure_llm(self, model_info: sch.AzureModelInfo) -> FunctionCallingLLM:
+    def get_azure_llm(self, model_info: sch.AzureModelInfo, max_tokens: Optional[int] = None) -> FunctionCallingLLM:
         assert model_info.endpoint_info, "Missing endpoint info - the pydantic schema should be validating this"
-        return AzureOpenAI(
-            model=model_info.model_name.value,  # AIModelSchema.GPT4o.value
-            temperature=0,
-            max_tokens=model_info.max_tokens,
-            deployment_name=model_info.endpoint_info.deployment_name,
-            api_key=model_info.endpoint_info.api_key,
-            azure_endpoint=model_info.endpoint_info.endpoint,
-            api_version=model_info.api_version,
-            callback_manager=self.callback_manager,
+        endpoint_info = model_info.endpoint_info
+        max_tokens = max_tokens or model_info.max_tokens
+        key = (
+            AzureOpenAI,
+            endpoint_info.endpoint,
+            endpoint_info.deployment_name,
+            endpoint_info.api_key,
+            model_info.model_name.value,
+            model_info.api_version,
+            max_tokens,
+        )
+        model = ai_client_pool.get_model(
+            key=key,
+            factory=lambda: AzureOpenAI(
+                model=model_info.model_name.value,  # AIModelSchema.GPT4o.value
+                temperature=0,
+                max_tokens=max_tokens,
+                deployment_name=endpoint_info.deployment_name,
+                api_key=endpoint_info.api_key,
+                azure_endpoint=endpoint_info.endpoint,
+                api_version=model_info.api_version,
+                http_client=ai_client_pool.get_http_client(endpoint=endpoint_info.endpoint),
+                async_http_client=ai_client_pool.get_async_http_client(endpoint=endpoint_info.endpoint),
+            ),
         )
+        return self._with_callback_manager(model)
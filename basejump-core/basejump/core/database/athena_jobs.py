@@ -0,0 +1,119 @@
+"""Run Athena queries without blocking the event loop
+
+Athena queries run asynchronously, so the caller has to poll until the query finishes. Polling with aioboto3
+keeps worker threads free while waiting. The delay between polls starts short since DDL usually finishes in
+a second or two and backs off for slower queries.
+"""
+
+import asyncio
+import contextlib
+from typing import Iterator, Optional
+
+import aioboto3
+from basejump.core.common.config.logconfig import set_logging
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+ATHENA_POLL_INITIAL_DELAY = 0.25  # seconds
+ATHENA_POLL_MAX_DELAY = 5  # seconds
+ATHENA_POLL_BACKOFF = 2
+ATHENA_JOB_DEADLINE = 60  # seconds
+ATHENA_FINAL_STATES = ["SUCCEEDED", "FAILED", "CANCELLED"]
+ATHENA_TIMED_OUT = "TIMED_OUT"
+
+
+def get_poll_delays(
+    initial_delay: float = ATHENA_POLL_INITIAL_DELAY,
+    max_delay: float = ATHENA_POLL_MAX_DELAY,
+    backoff: float = ATHENA_POLL_BACKOFF,
+) -> Iterator[float]:
+    """Yield exponentially increasing delays capped at the max delay"""
+    delay = initial_delay
+    while True:
+        yield delay
+        delay = min(delay * backoff, max_delay)
+
+
+class AthenaJobRunner:
+    """Start Athena queries and wait for them to finish
+
+    Parameters
+    ----------
+    output_location
+        The S3 path Athena writes the query results to
+    deadline
+        The max number of seconds to wait for a query. Queries still running after the deadline are stopped.
+    """
+
+    def __init__(
+        self,
+        region: str,
+        access_key: str,
+        secret_access_key: str,
+        output_location: str,
+        deadline: float = ATHENA_JOB_DEADLINE,
+        initial_delay: float = ATHENA_POLL_INITIAL_DELAY,
+        max_delay: float = ATHENA_POLL_MAX_DELAY,
+    ):
+        self.session = aioboto3.Session(
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_access_key,
+            region_name=region,
+        )
+        self.output_location = output_location
+        self.deadline = deadline
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+
+    async def _wait_for_query(self, athena_client, execution_id: str) -> str:
+        for delay in get_poll_delays(initial_delay=self.initial_delay, max_delay=self.max_delay):
+            query_details = await athena_client.get_query_execution(QueryExecutionId=execution_id)
+            query_state = query_details["QueryExecution"]["Status"]["State"]
+            if query_state in ATHENA_FINAL_STATES:
+                if query_state != "SUCCEEDED":
+                    reason = query_details["QueryExecution"]["Status"].get("StateChangeReason")
+                    logger.warning(f"Athena query {execution_id} {query_state}: {reason}")
+                return query_state
+            await asyncio.sleep(delay)
+        raise RuntimeError("Polling ended without a final state")  # pragma: no cover
+
+    async def _run_query(self, athena_client, query: str) -> str:
+        query_execution = await athena_client.start_query_execution(
+            QueryString=query, ResultConfiguration={"OutputLocation": self.output_location}
+        )
+        execution_id = query_execution["QueryExecutionId"]
+        try:
+            async with asyncio.timeout(self.deadline):
+                return await self._wait_for_query(athena_client=athena_client, execution_id=execution_id)
+        except TimeoutError:
+            logger.warning(f"Athena query {execution_id} did not finish after {self.deadline} seconds")
+            with contextlib.suppress(Exception):
+                await athena_client.stop_query_execution(QueryExecutionId=execution_id)
+            return ATHENA_TIMED_OUT
+
+    async def run_query(self, query: str) -> str:
+        """Run a query and return its final state"""
+        return (await self.run_queries(queries=[query]))[0]
+
+    async def run_queries(self, queries: list[str], max_concurrency: Optional[int] = None) -> list[str]:
+        """Run queries concurrently using a single client
+
+        Parameters
+        ----------
+        max_concurrency
+            The max number of queries to run at once. Athena limits the number of concurrent DDL queries
+            per account, so set this for large batches.
+
+        Returns
+        -------
+        query_states
+            The final state of each query in the same order as the queries
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or len(queries) or 1)
+        async with self.session.client("athena") as athena_client:
+
+            async def run_query(query: str) -> str:
+                async with semaphore:
+                    return await self._run_query(athena_client=athena_client, query=query)
+
+            return list(await asyncio.gather(*[run_query(query) for query in queries]))
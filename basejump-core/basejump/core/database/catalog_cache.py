@@ -0,0 +1,188 @@
+"""Per-process cache of the prepared state used to set up the SQL tools for a connection
+
+Setting up the tools for a chat decrypts the connection parameters and loads the tables, columns and
+metadata filters for every connection. This state rarely changes between prompts, so it is cached here.
+
+Entries are tied to a catalog version that is stored in Redis per client so that every process sees a
+change to the catalog. Anything that updates the tables, schemas or index for a client should call
+invalidate_catalog, which bumps the version. Demo tables are indexed under the demo client, so catalog
+entries are also tied to the version of the client that owns the vector index. Entries also expire after a
+TTL to pick up any changes made outside of the hooks, such as tables being ignored.
+"""
+
+import time
+from typing import Optional, Union
+
+from basejump.core.common.config.logconfig import set_logging
+from basejump.core.common.common_utils import hash_value
+from basejump.core.models import models
+from basejump.core.models import schemas as sch
+from llama_index.core.vector_stores import MetadataFilters
+from redis.asyncio import Redis as RedisAsync
+from sqlalchemy import Row
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+CATALOG_CACHE_TTL = 60 * 10  # seconds
+CATALOG_CACHE_MAX_ENTRIES = 1000
+CATALOG_VERSION_PREFIX = "catalog_version:"
+
+
+class CatalogState:
+    """The tables, columns and vector index info prepared for a connection"""
+
+    def __init__(
+        self,
+        vector_uuid,
+        index_name: str,
+        vector_schema: sch.VectorDBSchema,
+        vector_client_id: int,
+        is_demo: bool,
+        all_tables: list[str],
+        ignored_tables: list[str],
+        db_cols: list[sch.DBColumn],
+        ignored_cols: list[sch.DBColumn],
+        filters: MetadataFilters,
+    ):
+        self.vector_uuid = vector_uuid
+        self.index_name = index_name
+        self.vector_schema = vector_schema
+        self.vector_client_id = vector_client_id
+        self.is_demo = is_demo
+        self.all_tables = all_tables
+        self.ignored_tables = ignored_tables
+        self.db_cols = db_cols
+        self.ignored_cols = ignored_cols
+        self.filters = filters
+
+    def copy_columns(self) -> tuple[list[sch.DBColumn], list[sch.DBColumn]]:
+        """Return copies of the columns since the SQL tool updates them while checking queries"""
+        return [col.model_copy() for col in self.db_cols], [col.model_copy() for col in self.ignored_cols]
+
+
+class CacheEntry:
+    def __init__(self, value, version: Union[int, tuple[int, int]] = 0):
+        self.value = value
+        self.version = version
+        self.created_at = time.monotonic()
+
+
+class CatalogCache:
+    """Cache of decrypted connection parameters and catalog state
+
+    Parameters
+    ----------
+    ttl
+        The max number of seconds to keep an entry
+    """
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL, max_entries: int = CATALOG_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn_params: dict[tuple[int, str], CacheEntry] = {}
+        self._catalogs: dict[tuple[int, int, str], CacheEntry] = {}
+
+    @staticmethod
+    def get_version_key(client_id: int) -> str:
+        return CATALOG_VERSION_PREFIX + str(client_id)
+
+    @staticmethod
+    def get_conn_fingerprint(db_conn: Union[models.DBConn, Row], db_params: models.DBParams) -> str:
+        """Hash the encrypted connection parameters so a changed connection never hits the cache"""
+        db_params_bytes = sch.DBParamsBytes.from_orm(db_params)
+        return hash_value(
+            repr(
+                (
+                    db_conn.username,
+                    db_conn.password,
+                    db_conn.schemas,
+                    db_conn.data_source_desc,
+                    sorted(db_params_bytes.dict().items()),
+                )
+            )
+        )
+
+    @staticmethod
+    def get_schemas_fingerprint(schemas: list[sch.DBSchema]) -> str:
+        return hash_value(repr(schemas))
+
+    async def get_version(self, redis_client_async: RedisAsync, client_id: int) -> int:
+        version = await redis_client_async.get(self.get_version_key(client_id=client_id))
+        return int(version) if version else 0
+
+    async def get_catalog_version(
+        self, redis_client_async: RedisAsync, client_id: int, vector_client_id: int
+    ) -> tuple[int, int]:
+        """Get the versions of the client and of the client that owns the vector index in one round trip"""
+        client_version, vector_version = await redis_client_async.mget(
+            [self.get_version_key(client_id=client_id), self.get_version_key(client_id=vector_client_id)]
+        )
+        return int(client_version) if client_version else 0, int(vector_version) if vector_version else 0
+
+    def _is_valid(self, entry: Optional[CacheEntry], version: Union[int, tuple[int, int]] = 0) -> bool:
+        if entry is None:
+            return False
+        return entry.version == version and time.monotonic() - entry.created_at < self.ttl
+
+    def _evict(self, cache: dict) -> None:
+        if len(cache) >= self.max_entries:
+            # Dicts keep insertion order so the first key is the oldest entry
+            del cache[next(iter(cache))]
+
+    def get_conn_params(self, conn_id: int, fingerprint: str) -> Optional[sch.SQLDBSchema]:
+        entry = self._conn_params.get((conn_id, fingerprint))
+        if not self._is_valid(entry):
+            return None
+        return entry.value.model_copy(deep=True)  # type: ignore
+
+    def set_conn_params(self, conn_id: int, fingerprint: str, conn_params: sch.SQLDBSchema) -> None:
+        self._evict(self._conn_params)
+        self._conn_params[(conn_id, fingerprint)] = CacheEntry(value=conn_params.model_copy(deep=True))
+
+    def get_vector_client_id(self, client_id: int, conn_id: int, fingerprint: str) -> int:
+        """Get the ID of the client that owns the vector index from the cached state, even if it has expired
+
+        Defaults to the client itself when the catalog hasn't been cached yet.
+        """
+        entry = self._catalogs.get((client_id, conn_id, fingerprint))
+        return entry.value.vector_client_id if entry else client_id
+
+    def get_catalog(
+        self, client_id: int, conn_id: int, version: tuple[int, int], fingerprint: str
+    ) -> Optional[CatalogState]:
+        entry = self._catalogs.get((client_id, conn_id, fingerprint))
+        if not self._is_valid(entry, version=version):
+            return None
+        return entry.value  # type: ignore
+
+    def set_catalog(
+        self, client_id: int, conn_id: int, version: tuple[int, int], fingerprint: str, catalog_state: CatalogState
+    ) -> None:
+        """Save the catalog state
+
+        Parameters
+        ----------
+        version
+            The catalog versions of the client and the vector client read before the state was loaded so that
+            a concurrent update is not hidden by the cache
+        """
+        self._evict(self._catalogs)
+        self._catalogs[(client_id, conn_id, fingerprint)] = CacheEntry(value=catalog_state, version=version)
+
+    async def invalidate(self, redis_client_async: RedisAsync, client_id: int) -> None:
+        await redis_client_async.incr(self.get_version_key(client_id=client_id))
+        for key in [key for key in self._catalogs if key[0] == client_id]:
+            del self._catalogs[key]
+        logger.debug("Invalidated the catalog cache for client %s", client_id)
+
+
+catalog_cache = CatalogCache()
+
+
+async def invalidate_catalog(redis_client_async: RedisAsync, client_id: int) -> None:
+    """Invalidate the cached catalog state for a client in every process"""
+    try:
+        await catalog_cache.invalidate(redis_client_async=redis_client_async, client_id=client_id)
+    except Exception as e:
+        # The TTL still bounds how long a stale entry can be used
+        logger.error("Error invalidating the catalog cache: %s", str(e))
@@ -15,12 +15,15 @@ from basejump.core.database.token_price import get_token_count_obj
 from basejump.core.database.vector_utils import delete_nodes
 from basejump.core.models import constants, enums, models
 from basejump.core.models import schemas as sch
-from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from llama_index.core.callbacks import CallbackManager
 from llama_index.core.memory import VectorMemory
+from llama_index.core.memory.vector_memory import _stringify_chat_message
+from llama_index.core.schema import TextNode
 from llama_index.core.vector_stores.types import BasePydanticVectorStore
 from redis.asyncio import Redis as RedisAsync
-from sqlalchemy import Row, case, desc, func, select
+from sqlalchemy import Row, case, desc, func, select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = set_logging(handler_option="stream", name=__name__)
@@ -193,38 +196,103 @@ async def save_message(
     logger.debug("Completed saving chat message to DB")
 
 
+async def upsert_messages(
+    db: AsyncSession,
+    messages: list[sch.APIMessage],
+    prompt_metadata: sch.PromptMetadataBase,
+    chat_metadata: sch.ChatMetadata,
+    query_result: sch.MessageQueryResult,
+    msg_in_index: bool = False,
+) -> None:
+    """Save or update many chat messages using a single statement and commit
+
+    This matches save_message, but inserts new messages and updates existing ones in one
+    INSERT ... ON CONFLICT DO UPDATE instead of a select and commit per message.
+    """
+    if not messages:
+        return
+    timestamp = datetime.now(ZoneInfo("UTC"))
+    rows: dict[uuid.UUID, dict] = {}
+    for message in messages:
+        # Each message gets its own timestamp so the history is ordered the same as the messages were added
+        if message.msg_uuid in rows:
+            msg_timestamp = rows[message.msg_uuid]["timestamp"]
+        else:
+            msg_timestamp = timestamp + timedelta(microseconds=len(rows))
+        # Messages can be in the chat history more than once, but a row can only be upserted once per statement
+        rows[message.msg_uuid] = dict(
+            client_id=prompt_metadata.client_id,
+            msg_uuid=message.msg_uuid,
+            msg_in_index=msg_in_index,
+            parent_msg_uuid=chat_metadata.parent_msg_uuid,
+            chat_id=chat_metadata.chat_id,
+            prompt_uuid=prompt_metadata.prompt_uuid,
+            initial_prompt=prompt_metadata.initial_prompt,
+            prompt_time=prompt_metadata.prompt_time,
+            content=message.content,
+            internal_content=add_message_context(
+                content=message.content, timestamp=msg_timestamp.isoformat(), sql_query=query_result.sql_query
+            ),  # BC v0.26.1
+            role=message.role.value if message.role else None,
+            msg_type=message.msg_type.value if message.msg_type else None,
+            sql_query=query_result.sql_query,
+            result_uuid=query_result.result_uuid,
+            visual_result_uuid=query_result.visual_result_uuid,
+            result_type=query_result.result_type.value if query_result.result_type else None,
+            timestamp=msg_timestamp,
+        )
+    stmt = insert(models.ChatHistory).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.ChatHistory.client_id, models.ChatHistory.msg_uuid],
+        set_=dict(
+            content=stmt.excluded.content,
+            msg_type=stmt.excluded.msg_type,
+            internal_content=stmt.excluded.internal_content,
+            sql_query=stmt.excluded.sql_query,
+            result_uuid=stmt.excluded.result_uuid,
+            visual_result_uuid=stmt.excluded.visual_result_uuid,
+            result_type=stmt.excluded.result_type,
+            msg_in_index=stmt.excluded.msg_in_index,
+        ),
+    )
+    await db.execute(stmt)
+    await db.commit()
+    logger.debug("Completed saving %s chat messages to DB", len(rows))
+
+
 async def save_token_counts(
     db: AsyncSession,
     prompt_metadata: sch.PromptMetadata,
 ):
     # NOTE: Using in since the model version can be appended to the end of the model name
-    for token_count in prompt_metadata.token_counter.llm_token_counts:
-        token_count_obj = get_token_count_obj(
-            token_count=token_count, prompt_metadata=prompt_metadata, type_=enums.AIModelType.LLM
-        )
-        token_id = await crud_utils.get_next_val(
-            db=db, full_table_nm=str(models.TokenCount.__table__), column_nm="token_id"
-        )
-        token_count_db = models.TokenCount(token_id=token_id, **token_count_obj.dict())
-        db.add(token_count_db)
-        token_count_assoc = models.TokenUserAssociation(
-            client_id=prompt_metadata.client_id, user_id=prompt_metadata.user_id, token_id=token_id
-        )
-        db.add(token_count_assoc)
-
-    for token_count in prompt_metadata.token_counter.embedding_token_counts:
-        token_count_obj = get_token_count_obj(
+    token_count_objs = [
+        get_token_count_obj(token_count=token_count, prompt_metadata=prompt_metadata, type_=enums.AIModelType.LLM)
+        for token_count in prompt_metadata.token_counter.llm_token_counts
+    ]
+    token_count_objs += [
+        get_token_count_obj(
             token_count=token_count, prompt_metadata=prompt_metadata, type_=enums.AIModelType.EMBEDDING
         )
-        token_id = await crud_utils.get_next_val(
-            db=db, full_table_nm=str(models.TokenCount.__table__), column_nm="token_id"
+        for token_count in prompt_metadata.token_counter.embedding_token_counts
+    ]
+    if token_count_objs:
+        token_ids = await crud_utils.get_next_vals(
+            db=db, full_table_nm=str(models.TokenCount.__table__), column_nm="token_id", count=len(token_count_objs)
+        )
+        await db.execute(
+            insert(models.TokenCount),
+            [
+                dict(token_id=token_id, **token_count_obj.dict())
+                for token_id, token_count_obj in zip(token_ids, token_count_objs)
+            ],
         )
-        token_count_db = models.TokenCount(token_id=token_id, **token_count_obj.dict())
-        db.add(token_count_db)
-        token_count_assoc = models.TokenUserAssociation(
-            client_id=prompt_metadata.client_id, user_id=prompt_metadata.user_id, token_id=token_id
+        await db.execute(
+            insert(models.TokenUserAssociation),
+            [
+                dict(client_id=prompt_metadata.client_id, user_id=prompt_metadata.user_id, token_id=token_id)
+                for token_id in token_ids
+            ],
         )
-        db.add(token_count_assoc)
     await db.commit()
     prompt_metadata.token_counter.reset_counts()
 
@@ -254,9 +322,15 @@ async def get_prompt_history(db: AsyncSession, prompt_uuid: uuid.UUID) -> Option
 async def delete_chat_msgs_from_vector(
     db: AsyncSession, client_id: int, msg_uuids: list[uuid.UUID], redis_client_async: RedisAsync
 ) -> None:
-    chat_history = await get_chat_history_from_msgs(db=db, msg_uuids=msg_uuids)
-    for msg in chat_history:
-        msg.msg_in_index = False
+    if not msg_uuids:
+        return
+    stmt = (
+        update(models.ChatHistory)
+        .where(models.ChatHistory.msg_uuid.in_(msg_uuids))
+        .values(msg_in_index=False)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(stmt)
     await db.commit()
     await delete_nodes(
         client_id=client_id,
@@ -278,20 +352,35 @@ async def get_chat_history_for_chats(
     return [msg.msg_uuid for msg in msgs]
 
 
-async def index_chat_history(
-    db: AsyncSession,
-    client_uuid: uuid.UUID,
-    chat_id: int,
-    chat_uuid: uuid.UUID,
-    vector_id: int,
-    chat_history: list[sch.APIMessage],
-    callback_manager: CallbackManager,
-    vector_store: BasePydanticVectorStore,
-    embedding_model_info: sch.AzureModelInfo,
-) -> None:
+async def get_overflow_msg_uuids(
+    db: AsyncSession, chat_ids: list[int], max_chat_history: int = constants.MAX_CHAT_HISTORY
+) -> list[uuid.UUID]:
+    """Get the UUIDs of the oldest indexed messages beyond the max chat history for each chat"""
+    msg_rank = (
+        select(
+            models.ChatHistory.msg_uuid,
+            func.row_number()
+            .over(partition_by=models.ChatHistory.chat_id, order_by=desc(models.ChatHistory.timestamp))
+            .label("msg_rank"),
+        )
+        .filter(models.ChatHistory.chat_id.in_(chat_ids), models.ChatHistory.msg_in_index.is_(True))
+        .subquery()
+    )
+    stmt = select(msg_rank.c.msg_uuid).filter(msg_rank.c.msg_rank > max_chat_history)
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def get_chat_history_to_index(
+    db: AsyncSession, chat_id: int, chat_history: list[sch.APIMessage]
+) -> list[sch.APIMessage]:
+    """Get the messages to index, including older messages that have not been indexed yet
+
+    The chat is marked as not in the index until mark_chat_messages_indexed is called after the messages are indexed.
+    """
     chat = await get_chat_from_id(db=db, chat_id=chat_id)
     assert chat
-    # Reindex old chats if not in the index
+    # Reindex old messages if the chat has messages that are not in the index
     if not chat.chat_in_index:
         old_chat_hist = []
         limit = constants.MAX_CHAT_HISTORY - len(chat_history)
@@ -303,9 +392,57 @@ async def index_chat_history(
             if str(msg.msg_uuid) not in chat_hist_uuids:
                 old_chat_hist.append(sch.APIMessage.from_orm(msg))
         chat_history = old_chat_hist + chat_history  # Put old chat hist first
-    chat.chat_in_index = True
+    elif chat_history:
+        chat.chat_in_index = False
+        await db.commit()
+    return chat_history
+
+
+async def mark_chat_messages_indexed(db: AsyncSession, chat_id: int, msg_uuids: list[uuid.UUID]) -> None:
+    """Mark messages as indexed and mark the chat as in the index if it has no recent messages left to index
+
+    Only the messages that get_chat_history_to_index would reindex are checked, since trimmed messages are
+    also not in the index.
+    """
+    if msg_uuids:
+        await db.execute(
+            update(models.ChatHistory)
+            .where(models.ChatHistory.chat_id == chat_id, models.ChatHistory.msg_uuid.in_(msg_uuids))
+            .values(msg_in_index=True)
+            .execution_options(synchronize_session=False)
+        )
+    recent_msgs = (
+        select(models.ChatHistory.msg_in_index)
+        .filter(models.ChatHistory.chat_id == chat_id)
+        .order_by(desc(models.ChatHistory.timestamp))
+        .limit(constants.MAX_CHAT_HISTORY)
+        .subquery()
+    )
+    unindexed_msgs = select(recent_msgs.c.msg_in_index).filter(recent_msgs.c.msg_in_index.is_(False)).exists()
+    await db.execute(
+        update(models.Chat)
+        .where(models.Chat.chat_id == chat_id)
+        .values(chat_in_index=~unindexed_msgs)
+        .execution_options(synchronize_session=False)
+    )
     await db.commit()
-    # Add the chats to the vector database
+
+
+async def index_chat_messages(
+    client_uuid: uuid.UUID,
+    chat_uuid: uuid.UUID,
+    chat_history: list[sch.APIMessage],
+    callback_manager: CallbackManager,
+    vector_store: BasePydanticVectorStore,
+    embedding_model_info: sch.AzureModelInfo,
+) -> None:
+    """Add chat messages to the vector database
+
+    Messages are grouped the same way as VectorMemory (a user message followed by its replies) and all groups
+    are embedded in batches and written with a single vector store add.
+    """
+    if not chat_history:
+        return
     ai_catalog = AICatalog(callback_manager=callback_manager)
     vector_memory = VectorMemory.from_defaults(
         vector_store=vector_store,
@@ -313,25 +450,61 @@ async def index_chat_history(
     )
     logger.debug("Using the following chat_uuid %s", chat_uuid)
     logger.debug("Indexing the following chat history: %s", chat_history)
+    # TODO: Update the exclude LLM and exclude embed for chat and client UUIDs
+    metadata = {
+        "chat_uuid": str(chat_uuid),
+        "client_uuid": str(client_uuid),
+        "vector_type": enums.VectorSourceType.CHAT.value,
+    }
+    nodes: list[TextNode] = []
     for chat_msg in chat_history:
-        idx_msg = copy.deepcopy(chat_msg)
-        idx_msg.content = add_message_context(
-            content=idx_msg.content,
-            sql_query=idx_msg.sql_query,
-            timestamp=idx_msg.timestamp,
-            result_uuid=idx_msg.result_uuid,
-            visual_json=idx_msg.visual_json,
-        )
-        # TODO: Update the exclude LLM and exclude embed for chat and client UUIDs
-        await vector_memory.async_put(
-            ChatMessage(content=idx_msg.content, timestamp=idx_msg.timestamp, role=idx_msg.role),
-            {
-                "chat_uuid": str(chat_uuid),
-                "client_uuid": str(client_uuid),
-                "vector_type": enums.VectorSourceType.CHAT.value,
-            },
-            str(idx_msg.msg_uuid),
+        content = add_message_context(
+            content=chat_msg.content,
+            sql_query=chat_msg.sql_query,
+            timestamp=chat_msg.timestamp,
+            result_uuid=chat_msg.result_uuid,
+            visual_json=chat_msg.visual_json,
         )
+        chat_message = ChatMessage(content=content, timestamp=chat_msg.timestamp, role=chat_msg.role)
+        if not nodes or chat_message.role in [MessageRole.USER, MessageRole.SYSTEM]:
+            nodes.append(
+                TextNode(
+                    id_=str(chat_msg.msg_uuid),
+                    text=content,
+                    metadata={"sub_dicts": [], **metadata},
+                    excluded_embed_metadata_keys=["sub_dicts"],
+                    excluded_llm_metadata_keys=["sub_dicts"],
+                )
+            )
+        else:
+            nodes[-1].text += " " + content
+        nodes[-1].metadata["sub_dicts"].append(_stringify_chat_message(chat_message))
+    # Replace any prior versions of the nodes
+    await vector_memory.vector_index.adelete_nodes([node.id_ for node in nodes])
+    await vector_memory.vector_index.ainsert_nodes(nodes)
+
+
+async def index_chat_history(
+    db: AsyncSession,
+    client_uuid: uuid.UUID,
+    chat_id: int,
+    chat_uuid: uuid.UUID,
+    vector_id: int,
+    chat_history: list[sch.APIMessage],
+    callback_manager: CallbackManager,
+    vector_store: BasePydanticVectorStore,
+    embedding_model_info: sch.AzureModelInfo,
+) -> None:
+    chat_history = await get_chat_history_to_index(db=db, chat_id=chat_id, chat_history=chat_history)
+    await index_chat_messages(
+        client_uuid=client_uuid,
+        chat_uuid=chat_uuid,
+        chat_history=chat_history,
+        callback_manager=callback_manager,
+        vector_store=vector_store,
+        embedding_model_info=embedding_model_info,
+    )
+    await mark_chat_messages_indexed(db=db, chat_id=chat_id, msg_uuids=[msg.msg_uuid for msg in chat_history])
 
 
 async def get_initial_prompt_for_result(db: AsyncSession, result_uuid: uuid.UUID):
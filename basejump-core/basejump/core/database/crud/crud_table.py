@@ -9,12 +9,13 @@ from basejump.core.database.db_connect import TableManager
 from basejump.core.models import constants
 from basejump.core.models import schemas as sch
 from basejump.core.models.models import (
+    Base,
     ConnTableAssociation,
     DBConn,
     DBTableColumns,
     DBTables,
 )
-from sqlalchemy import Row, func, select
+from sqlalchemy import Row, func, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import load_only, selectinload
 
@@ -136,43 +137,69 @@ async def upload_table_names(
         raise AssertionError(constants.NO_TABLES)
 
     found_permitted_table = False
+    existing_tables = {}
+    if update_only:
+        retrieved_tables = await get_tables_from_nms(
+            db=db, table_names=[table.full_table_name for table in tables], db_id=db_id
+        )
+        existing_tables = {retrieved_table.table_name: retrieved_table for retrieved_table in retrieved_tables}
+    new_tables = [table for table in tables if table.full_table_name not in existing_tables]
+    # Reserve all of the table IDs at once so the tables, associations and columns can be bulk inserted
+    tbl_ids = await crud_utils.get_next_vals(
+        db=db, full_table_nm=str(DBTables.__table__), column_nm="tbl_id", count=len(new_tables)
+    )
+    # The new tables are visited in the same order below. Taking the IDs in order gives duplicate table names their
+    # own IDs, the same as inserting them one at a time.
+    new_tbl_ids = iter(tbl_ids)
+    table_rows = []
+    conn_table_rows = []
+    column_rows = []
     for table in tables:
         logger.debug("Table name: %s", table.full_table_name)
-        if update_only:
-            retrieved_tables = await get_tables_from_nms(db=db, table_names=[table.full_table_name], db_id=db_id)
-            retrieved_table = retrieved_tables[0]
+        if table.full_table_name in existing_tables:
+            retrieved_table = existing_tables[table.full_table_name]
             tbl_id = retrieved_table.tbl_id
+            table.tbl_uuid = table.tbl_uuid or retrieved_table.tbl_uuid
+            columns = [column for column in table.columns if column.new]
         else:
-            tbl_id = await crud_utils.get_next_val(db=db, full_table_nm=str(DBTables.__table__), column_nm="tbl_id")
-            sql_table = DBTables(
-                tbl_id=tbl_id,
-                tbl_uuid=uuid.uuid4(),
-                db_id=db_id,
-                client_id=client_id,
-                table_name=table.full_table_name,
-                context=table.context_str,
+            tbl_id = next(new_tbl_ids)
+            table.tbl_uuid = uuid.uuid4()
+            table_rows.append(
+                dict(
+                    tbl_id=tbl_id,
+                    tbl_uuid=table.tbl_uuid,
+                    db_id=db_id,
+                    client_id=client_id,
+                    table_name=table.full_table_name,
+                    context=table.context_str,
+                )
             )
-            db.add(sql_table)
-            table.tbl_uuid = sql_table.tbl_uuid
             if permitted_tables_dict.get(table.full_table_name.lower()):
                 found_permitted_table = True
-                conn_table = ConnTableAssociation(client_id=client_id, conn_id=conn_id, tbl_id=tbl_id)
-                db.add(conn_table)
-        for column in table.columns:
-            if update_only and not column.new:
-                continue
-        for column in table.columns:
-            table_cols = DBTableColumns(
-                client_id=client_id,
-                tbl_id=tbl_id,
-                column_name=column.column_name,
-                column_type=column.column_type,
-                description=column.description,
-                foreign_key_column_name=column.foreign_key_column_name,
-                foreign_key_table_name=column.foreign_key_table_name,
-                quoted=column.quoted,
+                conn_table_rows.append(dict(client_id=client_id, conn_id=conn_id, tbl_id=tbl_id))
+            columns = table.columns
+        for column in columns:
+            column_rows.append(
+                dict(
+                    client_id=client_id,
+                    tbl_id=tbl_id,
+                    column_name=column.column_name,
+                    column_type=column.column_type,
+                    description=column.description,
+                    foreign_key_column_name=column.foreign_key_column_name,
+                    foreign_key_table_name=column.foreign_key_table_name,
+                    quoted=column.quoted,
+                )
             )
-            db.add(table_cols)
+    # Insert the tables before the rows that reference them
+    inserts: list[tuple[type[Base], list[dict]]] = [
+        (DBTables, table_rows),
+        (ConnTableAssociation, conn_table_rows),
+        (DBTableColumns, column_rows),
+    ]
+    for model, rows in inserts:
+        if rows:
+            await db.execute(insert(model), rows)
     await db.commit()
     try:
         assert found_permitted_table
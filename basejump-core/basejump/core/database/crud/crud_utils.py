@@ -15,16 +15,35 @@ from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
-async def get_next_val(db: AsyncSession, full_table_nm: str, column_nm: str):
-    """Get the next value in a sequence to avoid having to commit and refresh the table"""
+async def get_table_seq(db: AsyncSession, full_table_nm: str, column_nm: str) -> str:
     table_seq_base = await db.execute(sa.text(f"SELECT pg_get_serial_sequence('{full_table_nm}', '{column_nm}');"))
     table_seq = table_seq_base.scalar()
     if not table_seq:
         table_seq = f"{full_table_nm}_{column_nm}_seq"
+    return table_seq
+
+
+async def get_next_val(db: AsyncSession, full_table_nm: str, column_nm: str):
+    """Get the next value in a sequence to avoid having to commit and refresh the table"""
+    table_seq = await get_table_seq(db=db, full_table_nm=full_table_nm, column_nm=column_nm)
     next_val_base = await db.execute(sa.text(f"SELECT nextval('{table_seq}')"))
     return next_val_base.scalar()
 
 
+async def get_next_vals(db: AsyncSession, full_table_nm: str, column_nm: str, count: int) -> list[int]:
+    """Reserve a block of values in a sequence using a single query
+
+    Use this instead of get_next_val when inserting many rows so the IDs can be set before a bulk insert
+    """
+    if count <= 0:
+        return []
+    table_seq = await get_table_seq(db=db, full_table_nm=full_table_nm, column_nm=column_nm)
+    next_vals = await db.execute(
+        sa.text(f"SELECT nextval('{table_seq}') FROM generate_series(1, :count)"), {"count": count}
+    )
+    return list(next_vals.scalars().all())
+
+
 def create_callback_mgrs() -> sch.CallbackMgrs:
     """
     Set up callback manager scoped to this specific conversation
@@ -37,6 +37,17 @@ from sqlalchemy.pool import NullPool
 from sqlalchemy.sql.elements import quoted_name
 
 TABLE_PROFILING_TIME_LIMIT = 60 * 3
+COMPACT_TYPE_ABBREVIATIONS = {
+    "character varying": "varchar",
+    "timestamp without time zone": "timestamp",
+    "timestamp with time zone": "timestamptz",
+    "time without time zone": "time",
+    "time with time zone": "timetz",
+    "double precision": "double",
+    "integer": "int",
+    "boolean": "bool",
+    "character": "char",
+}
 
 # Set constants
 logger = set_logging(handler_option="stream", name=__name__)
@@ -233,7 +244,7 @@ selection is not supported."""
         return table
 
     @staticmethod
-    def format_table_info(table: sch.SQLTable) -> str:
+    def format_table_info(table: sch.SQLTable, schema_format: enums.SchemaFormat = enums.SchemaFormat.YAML) -> str:
         # Create a dictionary
         table_dict = table.dict(exclude_none=True, exclude_defaults=True, exclude={"primary_key"})
         # NOTE: Calling this description instead. Don't want to add if it doesn't exist
@@ -258,6 +269,12 @@ selection is not supported."""
             logger.debug("No primary keys defined for table")
         # Have columns go last
         table_dict["columns"] = table_dict.pop("columns", None)
+        if schema_format == enums.SchemaFormat.COMPACT:
+            return TableManager.format_compact_table_info(table_dict=table_dict)
+        return TableManager.dump_table_info(table_dict=table_dict)
+
+    @staticmethod
+    def dump_table_info(table_dict: dict) -> str:
         # Create a YAML instance
         yaml = ruamel.yaml.YAML()
         # Dump to a string with block style
@@ -269,6 +286,88 @@ selection is not supported."""
         table_info = stream.getvalue()
         return table_info
 
+    @staticmethod
+    def load_table_info(table_info: str) -> Optional[dict]:
+        """Load table info saved as YAML, returning None if it can't be parsed"""
+        try:
+            table_dict = ruamel.yaml.YAML(typ="safe").load(table_info)
+            assert isinstance(table_dict, dict) and "table_name" in table_dict
+        except Exception as e:
+            logger.warning("Unable to load the table info: %s", str(e))
+            return None
+        return table_dict
+
+    @staticmethod
+    def prune_table_info(table_dict: dict, column_names: list[str]) -> str:
+        """Only keep the given columns along with any key columns in the table info
+
+        Parameters
+        ----------
+        table_dict
+            The table info loaded with load_table_info
+        column_names
+            The names of the columns relevant to the inquiry
+        """
+        keep_columns = set(column_names) | set(str(key) for key in table_dict.get("primary_keys") or [])
+        columns = [
+            column
+            for column in table_dict.get("columns") or []
+            if column["column_name"] in keep_columns
+            or column.get("primary_key")
+            or column.get("foreign_key_table_name")
+        ]
+        return TableManager.dump_table_info(table_dict={**table_dict, "columns": columns})
+
+    @staticmethod
+    def abbreviate_column_type(column_type: str) -> str:
+        column_type = column_type.lower().split(" collate ")[0].strip()
+        for long_type, short_type in COMPACT_TYPE_ABBREVIATIONS.items():
+            if column_type.startswith(long_type):
+                return short_type + column_type[len(long_type) :]
+        return column_type
+
+    @staticmethod
+    def format_compact_table_info(table_dict: dict) -> str:
+        """Format the table info with one line per column
+
+        Uses far fewer tokens than YAML. Columns are formatted as:
+        name type [PK] [-> fk_table.fk_column] [values: a|b] [-- description]
+
+        Ignored columns are left out since they can't be used in queries.
+        """
+
+        def clean(text) -> str:
+            return " ".join(str(text).split())
+
+        table_line = f"table {table_dict['table_name']}"
+        if table_dict.get("description"):
+            table_line += f" -- {clean(table_dict['description'])}"
+        lines = [table_line]
+        columns = [column for column in table_dict.get("columns") or [] if not column.get("ignore")]
+        if table_dict.get("primary_keys") and not any(column.get("primary_key") for column in columns):
+            lines.append(f"pk {', '.join(str(key) for key in table_dict['primary_keys'])}")
+        for column in columns:
+            column_name = f'"{column["column_name"]}"' if column.get("quoted") else column["column_name"]
+            column_line = f"{column_name} {TableManager.abbreviate_column_type(str(column.get('column_type', '')))}"
+            if column.get("primary_key"):
+                column_line += " PK"
+            if column.get("foreign_key_table_name"):
+                column_line += f" -> {column['foreign_key_table_name']}.{column.get('foreign_key_column_name', '')}"
+            if column.get("distinct_values"):
+                column_line += f" values: {'|'.join(clean(value) for value in column['distinct_values'])}"
+            if column.get("description"):
+                column_line += f" -- {clean(column['description'])}"
+            lines.append(column_line)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def compact_table_info(table_info: str) -> str:
+        """Convert table info saved as YAML to the compact format"""
+        table_dict = TableManager.load_table_info(table_info=table_info)
+        if not table_dict:
+            return table_info
+        return TableManager.format_compact_table_info(table_dict=table_dict)
+
     def is_column_case_sensitive(self, column_name):
         """
         Determines if a column name is case sensitive in Snowflake.
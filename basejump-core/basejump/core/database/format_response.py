@@ -1,8 +1,8 @@
-import copy
 from typing import Optional, Type
 
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.database.aicatalog import AICatalog
+from basejump.core.database.response_cache import LLMResponseCache
 from basejump.core.models import pydantic_ai_formats as fmt
 from basejump.core.models import schemas as sch
 from llama_index.core import ChatPromptTemplate
@@ -22,12 +22,14 @@ class JSONResponseFormatter:
         small_model_info: sch.ModelInfo,
         max_tokens: int = 500,
         llm: Optional[LLM] = None,
+        response_cache: Optional[LLMResponseCache] = None,
     ):
         self.response = response
         self.pydantic_format = pydantic_format
         self.max_tokens = max_tokens
         self.llm = llm
         self.small_model_info = small_model_info
+        self.response_cache = response_cache
 
     @property
     def feedback_template(self):
@@ -46,10 +48,8 @@ class JSONResponseFormatter:
 
     def _format_json_response(self):
         if not self.llm:
-            my_small_model_info = copy.deepcopy(self.small_model_info)
-            my_small_model_info.max_tokens = self.max_tokens
             ai_catalog = AICatalog()
-            self.llm = ai_catalog.get_llm(model_info=my_small_model_info)
+            self.llm = ai_catalog.get_llm(model_info=self.small_model_info, max_tokens=self.max_tokens)
         program = OpenAIPydanticProgram.from_defaults(
             output_cls=self.pydantic_format,
             llm=self.llm,
@@ -57,13 +57,43 @@ class JSONResponseFormatter:
         )
         return program
 
+    def _get_cache_key(self) -> Optional[str]:
+        """Get the response cache key if the response can be cached"""
+        assert self.llm
+        # Only deterministic calls are cached
+        if not self.response_cache or getattr(self.llm, "temperature", None) != 0:
+            return None
+        return self.response_cache.get_key(
+            model_name=self.llm.metadata.model_name,
+            pydantic_format=self.pydantic_format,
+            messages=self.feedback_template.format_messages(response=self.response),
+        )
+
     def format_sync(self):
         program = self._format_json_response()
-        return program(response=self.response)
+        cache_key = self._get_cache_key()
+        if cache_key:
+            assert self.response_cache
+            cached_response = self.response_cache.get(key=cache_key, pydantic_format=self.pydantic_format)
+            if cached_response:
+                return cached_response
+        extract = program(response=self.response)
+        if cache_key:
+            self.response_cache.set(key=cache_key, value=extract)  # type: ignore
+        return extract
 
     async def format(self):
         program = self._format_json_response()
-        return await program.acall(response=self.response)
+        cache_key = self._get_cache_key()
+        if cache_key:
+            assert self.response_cache
+            cached_response = await self.response_cache.aget(key=cache_key, pydantic_format=self.pydantic_format)
+            if cached_response:
+                return cached_response
+        extract = await program.acall(response=self.response)
+        if cache_key:
+            await self.response_cache.aset(key=cache_key, value=extract)  # type: ignore
+        return extract
 
     # TODO: Some of these params can be simplified into classes
     # TODO: Replace this with composition - pass in an agent
@@ -77,6 +107,7 @@ class DateFormatter(JSONResponseFormatter):
         small_model_info: sch.ModelInfo,
         max_tokens: int = 500,
         llm: Optional[LLM] = None,
+        response_cache: Optional[LLMResponseCache] = None,
     ):
         super().__init__(
             response=response,
@@ -84,6 +115,7 @@ class DateFormatter(JSONResponseFormatter):
             max_tokens=max_tokens,
             small_model_info=small_model_info,
             llm=llm,
+            response_cache=response_cache,
         )
 
     @property
@@ -108,6 +140,7 @@ async def get_title_description(
     sql_query: str,
     query_result: str,
     small_model_info: sch.ModelInfo,
+    response_cache: Optional[LLMResponseCache] = None,
 ) -> fmt.DescriptionFormat:
     prompt = f"""\
 Summarize the following query results into a title and description. \
@@ -118,6 +151,9 @@ SQL Query: {sql_query}\n
 SQL Results: {query_result}\n
     """
     format_json_response = JSONResponseFormatter(
-        response=prompt, pydantic_format=fmt.DescriptionFormat, small_model_info=small_model_info
+        response=prompt,
+        pydantic_format=fmt.DescriptionFormat,
+        small_model_info=small_model_info,
+        response_cache=response_cache,
     )
     return await format_json_response.format()
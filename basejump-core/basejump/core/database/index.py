@@ -7,6 +7,7 @@ from typing import Optional
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.database import db_utils
 from basejump.core.database.aicatalog import AICatalog
+from basejump.core.database.catalog_cache import invalidate_catalog
 from basejump.core.database.crud import crud_connection, crud_table
 from basejump.core.database.db_connect import LocalSession, TableManager
 from basejump.core.database.vector_utils import get_index_name
@@ -33,6 +34,7 @@ class DBTableIndexer:
         index_name: Optional[str] = None,
         vector_uuid: Optional[uuid.UUID] = None,
         vector_database_vendor: enums.VectorVendorType = enums.VectorVendorType.REDIS,  # noqa
+        index_columns: bool = True,
     ):
         # Setup variables
         self.client_id = client_id
@@ -44,6 +46,11 @@ class DBTableIndexer:
         self.vector_database_vendor = vector_database_vendor
         self.vector_datasource_type = enums.VectorSourceType.TABLE
         self.index_name = get_index_name(client_id=self.client_id) if not index_name else index_name
+        self.index_columns = index_columns
+
+    @staticmethod
+    def get_column_node_id(table: sch.SQLTable, column: sch.SQLTableColumn) -> str:
+        return str(uuid.uuid5(table.tbl_uuid, column.column_name))  # type: ignore
 
     async def to_nodes_from_tables(self, tables: list[sch.SQLTable]) -> list[TextNode]:
         # Originally taken from the llama_index table_node_mapping.py module
@@ -74,6 +81,34 @@ class DBTableIndexer:
             nodes.append(node)
         return nodes
 
+    async def to_column_nodes_from_tables(self, tables: list[sch.SQLTable]) -> list[TextNode]:
+        """Create a node for each column of the wide tables so they can be pruned to the relevant columns"""
+        nodes = []
+        for table in tables:
+            if table.ignore or not table.tbl_uuid or len(table.columns) <= constants.WIDE_TABLE_COLUMN_CT:
+                continue
+            for column in table.columns:
+                if column.ignore:
+                    continue
+                column_text = f"Column {column.column_name} ({column.column_type}) of table {table.full_table_name}"
+                if column.description:
+                    column_text += f": {column.description}"
+                node = TextNode(
+                    text=column_text,
+                    metadata={
+                        "name": table.full_table_name,
+                        "column_name": column.column_name,
+                        "client_uuid": str(self.client_uuid),
+                        "db_uuid": str(self.db_uuid),
+                        "vector_type": enums.VectorSourceType.COLUMN.value,
+                    },
+                    excluded_embed_metadata_keys=["name", "column_name", "client_uuid", "db_uuid", "vector_type"],
+                    excluded_llm_metadata_keys=["client_uuid", "db_uuid", "vector_type"],
+                )
+                node.id_ = self.get_column_node_id(table=table, column=column)
+                nodes.append(node)
+        return nodes
+
     async def create_index(self, tables: list[sch.SQLTable], redis_client_async: RedisAsync) -> None:
         """Creating and update use the same process, this function is simply here for completeness or
         those looking for a create index function"""
@@ -94,6 +129,15 @@ class DBTableIndexer:
         embed_model = ai_catalog.get_embedding_model(model_info=self.embedding_model_info)
         for node in nodes:
             node.embedding = await embed_model.aget_text_embedding(node.get_content(metadata_mode=MetadataMode.EMBED))
+        if self.index_columns:
+            logger.debug("Creating column node embeddings...")
+            column_nodes = await self.to_column_nodes_from_tables(tables)
+            embeddings = await embed_model.aget_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in column_nodes]
+            )
+            for node, embedding in zip(column_nodes, embeddings):
+                node.embedding = embedding
+            nodes += column_nodes
         await self._update_index(nodes=list(nodes), tables=tables, redis_client_async=redis_client_async)
 
     async def _update_index(
@@ -115,8 +159,15 @@ class DBTableIndexer:
         vector_store = RedisVectorStore(redis_client_async=redis_client_async, schema=schema, legacy_filters=True)
         logger.debug("Deleting overlapping nodes for %s documents...", len(nodes))
         update_nodes_error = False
+        # Include every column so columns that are now ignored or no longer indexed are removed
+        column_node_ids = [
+            self.get_column_node_id(table=table, column=column)
+            for table in tables
+            if table.tbl_uuid
+            for column in table.columns
+        ]
         try:
-            await vector_store.adelete_nodes(node_ids=[node.node_id for node in nodes])
+            await vector_store.adelete_nodes(node_ids=list({node.node_id for node in nodes} | set(column_node_ids)))
         except Exception as e:
             logger.warning("Deleting threw error: %s", e)
             update_nodes_error = True
@@ -130,6 +181,8 @@ class DBTableIndexer:
         except Exception as e:
             logger.error("Error inn _update_index %s", str(e))
             update_nodes_error = True
+        # Retrieval results cached for the index are now stale
+        await invalidate_catalog(redis_client_async=redis_client_async, client_id=self.client_id)
         if update_nodes_error:
             # TODO: This seems backwards, the hash key should likely be provided first
             await redis_client_async.hset(  # type: ignore
@@ -340,3 +393,4 @@ class IndexUpdater:
                     new_tables=new_tables,
                     db_id=self.db_id,
                 )
+        await invalidate_catalog(redis_client_async=redis_client_async, client_id=self.client_user.client_id)
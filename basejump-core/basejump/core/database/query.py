@@ -7,6 +7,7 @@ import sqlalchemy as sa
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.database import upload
 from basejump.core.database.db_connect import ConnectDB, TableManager
+from basejump.core.models import enums
 from basejump.core.models import schemas as sch
 from sqlalchemy.engine import Engine, Row
 from sqlglot import exp, parse_one
@@ -87,6 +88,7 @@ class ClientQueryManager:
             initial_prompt=initial_prompt,
             client_id=client_id,
             small_model_info=small_model_info,
+            database_type=self.client_conn_params.database_type,
         )  # type: ignore
 
     async def run_client_query(self) -> sch.QueryResultDF:
@@ -126,6 +128,7 @@ def run_client_query_sync_and_upload(
     small_model_info: sch.ModelInfo,
     client_id: int,
     result_uuid: Optional[uuid.UUID] = None,
+    database_type: Optional[enums.DatabaseType] = None,
 ) -> sch.QueryResult:
     # TODO: Parse and parameterize this SQL query
     # NOTE: This needs to stay as connect so no DDL statements get committed
@@ -139,6 +142,7 @@ def run_client_query_sync_and_upload(
                 initial_prompt=initial_prompt,
                 client_id=client_id,
                 small_model_info=small_model_info,
+                database_type=database_type,
             )
         except Exception as e:
             logger.error("Error in run_client_query_sync_and_upload %s", str(e))
@@ -0,0 +1,129 @@
+"""Redis cache for structured LLM responses
+
+Formatting calls use temperature 0 and a fixed prompt template, so the same input returns the same
+output. The cache is off by default. Set the LLM_RESPONSE_CACHE environment variable to true to use it.
+"""
+
+import json
+import os
+from typing import Optional, Type
+
+from basejump.core.common.common_utils import hash_value
+from basejump.core.common.config.logconfig import set_logging
+from llama_index.core.llms import ChatMessage
+from pydantic import BaseModel, ValidationError
+from redis import Redis
+from redis.asyncio import Redis as RedisAsync
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+RESPONSE_CACHE_ENV_VAR = "LLM_RESPONSE_CACHE"
+RESPONSE_CACHE_PREFIX = "llm_response:"
+RESPONSE_CACHE_TTL = 60 * 60 * 24  # seconds
+RESPONSE_CACHE_MAX_PROMPT_CHARS = 20000  # Skip caching large prompts since they rarely repeat
+RESPONSE_CACHE_MAX_VALUE_BYTES = 64 * 1024
+
+
+class LLMResponseCache:
+    """Cache pydantic responses from the LLM in Redis
+
+    Parameters
+    ----------
+    redis_client_async
+        The client used by JSONResponseFormatter.format
+    redis_client
+        The client used by JSONResponseFormatter.format_sync
+    """
+
+    def __init__(
+        self,
+        redis_client_async: Optional[RedisAsync] = None,
+        redis_client: Optional[Redis] = None,
+        ttl: int = RESPONSE_CACHE_TTL,
+        max_prompt_chars: int = RESPONSE_CACHE_MAX_PROMPT_CHARS,
+        max_value_bytes: int = RESPONSE_CACHE_MAX_VALUE_BYTES,
+    ):
+        self.redis_client_async = redis_client_async
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.max_prompt_chars = max_prompt_chars
+        self.max_value_bytes = max_value_bytes
+
+    def get_key(self, model_name: str, pydantic_format: Type[BaseModel], messages: list[ChatMessage]) -> Optional[str]:
+        """Get the cache key for the prompt or None if the prompt shouldn't be cached"""
+        prompt = "\n".join(f"{message.role.value}: {message.content}" for message in messages)
+        if len(prompt) > self.max_prompt_chars:
+            return None
+        # Include the schema so changes to the format don't return stale responses
+        format_hash = hash_value(json.dumps(pydantic_format.model_json_schema(), sort_keys=True))
+        return (
+            f"{RESPONSE_CACHE_PREFIX}{model_name}:{pydantic_format.__name__}:{format_hash[:16]}:{hash_value(prompt)}"
+        )
+
+    def _parse(self, key: str, value: Optional[bytes], pydantic_format: Type[BaseModel]) -> Optional[BaseModel]:
+        if not value:
+            return None
+        try:
+            response = pydantic_format.model_validate_json(value)
+        except ValidationError:
+            logger.warning("Ignoring an invalid cached response for %s", key)
+            return None
+        logger.debug("LLM response cache hit for %s", key)
+        return response
+
+    def _serialize(self, value: BaseModel) -> Optional[str]:
+        serialized = value.model_dump_json()
+        if len(serialized.encode("UTF-8")) > self.max_value_bytes:
+            return None
+        return serialized
+
+    async def aget(self, key: str, pydantic_format: Type[BaseModel]) -> Optional[BaseModel]:
+        if not self.redis_client_async:
+            return None
+        try:
+            value = await self.redis_client_async.get(key)
+        except Exception as e:
+            logger.warning("Error reading the LLM response cache: %s", str(e))
+            return None
+        return self._parse(key=key, value=value, pydantic_format=pydantic_format)
+
+    async def aset(self, key: str, value: BaseModel) -> None:
+        serialized = self._serialize(value=value)
+        if not self.redis_client_async or not serialized:
+            return
+        try:
+            await self.redis_client_async.set(key, serialized, ex=self.ttl)
+        except Exception as e:
+            logger.warning("Error writing to the LLM response cache: %s", str(e))
+
+    def get(self, key: str, pydantic_format: Type[BaseModel]) -> Optional[BaseModel]:
+        if not self.redis_client:
+            return None
+        try:
+            value = self.redis_client.get(key)
+        except Exception as e:
+            logger.warning("Error reading the LLM response cache: %s", str(e))
+            return None
+        return self._parse(key=key, value=value, pydantic_format=pydantic_format)  # type: ignore
+
+    def set(self, key: str, value: BaseModel) -> None:
+        serialized = self._serialize(value=value)
+        if not self.redis_client or not serialized:
+            return
+        try:
+            self.redis_client.set(key, serialized, ex=self.ttl)
+        except Exception as e:
+            logger.warning("Error writing to the LLM response cache: %s", str(e))
+
+
+def response_cache_enabled() -> bool:
+    return os.environ.get(RESPONSE_CACHE_ENV_VAR, "false").strip().lower() in ("1", "true", "yes")
+
+
+def get_response_cache(
+    redis_client_async: Optional[RedisAsync] = None, redis_client: Optional[Redis] = None
+) -> Optional[LLMResponseCache]:
+    """Get the response cache or None if it isn't enabled"""
+    if not response_cache_enabled():
+        return None
+    return LLMResponseCache(redis_client_async=redis_client_async, redis_client=redis_client)
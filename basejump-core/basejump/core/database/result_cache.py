@@ -0,0 +1,89 @@
+"""Per-process cache of recent query results
+
+The visualization tool usually plots a result seconds after the SQL tool uploaded it in the same process.
+The uploader keeps a copy of small results here so the plot doesn't need to download them from S3.
+Results are kept as the uploaded CSV bytes so they are parsed exactly the same way as the S3 file.
+"""
+
+import io
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import pandas as pd
+from basejump.core.common.config.logconfig import set_logging
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_MAX_ENTRY_BYTES = 5 * 1024 * 1024  # Larger results aren't plotted
+RESULT_CACHE_TTL = 60 * 15  # seconds
+
+
+class CachedResult:
+    def __init__(self, result_file_path: str, csv_bytes: bytes):
+        self.result_file_path = result_file_path
+        self.csv_bytes = csv_bytes
+        self.created_at = time.monotonic()
+
+
+class ResultCache:
+    """Bounded LRU of result CSVs keyed by result UUID
+
+    Parameters
+    ----------
+    max_bytes
+        The max total size of the cached results. The least recently used results are dropped first.
+    max_entry_bytes
+        Results larger than this are not cached
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES,
+        ttl: float = RESULT_CACHE_TTL,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self._results: OrderedDict[uuid.UUID, CachedResult] = OrderedDict()
+        # The uploader runs in worker threads
+        self._lock = threading.Lock()
+
+    def _pop(self, result_uuid: uuid.UUID) -> None:
+        cached_result = self._results.pop(result_uuid, None)
+        if cached_result:
+            self.total_bytes -= len(cached_result.csv_bytes)
+
+    def set(self, result_uuid: uuid.UUID, result_file_path: str, csv_bytes: bytes) -> None:
+        with self._lock:
+            self._pop(result_uuid)
+            if len(csv_bytes) > self.max_entry_bytes:
+                return
+            self._results[result_uuid] = CachedResult(result_file_path=result_file_path, csv_bytes=csv_bytes)
+            self.total_bytes += len(csv_bytes)
+            while self.total_bytes > self.max_bytes:
+                self._pop(next(iter(self._results)))
+
+    def get(self, result_uuid: uuid.UUID, result_file_path: str) -> Optional[pd.DataFrame]:
+        """Get the result as a DataFrame if it was recently uploaded to the same file path"""
+        with self._lock:
+            cached_result = self._results.get(result_uuid)
+            if not cached_result:
+                return None
+            if (
+                cached_result.result_file_path != result_file_path
+                or time.monotonic() - cached_result.created_at >= self.ttl
+            ):
+                self._pop(result_uuid)
+                return None
+            self._results.move_to_end(result_uuid)
+        logger.debug("Result cache hit for %s", str(result_uuid))
+        return pd.read_csv(io.BytesIO(cached_result.csv_bytes))
+
+
+result_cache = ResultCache()
@@ -0,0 +1,364 @@
+"""Where query results are saved
+
+Results are saved to the storage connection of the client, which is either an S3 bucket or a directory on
+the local filesystem for single node deployments and tests. The uploader writes results through the
+ResultStore interface, which follows the S3 multipart upload API so that large results are written in parts.
+"""
+
+import contextlib
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Iterator, Optional
+
+from basejump.core.common.config.logconfig import set_logging
+from basejump.core.models import enums
+from botocore.exceptions import ClientError
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+S3_PREFIX = "s3://"
+PREVIEW_SUFFIX = "_preview"
+ROW_INDEX_SUFFIX = "_row_index"
+LOCAL_RESULT_STORE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+LOCAL_MULTIPART_DIR = ".multipart"
+LOCAL_STREAM_CHUNK_BYTES = 1024 * 1024
+
+# Local stores share the usage of their directory since a store is created for each upload and uploads run in
+# worker threads
+_local_eviction_lock = threading.Lock()
+
+
+class ResultStore(ABC):
+    """Save and read result files by key"""
+
+    storage_provider: enums.StorageProvider
+
+    @abstractmethod
+    def get_file_path(self, key: str) -> str:
+        """Get the path that is saved with the result and used to read it later"""
+        pass
+
+    @abstractmethod
+    def upload_fileobj(self, fileobj, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def put_object(self, key: str, body: bytes, content_type: Optional[str] = None) -> None:
+        pass
+
+    @abstractmethod
+    def create_multipart_upload(self, key: str, content_type: Optional[str] = None) -> str:
+        """Start a multipart upload and return its ID"""
+        pass
+
+    @abstractmethod
+    def upload_part(self, key: str, upload_id: str, part_number: int, body) -> str:
+        """Upload a part and return its ETag"""
+        pass
+
+    @abstractmethod
+    def complete_multipart_upload(self, key: str, upload_id: str, etags: list[str]) -> None:
+        """Combine the parts in the order of the ETags"""
+        pass
+
+    @abstractmethod
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def read_bytes(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        """Read the file, or only the bytes from start to end with the end excluded"""
+        pass
+
+    @abstractmethod
+    def stream(self, key: str, chunk_size: int = LOCAL_STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+        """Read the file in chunks"""
+        pass
+
+
+class S3ResultStore(ResultStore):
+    storage_provider = enums.StorageProvider.AWS_S3
+
+    def __init__(self, s3_client, bucket_name: str):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+
+    def get_file_path(self, key: str) -> str:
+        return f"{S3_PREFIX}{self.bucket_name}/{key}"
+
+    def upload_fileobj(self, fileobj, key: str) -> None:
+        self.s3_client.upload_fileobj(fileobj, self.bucket_name, key)
+
+    def put_object(self, key: str, body: bytes, content_type: Optional[str] = None) -> None:
+        kwargs = {"ContentType": content_type} if content_type else {}
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=body, **kwargs)
+
+    def create_multipart_upload(self, key: str, content_type: Optional[str] = None) -> str:
+        kwargs = {"ContentType": content_type} if content_type else {}
+        multipart_upload = self.s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=key, **kwargs)
+        return multipart_upload["UploadId"]
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, body) -> str:
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name, Key=key, PartNumber=part_number, UploadId=upload_id, Body=body
+        )
+        return response["ETag"]
+
+    def complete_multipart_upload(self, key: str, upload_id: str, etags: list[str]) -> None:
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": idx + 1, "ETag": etag} for idx, etag in enumerate(etags)]},
+        )
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+        # Confirm all parts are deleted
+        try:
+            parts = self.s3_client.list_parts(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            logger.warning("Error when listing parts %s", str(e))
+            raise e
+        # If parts still exist, then try to abort again
+        if len(parts["Parts"]) > 0:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+            except Exception as e:
+                logger.warning("Error when in multipart upload %s", str(e))
+                raise e
+
+    def read_bytes(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        if start is None or end is None:
+            return self.s3_client.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+        if start >= end:
+            return b""
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key, Range=f"bytes={start}-{end - 1}")
+        return response["Body"].read()
+
+    def stream(self, key: str, chunk_size: int = LOCAL_STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+        yield from response["Body"].iter_chunks(chunk_size=chunk_size)
+
+
+def get_result_group(file_path: str) -> str:
+    """Get the path of the result a file belongs to, so a result is evicted along with its preview and row index"""
+    group, _ = os.path.splitext(file_path)
+    for suffix in [PREVIEW_SUFFIX, ROW_INDEX_SUFFIX]:
+        if group.endswith(suffix):
+            return group[: -len(suffix)]
+    return group
+
+
+class LocalStoreUsage:
+    """The sizes of the files saved to a directory, grouped by result in least recently used order
+
+    The directory is scanned the first time a file is saved and the sizes are updated as files are saved
+    and read after that, so saving a file doesn't need to walk the directory. Files deleted by other processes
+    are removed from the sizes when their result is evicted.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.groups: OrderedDict[str, dict[str, int]] = OrderedDict()
+        self.total_bytes = 0
+        self.scanned = False
+
+    def scan(self) -> None:
+        files = []
+        for dir_path, dir_names, file_names in os.walk(self.root_dir):
+            # Skip parts of uploads that are in progress
+            dir_names[:] = [dir_name for dir_name in dir_names if dir_name != LOCAL_MULTIPART_DIR]
+            for file_name in file_names:
+                if file_name.endswith(".tmp"):
+                    continue
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_path))
+        for _, file_size, file_path in sorted(files):
+            self.add(file_path=file_path, file_size=file_size)
+        self.scanned = True
+
+    def add(self, file_path: str, file_size: int) -> None:
+        group = get_result_group(file_path)
+        group_files = self.groups.setdefault(group, {})
+        self.total_bytes += file_size - group_files.get(file_path, 0)
+        group_files[file_path] = file_size
+        self.groups.move_to_end(group)
+
+    def touch(self, file_path: str) -> None:
+        group = get_result_group(file_path)
+        if group in self.groups:
+            self.groups.move_to_end(group)
+
+    def evict(self, max_bytes: int, keep_group: Optional[str] = None) -> None:
+        """Delete the least recently used results until the saved files fit in max_bytes"""
+        for group in list(self.groups):
+            if self.total_bytes <= max_bytes:
+                break
+            if group == keep_group:
+                continue
+            for file_path, file_size in self.groups.pop(group).items():
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                self.total_bytes -= file_size
+            logger.debug("Evicted local result %s", group)
+
+
+_local_store_usages: dict[str, LocalStoreUsage] = {}
+
+
+def get_local_store_usage(root_dir: str) -> LocalStoreUsage:
+    """Get the usage of the directory. Call while holding the eviction lock."""
+    root_dir = os.path.abspath(root_dir)
+    usage = _local_store_usages.get(root_dir)
+    if not usage:
+        usage = _local_store_usages[root_dir] = LocalStoreUsage(root_dir=root_dir)
+    return usage
+
+
+class LocalResultStore(ResultStore):
+    """Save results to a directory
+
+    Files are written to a temporary file and renamed so readers never see a partial file. Parts of a
+    multipart upload are saved as separate files and combined when the upload completes. Reads use mmap,
+    so range reads only load the pages that are read.
+
+    Parameters
+    ----------
+    root_dir
+        The directory results are saved to
+    max_bytes
+        The max total size of the saved files. The least recently used results are deleted first, along with
+        their preview and row index.
+    """
+
+    storage_provider = enums.StorageProvider.LOCAL
+
+    def __init__(self, root_dir: str, max_bytes: int = LOCAL_RESULT_STORE_MAX_BYTES):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+
+    def get_file_path(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def get_parts_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root_dir, LOCAL_MULTIPART_DIR, upload_id)
+
+    @staticmethod
+    def _write_atomic(file_path: str, write: Callable) -> None:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temp_file = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(file_path), prefix=".", suffix=".tmp", delete=False
+        )
+        try:
+            with temp_file:
+                write(temp_file)
+            os.replace(temp_file.name, file_path)
+        except Exception as e:
+            os.remove(temp_file.name)
+            raise e
+
+    def _save(self, key: str, write: Callable) -> None:
+        file_path = os.path.abspath(self.get_file_path(key))
+        self._write_atomic(file_path=file_path, write=write)
+        file_size = os.path.getsize(file_path)
+        with _local_eviction_lock:
+            usage = get_local_store_usage(self.root_dir)
+            if not usage.scanned:
+                # The scan includes the saved file
+                usage.scan()
+            else:
+                usage.add(file_path=file_path, file_size=file_size)
+            # Keep the rest of the result being saved
+            usage.evict(max_bytes=self.max_bytes, keep_group=get_result_group(file_path))
+
+    def upload_fileobj(self, fileobj, key: str) -> None:
+        self._save(key=key, write=lambda file: shutil.copyfileobj(fileobj, file))
+
+    def put_object(self, key: str, body: bytes, content_type: Optional[str] = None) -> None:
+        self._save(key=key, write=lambda file: file.write(body))
+
+    def create_multipart_upload(self, key: str, content_type: Optional[str] = None) -> str:
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.get_parts_dir(upload_id))
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, body) -> str:
+        part_path = os.path.join(self.get_parts_dir(upload_id), str(part_number))
+        self._write_atomic(file_path=part_path, write=lambda file: shutil.copyfileobj(body, file))
+        return str(part_number)
+
+    def complete_multipart_upload(self, key: str, upload_id: str, etags: list[str]) -> None:
+        parts_dir = self.get_parts_dir(upload_id)
+
+        def write_parts(file) -> None:
+            for etag in etags:
+                with open(os.path.join(parts_dir, etag), "rb") as part:
+                    shutil.copyfileobj(part, file)
+
+        self._save(key=key, write=write_parts)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        shutil.rmtree(self.get_parts_dir(upload_id), ignore_errors=True)
+
+    def read_bytes(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        file_path = self.get_file_path(key)
+        with open(file_path, "rb") as file:
+            file_size = os.fstat(file.fileno()).st_size
+            # Empty files can't be mapped
+            if not file_size:
+                return b""
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                data = mapped_file[start or 0 : file_size if end is None else end]
+        self.touch(file_path=file_path)
+        return data
+
+    def stream(self, key: str, chunk_size: int = LOCAL_STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+        file_path = self.get_file_path(key)
+        with open(file_path, "rb") as file:
+            self.touch(file_path=file_path)
+            if not os.fstat(file.fileno()).st_size:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                for idx in range(0, len(mapped_file), chunk_size):
+                    yield mapped_file[idx : idx + chunk_size]
+
+    @staticmethod
+    def touch(file_path: str) -> None:
+        """Mark the result of the file as recently used for eviction"""
+        # The modified time orders the results when the directory is scanned by a new process
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(file_path)
+        file_path = os.path.abspath(file_path)
+        with _local_eviction_lock:
+            # Results are read using the directory of the file, which is below the directory they were saved to
+            for root_dir, usage in _local_store_usages.items():
+                if file_path.startswith(root_dir + os.sep):
+                    usage.touch(file_path=file_path)
+
+
+def get_result_store(file_path: str, s3_client=None) -> tuple[ResultStore, str]:
+    """Get the store and key for a saved result file path
+
+    Parameters
+    ----------
+    s3_client
+        The client used to read files in S3
+    """
+    if file_path.startswith(S3_PREFIX):
+        bucket_name, key = file_path[len(S3_PREFIX) :].split("/", 1)
+        return S3ResultStore(s3_client=s3_client, bucket_name=bucket_name), key
+    return LocalResultStore(root_dir=os.path.dirname(file_path)), os.path.basename(file_path)
@@ -0,0 +1,81 @@
+"""Short lived Redis cache of the tables retrieved for an inquiry
+
+The agent often asks for tables with the same inquiry within a chat and across users on the same
+connection. Keys include the catalog version of the client that owns the index, so any update to the
+index invalidates them.
+"""
+
+import json
+from typing import Optional, Union
+
+from basejump.core.common.common_utils import hash_value
+from basejump.core.common.config.logconfig import set_logging
+from basejump.core.database.catalog_cache import catalog_cache
+from redis.asyncio import Redis as RedisAsync
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+TABLE_RETRIEVAL_PREFIX = "table_retrieval:"
+TABLE_RETRIEVAL_TTL = 60 * 5  # seconds
+
+
+class RetrievedTables:
+    """The table context strings for the relevant tables and the scores of all retrieved tables"""
+
+    def __init__(self, tables: list[str], scores: list[float]):
+        self.tables = tables
+        self.scores = scores
+
+    def to_json(self) -> str:
+        return json.dumps({"tables": self.tables, "scores": self.scores})
+
+    @classmethod
+    def from_json(cls, value: Union[str, bytes]) -> "RetrievedTables":
+        return cls(**json.loads(value))
+
+
+def normalize_inquiry(inquiry: str) -> str:
+    return " ".join(inquiry.lower().split()).strip(" .?!")
+
+
+class TableRetrievalCache:
+    def __init__(self, redis_client_async: RedisAsync, ttl: int = TABLE_RETRIEVAL_TTL):
+        self.redis_client_async = redis_client_async
+        self.ttl = ttl
+
+    async def get_key(self, client_id: int, vector_client_id: int, index_name: str, conn_id: int, inquiry: str) -> str:
+        """Get the cache key for an inquiry
+
+        Parameters
+        ----------
+        client_id
+            The ID of the client asking the inquiry. Connection IDs are only unique within a client.
+        vector_client_id
+            The ID of the client that owns the vector index, which is the demo client for demo tables
+        index_name
+            The name of the vector index the tables are retrieved from
+        """
+        version = await catalog_cache.get_version(
+            redis_client_async=self.redis_client_async, client_id=vector_client_id
+        )
+        inquiry_hash = hash_value(normalize_inquiry(inquiry))
+        return (
+            f"{TABLE_RETRIEVAL_PREFIX}{client_id}:{index_name}:{vector_client_id}:{conn_id}:{version}:{inquiry_hash}"
+        )
+
+    async def get(self, key: str) -> Optional[RetrievedTables]:
+        try:
+            value = await self.redis_client_async.get(key)
+        except Exception as e:
+            logger.warning("Error reading the table retrieval cache: %s", str(e))
+            return None
+        if not value:
+            return None
+        logger.debug("Table retrieval cache hit for %s", key)
+        return RetrievedTables.from_json(value)
+
+    async def set(self, key: str, retrieved_tables: RetrievedTables) -> None:
+        try:
+            await self.redis_client_async.set(key, retrieved_tables.to_json(), ex=self.ttl)
+        except Exception as e:
+            logger.warning("Error writing to the table retrieval cache: %s", str(e))
@@ -0,0 +1,163 @@
+"""Per-process cache of client storage connections and AWS clients
+
+Every query upload needs the client's active storage connection and an S3 client. Looking up the connection
+opens an engine against the Basejump database, and creating a boto3 client loads the service model, which
+together add hundreds of milliseconds to each upload. Storage connections rarely change, so they are cached
+for a short TTL.
+
+The TTL is the only bound on how long a changed storage connection is used, since connections can be changed
+by other processes and nothing in this package updates them after the client is created. Code that changes a
+storage connection in the same process can call invalidate_storage_conn to use the change right away.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import boto3
+from basejump.core.common.common_utils import hash_value
+from basejump.core.common.config.logconfig import set_logging
+from basejump.core.models import enums, models
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+STORAGE_CONN_CACHE_TTL = 60 * 5  # seconds
+STORAGE_CONN_CACHE_MAX_ENTRIES = 1000
+BOTO_CLIENT_POOL_MAX_ENTRIES = 100
+STORAGE_PROVIDER_ALIASES = {"S3": enums.StorageProvider.AWS_S3, "AWS": enums.StorageProvider.AWS_S3}
+
+
+def get_storage_provider(storage_provider: Optional[str]) -> enums.StorageProvider:
+    """Get the storage provider for a value saved on a storage connection
+
+    The column is free-form text, so the value is normalized and anything unknown is treated as AWS S3
+    instead of failing every upload for the client.
+    """
+    value = (storage_provider or "").strip().upper().replace("-", "_").replace(" ", "_")
+    if value in STORAGE_PROVIDER_ALIASES:
+        return STORAGE_PROVIDER_ALIASES[value]
+    try:
+        return enums.StorageProvider(value)
+    except ValueError:
+        logger.warning(f"Unknown storage provider {storage_provider!r}, using {enums.StorageProvider.AWS_S3}")
+        return enums.StorageProvider.AWS_S3
+
+
+class StorageConnection:
+    """The decrypted details of a client's active storage connection"""
+
+    def __init__(
+        self,
+        region: str,
+        bucket_name: str,
+        prefix: str,
+        access_key: str,
+        secret_access_key: str,
+        storage_provider: enums.StorageProvider = enums.StorageProvider.AWS_S3,
+    ):
+        self.region = region
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.access_key = access_key
+        self.secret_access_key = secret_access_key
+        self.storage_provider = storage_provider
+        self.created_at = time.monotonic()
+
+    @classmethod
+    def from_orm(cls, storage_conn: models.ClientStorageConnection) -> "StorageConnection":
+        return cls(
+            region=storage_conn.region,
+            bucket_name=storage_conn.bucket_name,
+            prefix=storage_conn.prefix,
+            # The encrypted columns are decrypted to strings when loaded
+            access_key=str(storage_conn.access_key),
+            secret_access_key=str(storage_conn.secret_access_key),
+            storage_provider=get_storage_provider(storage_conn.storage_provider),
+        )
+
+
+class StorageConnCache:
+    """Cache of the active storage connection for each client
+
+    Parameters
+    ----------
+    ttl
+        The max number of seconds to keep a connection
+    """
+
+    def __init__(self, ttl: float = STORAGE_CONN_CACHE_TTL, max_entries: int = STORAGE_CONN_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._storage_conns: dict[int, StorageConnection] = {}
+        # Uploads run in worker threads
+        self._lock = threading.Lock()
+
+    def get(self, client_id: int) -> Optional[StorageConnection]:
+        with self._lock:
+            storage_conn = self._storage_conns.get(client_id)
+            if storage_conn and time.monotonic() - storage_conn.created_at >= self.ttl:
+                del self._storage_conns[client_id]
+                return None
+        return storage_conn
+
+    def set(self, client_id: int, storage_conn: StorageConnection) -> None:
+        with self._lock:
+            self._storage_conns.pop(client_id, None)
+            if len(self._storage_conns) >= self.max_entries:
+                # Dicts keep insertion order so the first key is the oldest entry
+                del self._storage_conns[next(iter(self._storage_conns))]
+            self._storage_conns[client_id] = storage_conn
+
+    def invalidate(self, client_id: int) -> None:
+        with self._lock:
+            self._storage_conns.pop(client_id, None)
+        logger.debug("Invalidated the storage connection cache for client %s", client_id)
+
+
+class BotoClientPool:
+    """Shared boto3 clients keyed by service, region and credentials
+
+    Clients are thread-safe once created, but creating them from the default session is not, so they are
+    created from a new session while holding a lock.
+    """
+
+    def __init__(self, max_entries: int = BOTO_CLIENT_POOL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._clients: OrderedDict[tuple, object] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_client(
+        self,
+        service_name: str,
+        region: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+    ):
+        """Get a client, creating it if needed. Leave out the credentials to use the default credentials."""
+        # Don't keep the secret in the key
+        key = (service_name, region, access_key, hash_value(secret_access_key) if secret_access_key else None)
+        with self._lock:
+            client = self._clients.get(key)
+            if client:
+                self._clients.move_to_end(key)
+                return client
+            client = boto3.session.Session().client(
+                service_name,  # type: ignore
+                region_name=region,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_access_key,
+            )
+            self._clients[key] = client
+            if len(self._clients) > self.max_entries:
+                self._clients.popitem(last=False)
+        return client
+
+
+storage_conn_cache = StorageConnCache()
+boto_client_pool = BotoClientPool()
+
+
+def invalidate_storage_conn(client_id: int) -> None:
+    """Drop the cached storage connection for a client in this process"""
+    storage_conn_cache.invalidate(client_id=client_id)
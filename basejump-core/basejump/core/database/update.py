@@ -3,6 +3,7 @@ from typing import Sequence
 
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.database import db_utils
+from basejump.core.database.catalog_cache import invalidate_catalog
 from basejump.core.database.crud import crud_connection, crud_table, crud_utils
 from basejump.core.database.db_connect import ConnectDB, TableManager
 from basejump.core.database.index import DBTableIndexer
@@ -106,6 +107,7 @@ class DBManager:
                 tables=tables_formatted,
                 index_db_tables=index_db_tables,
             )
+            await invalidate_catalog(redis_client_async=self.redis_client_async, client_id=self.client_user.client_id)
         return list(brand_new_schemas)
 
     async def update_db(self) -> sch.GetDBParams:
@@ -125,6 +127,7 @@ class DBManager:
                 setattr(self.database, key, value)
         await self.db.commit()
         await self.db.refresh(self.database)
+        await invalidate_catalog(redis_client_async=self.redis_client_async, client_id=self.client_user.client_id)
         get_db_params = crud_utils.helper_decrypt_db(database=self.database)
         logger.info("Client engine updated and saved in database")
         # TODO: Raise an error if schema maps don't match anything
@@ -197,6 +200,7 @@ class DBManager:
         await index_db_tables.update_index_from_tables(
             tables=tables_w_new_schema, redis_client_async=self.redis_client_async
         )
+        await invalidate_catalog(redis_client_async=self.redis_client_async, client_id=self.client_user.client_id)
 
     async def check_for_updated_tables(self, connections: list[sch.SQLConnSchema]) -> list[sch.SQLTable]:
         # Identify new tables
@@ -1,28 +1,60 @@
 import asyncio
-import copy
+import codecs
 import csv
 import io
+import json
 import os
+import re
+import tempfile
 import time
+import unicodedata
 import uuid
-from typing import Optional
+from abc import ABC, abstractmethod
+from typing import IO, Optional, Union
 
-import boto3
 import pandas as pd
+import pyarrow as pa
+import psycopg2
+import pyarrow.parquet as pq
 import sqlalchemy as sa
 from basejump.core.common.config.logconfig import set_logging
+from basejump.core.database.athena_jobs import AthenaJobRunner
 from basejump.core.database.crud import crud_connection
 from basejump.core.database.db_connect import ConnectDB
 from basejump.core.database.format_response import JSONResponseFormatter
+from basejump.core.database.result_cache import result_cache
+from basejump.core.database.result_store import (
+    PREVIEW_SUFFIX,
+    ROW_INDEX_SUFFIX,
+    S3_PREFIX,
+    LocalResultStore,
+    ResultStore,
+    S3ResultStore,
+)
+from basejump.core.database.storage_cache import StorageConnection, boto_client_pool, storage_conn_cache
 from basejump.core.models import constants, enums, errors
 from basejump.core.models import pydantic_ai_formats as fmt
 from basejump.core.models import schemas as sch
 from botocore.exceptions import ClientError
 from fastapi import UploadFile
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
 
 RESULT_PREVIEW_CT = 100
-PREVIEW_SUFFIX = "_preview"
-S3_PREFIX = "s3://"
+CSV_INGEST_CHUNK_BYTES = 1024 * 1024
+CSV_TYPE_SAMPLE_ROWS = 10000
+PARQUET_BATCH_ROWS = 50000
+PARQUET_TYPES = {
+    "Int64": pa.int64(),
+    "float64": pa.float64(),
+    "boolean": pa.bool_(),
+    "datetime64[ns]": pa.timestamp("ns"),
+    "string": pa.string(),
+}
+BOOLEAN_VALUES = {"true": True, "false": False}
+# The type to use when values don't match the inferred type of a column
+WIDER_DTYPES = {"Int64": "float64", "float64": "string", "boolean": "string", "datetime64[ns]": "string"}
+CSV_ROW_DELIMITER_PATTERN = re.compile(rb'["\n]')
+ROW_INDEX_INTERVAL = 1000
 
 logger = set_logging(handler_option="stream", name=__name__)
 
@@ -38,11 +70,11 @@ def get_result_type(num_cols: int, num_rows: int) -> enums.ResultType:
     return result_type
 
 
-def save_preview(buffer, s3_client, s3_bucket_name, file_name):
+def save_preview(buffer, result_store: ResultStore, file_name):
     buffer.seek(0)
-    logger.info(f"Saving file preview, bucket: {s3_bucket_name}, file_name: {file_name}")
+    logger.info(f"Saving file preview, file_path: {result_store.get_file_path(file_name)}")
     try:
-        s3_client.upload_fileobj(buffer, s3_bucket_name, file_name)
+        result_store.upload_fileobj(buffer, file_name)
     except ClientError as e:
         logger.error("Error in save_preview %s", str(e))
         raise errors.InvalidClientCredentials
@@ -54,6 +86,12 @@ def get_preview_file_name(s3_file_key: str) -> str:
     return f"{file_name}{PREVIEW_SUFFIX}.csv"
 
 
+def get_row_index_file_name(s3_file_key: str) -> str:
+    split_file = s3_file_key.split(".csv")
+    file_name = split_file[0]
+    return f"{file_name}{ROW_INDEX_SUFFIX}.json"
+
+
 def get_s3_key(file_name, prefix: Optional[str] = None):
     if prefix:
         # NOTE: Prefixes end with a slash
@@ -94,6 +132,404 @@ def get_s3_folder_path(bucket_name: str, prefix: Optional[str] = None):
 
 
 # TODO: Stream uploads for databases that allow streaming (Redshift does not allow streaming)
+class CSVStreamParser:
+    """Parse CSV rows from chunks of bytes
+
+    Characters split across chunks are decoded once the rest of their bytes arrive, and rows split across
+    chunks, including quoted values with new lines, are parsed once they are complete.
+    """
+
+    def __init__(self, encoding: str = "utf-8-sig"):
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.pending = ""
+        self.record_lines: list[str] = []
+        self.quote_ct = 0
+
+    def feed(self, chunk: bytes, final: bool = False) -> list[list[str]]:
+        lines = (self.pending + self.decoder.decode(chunk, final=final)).split("\n")
+        # The last line is incomplete until the next chunk arrives
+        self.pending = lines.pop()
+        if final and self.pending:
+            lines.append(self.pending)
+            self.pending = ""
+        complete_lines = []
+        for line in lines:
+            self.record_lines.append(line + "\n")
+            self.quote_ct += line.count('"')
+            # A row is complete once all of its quotes are closed
+            if self.quote_ct % 2 == 0:
+                complete_lines += self.record_lines
+                self.record_lines = []
+                self.quote_ct = 0
+        if final:
+            complete_lines += self.record_lines
+            self.record_lines = []
+        return [row for row in csv.reader(complete_lines) if row]
+
+
+def get_column_names(header: list[str]) -> list[str]:
+    """Convert the CSV header to unique column names that are valid in Athena"""
+    column_names: list[str] = []
+    for idx, column in enumerate(header):
+        # Athena column names can only have lowercase letters, numbers and underscores
+        ascii_column = unicodedata.normalize("NFKD", column).encode("ascii", "ignore").decode()
+        column_name = re.sub(r"[^0-9a-z_]+", "_", ascii_column.strip().lower()).strip("_") or f"column_{idx}"
+        if column_name in column_names:
+            column_name = f"{column_name}_{idx}"
+        column_names.append(column_name)
+    return column_names
+
+
+def infer_column_dtype(values: pd.Series) -> str:
+    """Infer the type of a column of CSV values, which are all strings"""
+    values = values[values.str.strip() != ""]
+    if values.empty:
+        return "string"
+    if values.str.lower().isin(BOOLEAN_VALUES.keys()).all():
+        return "boolean"
+    # Keep values like zip codes with leading zeros as strings
+    if not values.str.match(r"^-?0\d").any():
+        numbers = pd.to_numeric(values, errors="coerce")
+        if numbers.notna().all():
+            is_integer = not values.str.contains(r"[.eE]").any()
+            return "Int64" if is_integer else "float64"
+    is_digits = values.str.fullmatch(r"\d+").any()
+    if not is_digits and pd.to_datetime(values, errors="coerce", format="mixed").notna().all():
+        return "datetime64[ns]"
+    return "string"
+
+
+def convert_csv_values(values: pd.Series, dtype: str) -> pd.Series:
+    """Convert a column of CSV values to the type. Values that don't match the type are set to null."""
+    if dtype == "Int64":
+        numbers = pd.to_numeric(values, errors="coerce")
+        return numbers.where(numbers % 1 == 0).astype("Int64")
+    if dtype == "float64":
+        return pd.to_numeric(values, errors="coerce").astype("float64")
+    if dtype == "boolean":
+        return values.str.lower().map(BOOLEAN_VALUES).astype("boolean")
+    if dtype == "datetime64[ns]":
+        # Convert any time zones to UTC since Athena timestamps don't have a time zone
+        return pd.to_datetime(values, errors="coerce", format="mixed", utc=True).dt.tz_localize(None)
+    return values
+
+
+def convert_csv_rows(rows: list[list[str]], dtypes: dict[str, str]) -> tuple[pd.DataFrame, dict[str, str]]:
+    """Convert rows of CSV values to the inferred types
+
+    The types are inferred from the first rows, so later values may not match them, such as 2.5 in an
+    Int64 column or N/A in a float64 column. The type of those columns is widened so no values are lost.
+
+    Returns
+    -------
+    df
+        The converted rows
+    dtypes
+        The types of the columns, including any that were widened
+    """
+    column_ct = len(dtypes)
+    rows = [row[:column_ct] + [""] * (column_ct - len(row)) for row in rows]
+    df = pd.DataFrame(rows, columns=list(dtypes.keys()), dtype="string")
+    dtypes = dict(dtypes)
+    for column, dtype in dtypes.items():
+        values = df[column].where(df[column].str.strip() != "")
+        converted = convert_csv_values(values=values, dtype=dtype)
+        while dtype in WIDER_DTYPES and (values.notna() & converted.isna()).any():
+            dtype = WIDER_DTYPES[dtype]
+            converted = convert_csv_values(values=values, dtype=dtype)
+        dtypes[column] = dtype
+        df[column] = converted
+    return df, dtypes
+
+
+def get_parquet_schema(dtypes: dict[str, str]) -> pa.Schema:
+    return pa.schema([(column, PARQUET_TYPES[dtype]) for column, dtype in dtypes.items()])
+
+
+def get_parquet_writer(parquet_file: IO[bytes], dtypes: dict[str, str]) -> pq.ParquetWriter:
+    return pq.ParquetWriter(
+        parquet_file, schema=get_parquet_schema(dtypes=dtypes), coerce_timestamps="ms", allow_truncated_timestamps=True
+    )
+
+
+def write_parquet_batch(writer: pq.ParquetWriter, df: pd.DataFrame) -> None:
+    writer.write_table(pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False))
+
+
+def widen_parquet_file(
+    writer: pq.ParquetWriter, parquet_file: IO[bytes], dtypes: dict[str, str]
+) -> tuple[pq.ParquetWriter, IO[bytes]]:
+    """Copy the batches written so far to a new file with the widened types
+
+    The old file is closed.
+
+    Returns
+    -------
+    writer
+        The writer for the new file
+    parquet_file
+        The new file
+    """
+    writer.close()
+    parquet_file.seek(0)
+    new_parquet_file = tempfile.TemporaryFile()
+    try:
+        new_writer = get_parquet_writer(parquet_file=new_parquet_file, dtypes=dtypes)
+        written_file = pq.ParquetFile(parquet_file)
+        for idx in range(written_file.num_row_groups):
+            # Casting doesn't lose values since types are only widened, but large integers may be rounded
+            new_writer.write_table(written_file.read_row_group(idx).cast(new_writer.schema, safe=False))
+    except Exception as e:
+        new_parquet_file.close()
+        raise e
+    parquet_file.close()
+    return new_writer, new_parquet_file
+
+
+class RowOffsetIndex:
+    """The byte offsets of every nth row in a result file
+
+    The index is saved next to the result so a page of rows can be read with a range request instead of
+    reading the file from the start.
+
+    Parameters
+    ----------
+    interval
+        The number of rows between offsets
+    offsets
+        The byte offset of the start of every nth row after the header
+    """
+
+    def __init__(
+        self,
+        interval: int = ROW_INDEX_INTERVAL,
+        offsets: Optional[list[int]] = None,
+        columns: Optional[list[str]] = None,
+        row_ct: int = 0,
+        file_size: int = 0,
+    ):
+        self.interval = interval
+        self.offsets = offsets or []
+        self.columns = columns or []
+        self.row_ct = row_ct
+        self.file_size = file_size
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "interval": self.interval,
+                "offsets": self.offsets,
+                "columns": self.columns,
+                "row_ct": self.row_ct,
+                "file_size": self.file_size,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, value: Union[str, bytes]) -> "RowOffsetIndex":
+        return cls(**json.loads(value))
+
+    def get_byte_range(self, start_row: int, end_row: int) -> tuple[int, int, int]:
+        """Get the bytes that contain rows [start_row, end_row)
+
+        Returns
+        -------
+        byte_range
+            The start and end of the bytes to read, with the end excluded, and the number of rows to skip at
+            the start of the bytes. The range is empty if start_row is past the end of the file.
+        """
+        if start_row < 0:
+            raise ValueError(f"start_row must not be negative, got {start_row}")
+        start_block = start_row // self.interval
+        if start_row >= end_row or start_block >= len(self.offsets):
+            return self.file_size, self.file_size, 0
+        end_block = -(-end_row // self.interval)
+        range_end = self.offsets[end_block] if end_block < len(self.offsets) else self.file_size
+        return self.offsets[start_block], range_end, start_row - start_block * self.interval
+
+
+class CSVRowCounter:
+    """Count the rows in a CSV byte stream without parsing the values
+
+    New lines in quoted values don't end a row, so chunks with quotes are scanned for quotes and new lines.
+    The first rows are kept so the header and preview can be parsed.
+
+    Parameters
+    ----------
+    head_row_ct
+        The number of rows to keep, including the header
+    row_index
+        The index to add the offset of every nth row to
+    """
+
+    def __init__(self, head_row_ct: int, row_index: Optional[RowOffsetIndex] = None):
+        self.head_row_ct = head_row_ct
+        self.head = bytearray()
+        self.row_ct = 0
+        self.byte_ct = 0
+        self.in_quotes = False
+        self.row_index = row_index or RowOffsetIndex()
+
+    @property
+    def next_indexed_row_ct(self) -> int:
+        # The header is the first row
+        return 1 + len(self.row_index.offsets) * self.row_index.interval
+
+    def feed(self, chunk: bytes) -> None:
+        head_row_ct = self.row_ct
+        if head_row_ct >= self.head_row_ct and not self.in_quotes and b'"' not in chunk:
+            newline_ct = chunk.count(b"\n")
+            if self.row_ct + newline_ct < self.next_indexed_row_ct:
+                self.row_ct += newline_ct
+                self.byte_ct += len(chunk)
+                return
+        head_end = None
+        for match in CSV_ROW_DELIMITER_PATTERN.finditer(chunk):
+            if match.group() == b'"':
+                self.in_quotes = not self.in_quotes
+            elif not self.in_quotes:
+                self.row_ct += 1
+                if self.row_ct == self.head_row_ct:
+                    head_end = match.end()
+                if self.row_ct == self.next_indexed_row_ct:
+                    self.row_index.offsets.append(self.byte_ct + match.end())
+        if head_row_ct < self.head_row_ct:
+            self.head += chunk[:head_end]
+        self.byte_ct += len(chunk)
+
+    def get_head_rows(self) -> list[list[str]]:
+        return list(csv.reader(io.StringIO(self.head.decode("utf-8", errors="replace"), newline="")))
+
+
+def get_rows(columns: list[str], rows: list) -> list[sa.Row]:
+    """Convert rows of values to SQLAlchemy rows"""
+    return list(IteratorResult(SimpleResultMetaData(columns), iter([tuple(row) for row in rows])).all())
+
+
+class MemoryViewReader(io.RawIOBase):
+    """Read a buffer without copying it
+
+    Uploads close the file when they finish, so uploading a BytesIO directly would close it. Closing the reader
+    only releases the view, so the buffer can be resized again.
+    """
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        size = min(len(b), max(len(self.view) - self.position, 0))
+        b[:size] = self.view[self.position : self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def close(self) -> None:
+        self.view.release()
+        super().close()
+
+
+class UploadLimitReached(Exception):
+    pass
+
+
+class ExportNotSupported(Exception):
+    """The database can't export the query, so the result is uploaded row by row instead"""
+
+    pass
+
+
+class SQLResultExporter(ABC):
+    """Export a query result as CSV with a header using the database's own export
+
+    Databases generate CSV much faster than converting every value in Python. Subclasses are used by
+    upload_sql_to_s3 when is_supported returns True for the connection.
+    """
+
+    database_types: list[enums.DatabaseType] = []
+    drivers: list[str] = []
+
+    def is_supported(self, conn: sa.Connection, database_type: Optional[enums.DatabaseType]) -> bool:
+        return database_type in self.database_types and conn.dialect.driver in self.drivers
+
+    @abstractmethod
+    def export(self, conn: sa.Connection, sql_query: str, file) -> None:
+        """Write the result to the file
+
+        Raise ExportNotSupported if the database can't export the query before it runs. Any other error is
+        raised to the caller without running the query again.
+
+        Parameters
+        ----------
+        file
+            An object with a write method that takes bytes
+        """
+        pass
+
+
+class PostgresCopyExporter(SQLResultExporter):
+    """Export results with COPY TO STDOUT. Redshift uses the same driver but doesn't support COPY TO."""
+
+    database_types = [enums.DatabaseType.POSTGRES]
+    drivers = ["psycopg2"]
+
+    def export(self, conn: sa.Connection, sql_query: str, file) -> None:
+        query = sql_query.strip().rstrip(";")
+        dbapi_connection = conn.connection.dbapi_connection
+        cursor = dbapi_connection.cursor()  # type: ignore
+        try:
+            # New lines keep a trailing comment in the query from commenting out the parenthesis
+            cursor.copy_expert(f"COPY (\n{query}\n) TO STDOUT WITH CSV HEADER", file)
+        except Exception as e:
+            # The connection isn't usable until the failed transaction is rolled back
+            dbapi_connection.rollback()  # type: ignore
+            # COPY can only wrap a single query, so statements like SHOW or several statements are rejected
+            # while the query is parsed, before it runs
+            if isinstance(e, (psycopg2.errors.SyntaxError, psycopg2.errors.FeatureNotSupported)):
+                raise ExportNotSupported(str(e)) from e
+            raise e
+        finally:
+            cursor.close()
+
+
+class ExportedCSVFile:
+    """Passed to the exporters as the file so the uploader receives the bytes as they are exported"""
+
+    def __init__(self, uploader: "S3Uploader"):
+        self.uploader = uploader
+
+    def write(self, data: bytes) -> None:
+        self.uploader.write_exported_csv(data)
+
+
+SQL_RESULT_EXPORTERS: list[SQLResultExporter] = [PostgresCopyExporter()]
+
+
+def get_sql_result_exporter(
+    conn: sa.Connection, database_type: Optional[enums.DatabaseType]
+) -> Optional[SQLResultExporter]:
+    for exporter in SQL_RESULT_EXPORTERS:
+        if exporter.is_supported(conn=conn, database_type=database_type):
+            return exporter
+    return None
+
+
 class S3Uploader:
     chunk_size = 8192
     upload_size_mb = 5
@@ -116,10 +552,14 @@ class S3Uploader:
         self.type: str = type
         self.types = ["csv", "sql"]
         self.result_uuid = result_uuid or uuid.uuid4()
-        self.result_file_name = f"{str(self.result_uuid)}.csv"
         assert self.type in self.types, f"'{self.type}' is not in {self.types}"
+        # Uploaded CSVs are saved as Parquet since they are queried using Athena
+        self.result_file_name = f"{str(self.result_uuid)}.{'parquet' if self.type == 'csv' else 'csv'}"
         self.buffer = io.BytesIO()
         self.text_wrapper = io.TextIOWrapper(self.buffer, newline="", encoding="utf-8")
+        self.preview_buffer = io.BytesIO()
+        self.preview_text_wrapper = io.TextIOWrapper(self.preview_buffer, newline="", encoding="utf-8")
+        self.cols: list[str] = []
         self.ai_query_result_view: list = []
         self.saved_preview = False
         self.multipart_upload = False
@@ -128,6 +568,9 @@ class S3Uploader:
         self.counter = 0
         self.chunk_counter = 0
         self.total_row_counter = 0
+        self.uploaded_byte_ct = 0
+        self.row_index = RowOffsetIndex()
+        self.row_counter = CSVRowCounter(head_row_ct=RESULT_PREVIEW_CT + 1, row_index=self.row_index)
         self.client_id = client_id
         self.initialize_s3_bucket(db_conn_params=db_conn_params)
         self.metric_value: Optional[str] = None
@@ -143,7 +586,10 @@ class S3Uploader:
     def s3_file_key(self) -> str:
         return get_s3_key(file_name=self.result_file_name, prefix=self.prefix)
 
-    def initialize_s3_bucket(self, db_conn_params: sch.SQLDBSchema):
+    def get_storage_conn(self, db_conn_params: sch.SQLDBSchema) -> StorageConnection:
+        storage_conn = storage_conn_cache.get(client_id=self.client_id)
+        if storage_conn:
+            return storage_conn
         conn_db = ConnectDB(conn_params=db_conn_params)
         sql_engine_noasync = conn_db.connect_db()
         session = sa.orm.sessionmaker(
@@ -157,70 +603,84 @@ class S3Uploader:
                 session_result = crud_connection.get_client_active_storage_conn_sync(
                     db=connect, client_id=self.client_id
                 )
-                if session_result:
-                    self.bucket_name = session_result.bucket_name
-                    self.prefix = session_result.prefix
-                    self.s3_client = boto3.client(  # type: ignore
-                        "s3",
-                        region_name=session_result.region,
-                        aws_access_key_id=session_result.access_key,
-                        aws_secret_access_key=session_result.secret_access_key,
-                    )
-                    if self.type == "csv":
-                        logger.debug("Using region: %s", session_result.region)
-                        self.athena_client = boto3.client(  # type: ignore
-                            "athena",
-                            region_name=session_result.region,
-                            aws_access_key_id=session_result.access_key,
-                            aws_secret_access_key=session_result.secret_access_key,
-                        )
-                else:
+                if not session_result:
                     msg = "No bucket name found"
                     logger.info(msg)
                     raise Exception(msg)
+                storage_conn = StorageConnection.from_orm(session_result)
         finally:
             sql_engine_noasync.dispose()
+        storage_conn_cache.set(client_id=self.client_id, storage_conn=storage_conn)
+        return storage_conn
+
+    def initialize_s3_bucket(self, db_conn_params: sch.SQLDBSchema):
+        storage_conn = self.get_storage_conn(db_conn_params=db_conn_params)
+        self.bucket_name = storage_conn.bucket_name
+        self.prefix = storage_conn.prefix
+        if storage_conn.storage_provider == enums.StorageProvider.LOCAL:
+            if self.type == "csv":
+                raise ValueError("Uploading files requires S3 storage since they are queried using Athena")
+            # The bucket name is the directory for local storage
+            self.result_store: ResultStore = LocalResultStore(root_dir=self.bucket_name)
+            return
+        self.s3_client = boto_client_pool.get_client(
+            "s3",
+            region=storage_conn.region,
+            access_key=storage_conn.access_key,
+            secret_access_key=storage_conn.secret_access_key,
+        )
+        self.result_store = S3ResultStore(s3_client=self.s3_client, bucket_name=self.bucket_name)
+        if self.type == "csv":
+            logger.debug("Using region: %s", storage_conn.region)
+            self.athena_runner = AthenaJobRunner(
+                region=storage_conn.region,
+                access_key=storage_conn.access_key,
+                secret_access_key=storage_conn.secret_access_key,
+                output_location=f"{S3_PREFIX}{self.bucket_name}/query_outputs",
+            )
 
     def _upload_chunk(self, part_number):
+        assert self.upload_id, "The multipart upload hasn't been created"
         self.buffer.seek(0)
-        response = self.s3_client.upload_part(
-            Bucket=self.bucket_name,
-            Key=self.s3_file_key,
-            PartNumber=part_number,
-            UploadId=self.upload_id,
-            Body=self.buffer.getvalue(),
-        )
-        return response["ETag"]
+        with MemoryViewReader(self.buffer.getbuffer()) as part:
+            return self.result_store.upload_part(
+                key=self.s3_file_key, upload_id=self.upload_id, part_number=part_number, body=part
+            )
 
     def upload_chunk(self):
         self.text_wrapper.flush()
         # If buffer exceeds 5 MB, upload and reset the buffer
-        if self.buffer.tell() >= self.chunk_size:
+        if self.buffer.tell() >= self.upload_size:
+            if not self.multipart_upload:
+                self.create_multipart_upload()
             self.chunk_counter += 1
             if self.chunk_counter > self.upload_chunk_limit:
                 # Not allowing uploads past 100 MB currently
                 self.abort_multipart_upload()
-            else:
-                try:
-                    etag = self._upload_chunk(part_number=len(self.etags) + 1)
-                    self.etags.append(etag)
-                    self.buffer.truncate(0)  # Reset the buffer for the next chunk
-                except Exception as e:
-                    logger.error("Error in upload to s3 in chunks %s", str(e))
-                    # Not raising error since this could also indicate it completed
+                self.aborted_upload = True
+                raise UploadLimitReached
+            part_size = self.buffer.tell()
+            try:
+                etag = self._upload_chunk(part_number=len(self.etags) + 1)
+                self.etags.append(etag)
+                self.uploaded_byte_ct += part_size
+                # Reset the buffer for the next chunk
+                self.buffer.seek(0)
+                self.buffer.truncate(0)
+            except Exception as e:
+                logger.error("Error in upload to s3 in chunks %s", str(e))
+                # Not raising error since this could also indicate it completed
 
     def clean_row(self, row):
         return [str(cell).replace("\n", "\\n").replace("\r", "") for cell in row]
 
     def create_multipart_upload(self):
         try:
-            multipart_upload = self.s3_client.create_multipart_upload(
-                Bucket=self.bucket_name, Key=self.s3_file_key, ContentType="text/csv"
-            )
+            self.upload_id = self.result_store.create_multipart_upload(key=self.s3_file_key, content_type="text/csv")
         except Exception as e:
             logger.error("Error in stream query results %s", str(e))
             raise e
-        self.upload_id = multipart_upload["UploadId"]
+        self.multipart_upload = True
 
     def complete_multipart_upload(self):
         self.text_wrapper.flush()
@@ -231,62 +691,49 @@ class S3Uploader:
             )
             self.etags.append(etag)
         # Complete the multipart upload
-        self.s3_client.complete_multipart_upload(
-            Bucket=self.bucket_name,
-            Key=self.s3_file_key,
-            UploadId=self.upload_id,
-            MultipartUpload={"Parts": [{"PartNumber": idx + 1, "ETag": etag} for idx, etag in enumerate(self.etags)]},
-        )
+        assert self.upload_id, "The multipart upload hasn't been created"
+        self.result_store.complete_multipart_upload(key=self.s3_file_key, upload_id=self.upload_id, etags=self.etags)
 
     def abort_multipart_upload(self):
-        self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.s3_file_key, UploadId=self.upload_id)
-        # Confirm all parts are deleted
-        try:
-            parts = self.s3_client.list_parts(Bucket=self.bucket_name, Key=self.s3_file_key, UploadId=self.upload_id)
-        except ClientError as e:
-            logger.warning("Error when listing parts %s", str(e))
-            raise e
-        # If parts still exist, then try to abort again
-        if len(parts["Parts"]) > 0:
-            try:
-                self.s3_client.abort_multipart_upload(
-                    Bucket=self.bucket_name, Key=self.s3_file_key, UploadId=self.upload_id
-                )
-            except Exception as e:
-                logger.warning("Error when in multipart upload %s", str(e))
-                raise e
+        assert self.upload_id, "The multipart upload hasn't been created"
+        self.result_store.abort_multipart_upload(key=self.s3_file_key, upload_id=self.upload_id)
 
     def single_upload(self):
         self.text_wrapper.flush()
         if not self.saved_preview:
-            preview_buffer_to_upload = copy.deepcopy(self.buffer)
-            save_preview(preview_buffer_to_upload, self.s3_client, self.bucket_name, self.preview_file_name)
-            self.saved_preview = True
-        self.buffer.seek(0)
-        buffer_to_upload = copy.deepcopy(self.buffer)
+            self.save_preview()
         try:
-            self.s3_client.upload_fileobj(buffer_to_upload, self.bucket_name, self.s3_file_key)
+            with MemoryViewReader(self.buffer.getbuffer()) as buffer_to_upload:
+                self.result_store.upload_fileobj(buffer_to_upload, self.s3_file_key)
         except ClientError as e:
             logger.error("Invalid client creds: %s", str(e))
             raise errors.InvalidClientCredentials
         assert self.saved_preview
+        if not self.etags and self.buffer.getbuffer().nbytes <= result_cache.max_entry_bytes:
+            # The buffer has the whole result, so keep it for the visualization tool
+            result_cache.set(
+                result_uuid=self.result_uuid,
+                result_file_path=self.result_store.get_file_path(self.s3_file_key),
+                csv_bytes=self.buffer.getvalue(),
+            )
 
     def save_preview(self):
-        self.text_wrapper.flush()
-        buffer_to_upload = copy.deepcopy(self.buffer)
-        save_preview(
-            buffer=buffer_to_upload,
-            s3_client=self.s3_client,
-            s3_bucket_name=self.bucket_name,
-            file_name=get_preview_file_name(self.s3_file_key),
-        )
+        self.preview_text_wrapper.flush()
+        with MemoryViewReader(self.preview_buffer.getbuffer()) as buffer_to_upload:
+            save_preview(
+                buffer=buffer_to_upload,
+                result_store=self.result_store,
+                file_name=get_preview_file_name(self.s3_file_key),
+            )
         self.saved_preview = True
 
     def get_metric_value(self, small_model_info: sch.ModelInfo, initial_prompt: str, sql_query: str):
         # Get the metric values
         # TODO: Possibly stop saving metrics in S3 since we're saving them in ResultHistory now
         # Doing this does cause issues elsewhere in the code though, so needs to be done carefully
-        metric_value_binary = self.buffer.getvalue()
+        # The preview has the whole result since metrics only have one row
+        self.preview_text_wrapper.flush()
+        metric_value_binary = self.preview_buffer.getvalue()
         self.metric_value = str(metric_value_binary.decode().replace("\n", " ").replace("\r", "").strip())
         prompt = f"""\
 Update the following metric value to be formatted based on the context. \
@@ -314,37 +761,113 @@ Metric Value: {self.metric_value}\n
         # Create a CSV writer that writes into the buffer
         csv_writer = csv.writer(self.text_wrapper)
 
+        # The preview rows are also written to a small buffer so the preview can be saved without copying
+        preview_csv_writer = csv.writer(self.preview_text_wrapper)
+
         # Write the header
-        self.cols = result.keys()
+        self.cols = [str(col) for col in result.keys()]
         csv_writer.writerow(self.cols)  # Write column names as header
+        preview_csv_writer.writerow(self.cols)
 
         # Process rows one by one and upload in chunks
         # HACK: Use pagination since server-side cursors aren't available for redshift
         for row in result:
+            if self.total_row_counter % self.row_index.interval == 0:
+                self.text_wrapper.flush()
+                self.row_index.offsets.append(self.uploaded_byte_ct + self.buffer.tell())
             if self.counter <= constants.AI_RESULT_PREVIEW_CT:
                 self.ai_query_result_view.append(row)
             self.counter += 1
             self.total_row_counter += 1
             cleaned_row = self.clean_row(row)  # Clean the row to handle newlines
             csv_writer.writerow(cleaned_row)
+            if self.total_row_counter <= RESULT_PREVIEW_CT:
+                preview_csv_writer.writerow(cleaned_row)
 
             # Save the preview if it hasn't been saved
-            if self.counter == 100 and not self.saved_preview:
+            if self.total_row_counter == RESULT_PREVIEW_CT and not self.saved_preview:
                 self.save_preview()
 
             # Flush the underlying buffer after writing - only flush every 500 rows to improve performance
             if self.counter > self.chunk_size:
                 self.counter = 0
-                if not self.multipart_upload:
-                    self.create_multipart_upload()
-                self.upload_chunk()
+                try:
+                    self.upload_chunk()
+                except UploadLimitReached:
+                    logger.warning(f"Aborted the upload after {self.upload_chunk_limit} parts")
+                    break
 
-        # Complete the multipart upload
+        self.text_wrapper.flush()
+        self.row_index.columns = self.cols
+        self.row_index.row_ct = self.total_row_counter
+        self.row_index.file_size = self.uploaded_byte_ct + self.buffer.tell()
+        self.finish_upload()
+        if self.total_row_counter == 1:
+            self.get_metric_value(
+                small_model_info=small_model_info, initial_prompt=initial_prompt, sql_query=sql_query
+            )
+        return self.create_query_result(sql_query=sql_query)
+
+    def finish_upload(self):
+        """Upload the rest of the result and its row index"""
+        if self.aborted_upload:
+            return
         if self.multipart_upload:
             self.complete_multipart_upload()
         else:
             # Otherwise use a single upload
             self.single_upload()
+        self.result_store.put_object(
+            key=get_row_index_file_name(self.s3_file_key),
+            body=self.row_index.to_json().encode("utf-8"),
+            content_type="application/json",
+        )
+
+    def write_exported_csv(self, data: bytes) -> None:
+        """Write CSV bytes from an exporter and upload a part once the buffer is large enough"""
+        self.row_counter.feed(data)
+        self.buffer.write(data)
+        if self.buffer.tell() < self.upload_size:
+            return
+        if not self.saved_preview:
+            self.save_exported_preview()
+        self.upload_chunk()
+
+    def save_exported_preview(self):
+        self.preview_buffer.write(self.row_counter.head)
+        self.save_preview()
+
+    def upload_exported_result(
+        self,
+        exporter: SQLResultExporter,
+        conn: sa.Connection,
+        small_model_info: sch.ModelInfo,
+        initial_prompt: str,
+        sql_query: str,
+    ) -> sch.QueryResult:
+        """Upload a result exported by the database as CSV
+
+        The rows are counted from the byte stream and only the preview rows are parsed.
+        """
+        try:
+            exporter.export(conn=conn, sql_query=sql_query, file=ExportedCSVFile(uploader=self))
+        except UploadLimitReached:
+            logger.warning(f"Aborted the upload after {self.upload_chunk_limit} parts")
+        head_rows = self.row_counter.get_head_rows()
+        self.cols = head_rows[0] if head_rows else []
+        # Nulls are exported as empty values
+        preview_rows = [
+            tuple(value if value != "" else None for value in row)
+            for row in head_rows[1 : constants.AI_RESULT_PREVIEW_CT + 1]
+        ]
+        self.ai_query_result_view = get_rows(columns=self.cols, rows=preview_rows)
+        self.total_row_counter = self.counter = max(self.row_counter.row_ct - 1, 0)
+        self.row_index.columns = self.cols
+        self.row_index.row_ct = self.total_row_counter
+        self.row_index.file_size = self.row_counter.byte_ct
+        if not self.saved_preview and not self.aborted_upload:
+            self.save_exported_preview()
+        self.finish_upload()
         if self.counter == 1:
             self.get_metric_value(
                 small_model_info=small_model_info, initial_prompt=initial_prompt, sql_query=sql_query
@@ -356,11 +879,11 @@ Metric Value: {self.metric_value}\n
         num_rows = self.total_row_counter
         num_cols = len(self.cols)
         result_type = get_result_type(num_rows=num_rows, num_cols=num_cols)
-        file_size_est_base = self.upload_size * self.chunk_counter
+        file_size_est_base = self.upload_size_mb * self.chunk_counter
         file_size_est = f"<{self.upload_size_mb}MB" if file_size_est_base == 0 else f"{file_size_est_base}MB"
         logger.debug(f"File has {num_rows} rows and {num_cols} columns. Estimated file size is {file_size_est}")
-        result_file_path = get_s3_file_path(s3_file_key=self.s3_file_key, bucket_name=self.bucket_name)
-        preview_file_path = get_s3_file_path(s3_file_key=self.preview_file_name, bucket_name=self.bucket_name)
+        result_file_path = self.result_store.get_file_path(self.s3_file_key)
+        preview_file_path = self.result_store.get_file_path(self.preview_file_name)
         logger.info("Here is the result file path: %s", result_file_path)
         logger.info("Here is the result preview file path: %s", preview_file_path)
         return sch.QueryResult(
@@ -379,81 +902,96 @@ Metric Value: {self.metric_value}\n
             aborted_upload=self.aborted_upload,
         )
 
-    async def upload_file(self, file: UploadFile) -> pd.DataFrame:
+    async def upload_file(self, file: UploadFile) -> dict[str, str]:
+        """Convert the CSV file to Parquet while it is read and upload it
+
+        Returns
+        -------
+        dtypes
+            The inferred type of each column
+        """
         # Update the prefix since all files for Athena need to be in a single directory
         self.prefix = get_s3_upload_prefix(prefix=self.prefix, result_uuid=self.result_uuid)
+        parser = CSVStreamParser()
+        rows: list[list[str]] = []
+        column_names: list[str] = []
+        dtypes: dict[str, str] = {}
+        writer: Optional[pq.ParquetWriter] = None
+        # The file is replaced if the types of columns are widened
+        parquet_file: IO[bytes] = tempfile.TemporaryFile()
+        try:
+            while True:
+                chunk = await file.read(CSV_INGEST_CHUNK_BYTES)
+                rows += parser.feed(chunk, final=not chunk)
+                if not column_names and rows:
+                    column_names = get_column_names(header=rows.pop(0))
+                # Infer the types once there is a large enough sample
+                if not dtypes and column_names and (len(rows) >= CSV_TYPE_SAMPLE_ROWS or not chunk):
+                    sample, _ = convert_csv_rows(
+                        rows=rows[:CSV_TYPE_SAMPLE_ROWS], dtypes=dict.fromkeys(column_names, "")
+                    )
+                    dtypes = {column: infer_column_dtype(sample[column].dropna()) for column in column_names}
+                    writer = get_parquet_writer(parquet_file=parquet_file, dtypes=dtypes)
+                if writer and (len(rows) >= PARQUET_BATCH_ROWS or not chunk):
+                    # Converting and compressing the batch is CPU bound, so keep it off the event loop
+                    df, batch_dtypes = await asyncio.to_thread(convert_csv_rows, rows=rows, dtypes=dtypes)
+                    if batch_dtypes != dtypes:
+                        logger.info(
+                            "Widening the types of columns %s for the upload",
+                            [column for column, dtype in batch_dtypes.items() if dtype != dtypes[column]],
+                        )
+                        dtypes = batch_dtypes
+                        writer, parquet_file = await asyncio.to_thread(
+                            widen_parquet_file, writer=writer, parquet_file=parquet_file, dtypes=dtypes
+                        )
+                    await asyncio.to_thread(write_parquet_batch, writer=writer, df=df)
+                    rows = []
+                if not chunk:
+                    break
+            if not writer:
+                raise ValueError("The uploaded file is empty")
+            writer.close()
+            parquet_file.seek(0)
+            # Large files are uploaded in parts concurrently
+            await asyncio.to_thread(self.result_store.upload_fileobj, parquet_file, self.s3_file_key)
+        finally:
+            parquet_file.close()
+        return dtypes
 
-        # Create buffer
-        buffer = io.StringIO()
-        writer = csv.writer(self.text_wrapper)
-
-        # Stream and write headers
-        chunk = await file.read(self.chunk_size)  # Small chunk to get headers
-        text = chunk.decode("utf-8")
-
-        # Initialize multipart upload
-        self.create_multipart_upload()
-        headers: list = []
-
-        # Process rest of file
-        while chunk:
-            if buffer.tell() >= self.upload_size:
-                self.upload_chunk()
-                writer = csv.writer(buffer)
-
-            for row in csv.reader(text.splitlines()):
-                if len(headers) <= 5:
-                    headers.append(row)
-                writer.writerow(row)
-
-            chunk = await file.read(self.chunk_size)
-            text = chunk.decode("utf-8") if chunk else ""
-
-        # Upload final chunk
-        self.complete_multipart_upload()
-        return pd.DataFrame(data=headers[1:], columns=headers[0])
+    @property
+    def athena_table_name(self) -> str:
+        table_suffix = str(self.result_uuid).replace("-", "_")
+        return f"default.uploaded_table_{table_suffix}"
 
-    def _create_table_from_csv(self, headers: pd.DataFrame):
-        schema = {col: get_athena_type(headers[col].dtype) for col in headers.columns.tolist()}
-        table_suffix = str(copy.copy(self.result_uuid)).replace("-", "_")
+    def get_create_table_query(self, dtypes: dict[str, str]) -> str:
         table_location = get_s3_folder_path(prefix=self.prefix, bucket_name=self.bucket_name)
-        table_name = f"default.uploaded_table_{table_suffix}"
-        create_table = f"""
-    CREATE EXTERNAL TABLE IF NOT EXISTS {table_name} (
-    {", ".join(f"{str(column)} {dtype}" for column, dtype in schema.items())}
+        return f"""
+    CREATE EXTERNAL TABLE IF NOT EXISTS {self.athena_table_name} (
+    {", ".join(f"`{column}` {get_athena_type(dtype)}" for column, dtype in dtypes.items())}
     )
-    ROW FORMAT SERDE 'org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe'
-    WITH SERDEPROPERTIES ('field.delim' = ',')
-    STORED AS INPUTFORMAT 'org.apache.hadoop.mapred.TextInputFormat' OUTPUTFORMAT \
-    'org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat'
+    STORED AS PARQUET
     LOCATION '{table_location}'
-    TBLPROPERTIES ('classification' = 'csv','skip.header.line.count'='1');"""
+    TBLPROPERTIES ('classification' = 'parquet');"""
 
-        query_execution = self.athena_client.start_query_execution(
-            QueryString=create_table, ResultConfiguration={"OutputLocation": f"s3://{self.bucket_name}/query_outputs"}
-        )
-        execution_id = query_execution["QueryExecutionId"]
-        query_details = self.athena_client.get_query_execution(QueryExecutionId=execution_id)
-
-        count = 0
-        query_state = query_details["QueryExecution"]["Status"]["State"]
-        while query_state not in ["SUCCEEDED", "FAILED", "CANCELED"]:
-            # wait n seconds
-            time.sleep(1)
-            max_time = 30
-            if count >= max_time:
-                logger.warning("Athena table creation failed after %s seconds", count)
-                break
-            query_details = self.athena_client.get_query_execution(QueryExecutionId=execution_id)
-            query_state = query_details["QueryExecution"]["Status"]["State"]
-            count += 1
-        logger_msg = f"Athena table creation {query_state} after {count} seconds"
-        logger.info("Athena table location: %s", table_location)
-        logger.info("Athena table name: %s", table_name)
-        if query_state != "SUCCEEDED":
-            logger.warning(logger_msg)
-        else:
-            logger.info(logger_msg)
+    async def _create_table_from_upload(self, dtypes: dict[str, str]) -> str:
+        """Create the Athena table for the uploaded file
+
+        Returns
+        -------
+        query_state
+            The final state of the DDL query
+        """
+        query_state = await self.athena_runner.run_query(query=self.get_create_table_query(dtypes=dtypes))
+        log_table_creation(table_name=self.athena_table_name, query_state=query_state)
+        return query_state
+
+
+def log_table_creation(table_name: str, query_state: str) -> None:
+    logger_msg = f"Athena table creation {query_state} for {table_name}"
+    if query_state != "SUCCEEDED":
+        logger.warning(logger_msg)
+    else:
+        logger.info(logger_msg)
 
 
 def get_athena_type(pd_type) -> str:
@@ -475,8 +1013,10 @@ def get_athena_type(pd_type) -> str:
         "object": "string",
         "string": "string",
         "category": "string",
+        "Int64": "bigint",
         # Boolean
         "bool": "boolean",
+        "boolean": "boolean",
         # Date/Time
         "datetime64[ns]": "timestamp",
         "datetime64[ms]": "timestamp",
@@ -501,17 +1041,45 @@ async def upload_csv_to_s3(
 
     # Upload file
     t1 = time.time()
-    headers = await uploader.upload_file(file=file)
+    dtypes = await uploader.upload_file(file=file)
     t2 = time.time()
     logger.debug(f"Time to upload file: {t2-t1}s")
-    # Get datatypes and create table
+    # Create the table using the inferred datatypes
     t1 = time.time()
-    await asyncio.to_thread(uploader._create_table_from_csv, headers=headers)
+    await uploader._create_table_from_upload(dtypes=dtypes)
     t2 = time.time()
     logger.debug(f"Time to create table: {t2-t1}s")
     return sch.UploadResult(result_uuid=result_uuid, s3_file_key=uploader.s3_file_key)
 
 
+async def upload_csvs_to_s3(
+    db_conn_params: sch.SQLDBSchema, files: list[UploadFile], client_id: int
+) -> list[sch.UploadResult]:
+    """Upload several CSV files and create their Athena tables concurrently"""
+    if not files:
+        return []
+    uploaders = [
+        S3Uploader(db_conn_params=db_conn_params, client_id=client_id, type="csv", result_uuid=uuid.uuid4())
+        for _ in files
+    ]
+    t1 = time.time()
+    all_dtypes = await asyncio.gather(*[uploader.upload_file(file=file) for uploader, file in zip(uploaders, files)])
+    t2 = time.time()
+    logger.debug(f"Time to upload {len(files)} files: {t2-t1}s")
+    # Every uploader uses the same storage connection, so one Athena client is enough
+    t1 = time.time()
+    query_states = await uploaders[0].athena_runner.run_queries(
+        queries=[uploader.get_create_table_query(dtypes=dtypes) for uploader, dtypes in zip(uploaders, all_dtypes)]
+    )
+    t2 = time.time()
+    logger.debug(f"Time to create {len(files)} tables: {t2-t1}s")
+    for uploader, query_state in zip(uploaders, query_states):
+        log_table_creation(table_name=uploader.athena_table_name, query_state=query_state)
+    return [
+        sch.UploadResult(result_uuid=uploader.result_uuid, s3_file_key=uploader.s3_file_key) for uploader in uploaders
+    ]
+
+
 def upload_sql_to_s3(
     conn: sa.Connection,
     db_conn_params: sch.SQLDBSchema,
@@ -520,13 +1088,38 @@ def upload_sql_to_s3(
     client_id: int,
     small_model_info: sch.ModelInfo,
     result_uuid: Optional[uuid.UUID] = None,
+    database_type: Optional[enums.DatabaseType] = None,
 ) -> sch.QueryResult:
+    """Run the query and upload the result as CSV
+
+    Parameters
+    ----------
+    database_type
+        The type of the client database. A faster export is used when the database supports it.
+    """
     uploader = S3Uploader(
         db_conn_params=db_conn_params,
         client_id=client_id,
         type="sql",
         result_uuid=result_uuid,
     )
+    exporter = get_sql_result_exporter(conn=conn, database_type=database_type)
+    if exporter:
+        try:
+            return uploader.upload_exported_result(
+                exporter=exporter,
+                conn=conn,
+                small_model_info=small_model_info,
+                initial_prompt=initial_prompt,
+                sql_query=sql_query,
+            )
+        except ExportNotSupported as e:
+            # Fall back to the row by row upload for queries the export doesn't support
+            if uploader.row_counter.row_ct or uploader.multipart_upload:
+                raise e
+            logger.warning(f"Error exporting the result, uploading it row by row instead: {str(e)}")
+            uploader.buffer.seek(0)
+            uploader.buffer.truncate(0)
     with conn.execute(sa.text(sql_query)) as result:
         upload_result = uploader.upload_sql_result(
             result=result, small_model_info=small_model_info, initial_prompt=initial_prompt, sql_query=sql_query
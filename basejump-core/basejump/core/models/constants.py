@@ -19,6 +19,8 @@ MAX_THOUGHT_TIME = 60
 MSG_TIMED_OUT = "Message timed out. Please try again."
 AI_RESULT_PREVIEW_CT = 10
 MAX_ITERATIONS = 15
+# Tables with more columns than this have their columns indexed and pruned to the relevant ones
+WIDE_TABLE_COLUMN_CT = 50
 MAX_CHAT_HISTORY_DAYS = 365
 # This distance is close enough that is likely only affects the SQL where clause
 REDIS_SEMCACHE_SIMILAR_DISTANCE = 0.3
@@ -26,6 +26,7 @@ class VectorVendorType(StrEnum):
 class VectorSourceType(StrEnum):
     TABLE = "TABLE"
     CHAT = "CHAT"
+    COLUMN = "COLUMN"
 
 
 class DatabaseType(StrEnum):
@@ -126,6 +127,20 @@ class VerifyMode(StrEnum):
     EXPLORE = "EXPLORE"
 
 
+class StorageProvider(StrEnum):
+    """Where results are saved"""
+
+    AWS_S3 = "AWS_S3"
+    LOCAL = "LOCAL"  # The bucket name is the directory results are saved to
+
+
+class SchemaFormat(StrEnum):
+    """How table schemas are rendered in prompts"""
+
+    YAML = "YAML"
+    COMPACT = "COMPACT"  # One line per column to use fewer tokens
+
+
 class MessageType(StrEnum):
     """Webhook response type"""
 
@@ -139,6 +154,8 @@ class MessageType(StrEnum):
     # This should only have a blank response and is only to indicate completion of a thought block
     SOLUTION = "solution"
     INIT = "initial"
+    # Partial content of the final response while it is still being generated. Each one holds the new text only.
+    PARTIAL = "partial"
 
 
 class ResultType(StrEnum):
@@ -196,6 +196,12 @@ class DBAliasConflict(Exception):
 
 
 RESULT_UUID_NOT_FOUND = "Result not found based on the provided UUID"
+RESULT_DATA_DELETED = "The originally created data for this result has been deleted. Please run the query again."
+
+
+class ResultDataDeleted(Exception):
+    def __init__(self):
+        super().__init__(RESULT_DATA_DELETED)
 
 
 class SQLIndexError(Exception):
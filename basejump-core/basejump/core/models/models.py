@@ -83,6 +83,7 @@ class Client(Base):
     client_name: Mapped[str]
     client_type: Mapped[enums.ClientType]
     verify_mode: Mapped[enums.VerifyMode] = mapped_column(server_default=enums.VerifyMode.EXPLORE.value)
+    schema_format: Mapped[enums.SchemaFormat] = mapped_column(server_default=enums.SchemaFormat.YAML.value)
     llm: Mapped[enums.AIModelSchemaClientOptions] = mapped_column(
         sa.Enum(
             enums.AIModelSchemaClientOptions,
@@ -6,6 +6,11 @@ from basejump.core.models import schemas as sch
 
 logger = set_logging(handler_option="stream", name=__name__)
 
+COMPACT_SCHEMA_LEGEND = (
+    "Each table starts with 'table <name> -- <description>' followed by one line per column: "
+    "<column> <type> [PK] [-> <foreign table>.<foreign column>] [values: <distinct values>] [-- <description>]\n\n"
+)
+
 DB_METADATA_PROMPT = (
     "Here are the SQL tables relevant to your following inquiry (in order of relevance): {inquiry}\n"
     "When creating a SQL query, only use the tables listed below:\n"
@@ -579,10 +579,13 @@ class ChatMetadata(BaseModel):
     send_message: bool = False
     webhook_url: Optional[str] = None
     webhook_headers: Optional[dict] = None
+    stream_messages: bool = False  # Also append every API message to the chat's Redis Stream
+    stream_response: bool = False  # Send the final response in partial messages as it is generated
     return_sql_in_thoughts: bool = False
     chat_in_index: bool = False
     semcache_response: Optional[SemCacheResponse] = None
     verify_mode: enums.VerifyMode = enums.VerifyMode.EXPLORE
+    schema_format: enums.SchemaFormat = enums.SchemaFormat.YAML
     vector_store: BasePydanticVectorStore
     embedding_model_info: AzureModelInfo
 
@@ -684,3 +687,14 @@ class IndexedTables(BaseModel):
 class UploadResult(BaseModel):
     result_uuid: uuid.UUID
     s3_file_key: str
+
+
+class ResultPage(BaseModel):
+    """A page of rows from a result file"""
+
+    columns: list[str]
+    rows: list[list[str]]
+    start_row: int
+    num_rows: Optional[int] = Field(
+        default=None, description="The number of rows in the result. Only known for results with a row index."
+    )
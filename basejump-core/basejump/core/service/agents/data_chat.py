@@ -7,9 +7,10 @@ from random import choice
 from typing import Optional, Sequence
 
 from basejump.core.common.config.logconfig import set_logging
-from basejump.core.database import db_auth
+from basejump.core.database import db_auth, upload
+from basejump.core.database.catalog_cache import catalog_cache
 from basejump.core.database.crud import crud_chat, crud_result
-from basejump.core.database.db_connect import ConnectDB
+from basejump.core.database.db_connect import ConnectDB, LocalSession
 from basejump.core.database.vector_utils import init_semcache
 from basejump.core.models import constants, enums, models
 from basejump.core.models import schemas as sch
@@ -26,6 +27,8 @@ from sqlalchemy.ext.asyncio import AsyncEngine
 
 logger = set_logging(handler_option="stream", name=__name__)
 
+TOOL_SETUP_CONCURRENCY = 4  # Max number of connections to set up tools for at once
+
 
 class DataChatAgent(BaseChatAgent):
     """
@@ -83,9 +86,15 @@ class DataChatAgent(BaseChatAgent):
         self.connections = []
         for conn in connections:
             assert isinstance(conn, models.DBConn)
-            conn_db = await ConnectDB.get_db_conn(db_conn=conn, db_params=conn.database_params)
+            # Decrypting the connection params is slow, so reuse them until the connection changes
+            fingerprint = catalog_cache.get_conn_fingerprint(db_conn=conn, db_params=conn.database_params)
+            conn_params = catalog_cache.get_conn_params(conn_id=conn.conn_id, fingerprint=fingerprint)
+            if not conn_params:
+                conn_db = await ConnectDB.get_db_conn(db_conn=conn, db_params=conn.database_params)
+                conn_params = conn_db.conn_params
+                catalog_cache.set_conn_params(conn_id=conn.conn_id, fingerprint=fingerprint, conn_params=conn_params)
             conn_schema = sch.SQLConnSchema(
-                conn_params=conn_db.conn_params,
+                conn_params=conn_params,
                 conn_id=conn.conn_id,
                 conn_uuid=str(conn.conn_uuid),
                 db_id=conn.db_id,
@@ -94,8 +103,8 @@ class DataChatAgent(BaseChatAgent):
             )
             self.connections.append(conn_schema)
         await self.db.commit()  # NOTE: Closing transaction to avoid idle in transaction
-        for connection in self.connections:
-            self.sql_tool = sql.SQLTool(
+        sql_tools = [
+            sql.SQLTool(
                 agent=self,
                 db=self.db,
                 db_conn_params=self.db_conn_params,
@@ -112,18 +121,55 @@ class DataChatAgent(BaseChatAgent):
                 embedding_model_info=self.embedding_model_info,
                 sql_engine=self.sql_engine,
             )
-            await self.sql_tool.post_init()
-            tools += self.sql_tool.tools
+            for connection in self.connections
+        ]
+        # Set up the connections concurrently so one slow or failing connection doesn't hold up the others
+        semaphore = asyncio.Semaphore(TOOL_SETUP_CONCURRENCY)
+        results = await asyncio.gather(
+            *[
+                self._setup_sql_tool(sql_tool=sql_tool, semaphore=semaphore, own_session=len(sql_tools) > 1)
+                for sql_tool in sql_tools
+            ],
+            return_exceptions=True,
+        )
+        ready_connections = []
+        setup_errors = []
+        for connection, sql_tool, result in zip(self.connections, sql_tools, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                logger.error(f"Error setting up the tools for conn_id {connection.conn_id}: {str(result)}")
+                setup_errors.append(result)
+                continue
+            ready_connections.append(connection)
+            self.sql_tool = sql_tool
+            tools += sql_tool.tools
+        if setup_errors and not ready_connections:
+            raise setup_errors[0]
+        self.connections = ready_connections
         vis_tool = visualize.VisTool(
             db=self.db,
             agent=self,
             llm=self.agent_llm,
             small_model_info=self.small_model_info,
             embedding_model_info=self.embedding_model_info,
+            db_conn_params=self.db_conn_params,
+            connections=self.connections,
         )
         tools.append(vis_tool.get_plot_tool())
         return tools
 
+    async def _setup_sql_tool(self, sql_tool: sql.SQLTool, semaphore: asyncio.Semaphore, own_session: bool) -> None:
+        async with semaphore:
+            if not own_session:
+                await sql_tool.post_init()
+                return
+            # NOTE: Each task needs its own session since sessions can't be used concurrently
+            local_session = LocalSession(client_id=self.prompt_metadata.client_id, engine=self.sql_engine)
+            Session = await local_session.get_session()
+            async with Session() as session:
+                await sql_tool.post_init(db=session)
+
     async def check_semcache(self, prompt) -> Optional[sch.Message]:
         try:
             # TODO: Determine why the semantic cache has issues initializing sometimes
@@ -194,12 +240,17 @@ class DataChatAgent(BaseChatAgent):
                         small_model_info=self.small_model_info,
                         db_conn_params=self.db_conn_params,
                     )
-                    file_gen_func = service_utils.get_file_generator_func(result.result_file_path)
-                    stream_gen = file_gen_func(result.result_file_path)
-                    rows_base = next(stream_gen)
-                    rows = [tuple(row.split(",")) for row in rows_base.decode("utf-8").splitlines()]
+                    # Include the header as the first row
+                    result_page = await asyncio.to_thread(
+                        service_utils.get_result_page,
+                        file_path=result.result_file_path,
+                        start_row=0,
+                        end_row=constants.AI_RESULT_PREVIEW_CT - 1,
+                    )
                     query_res = sch.QueryResult(
-                        query_result=rows[: constants.AI_RESULT_PREVIEW_CT],
+                        query_result=upload.get_rows(
+                            columns=result_page.columns, rows=[result_page.columns] + result_page.rows
+                        ),
                         preview_row_ct=constants.AI_RESULT_PREVIEW_CT,
                         num_rows=result.row_num_total,
                         num_cols=1,  # just a placeholder since it isn't used in the prompt
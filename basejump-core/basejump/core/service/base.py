@@ -9,7 +9,6 @@ from datetime import datetime, timedelta
 from typing import Optional, Union, Sequence
 from zoneinfo import ZoneInfo
 
-import aiohttp
 import redis
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.database import db_utils
@@ -19,6 +18,9 @@ from basejump.core.database.crud.crud_utils import create_callback_mgrs
 from basejump.core.database.db_connect import LocalSession
 from basejump.core.models import constants, enums, errors, models
 from basejump.core.models import schemas as sch
+from basejump.core.service.chat_history import chat_history_trimmer
+from basejump.core.service.message_stream import publish_chat_message
+from basejump.core.service.webhook import get_webhook_dispatcher
 from llama_index.core.agent import FunctionCallingAgent
 from llama_index.core.agent.react.output_parser import (
     COULD_NOT_PARSE_TXT,
@@ -41,10 +43,13 @@ from llama_index.vector_stores.redis import RedisVectorStore
 from llama_index.vector_stores.redis.base import NO_DOCS
 from redis.asyncio import Redis as RedisAsync
 from redisvl.schema import IndexSchema
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
 logger = set_logging(handler_option="stream", name=__name__)
 
+# Holds references to background tasks so they aren't garbage collected before they finish
+background_tasks: set[asyncio.Task] = set()
+
 
 class MessageHandler:
     def __init__(
@@ -188,18 +193,28 @@ class ChatMessageHandler(MessageHandler):
 
     async def _send_api_message(self, api_message: str):
         logger.debug("Webhook API message: %s", api_message)
+        if self.chat_metadata.stream_messages:
+            # The webhook is still sent if the message can't be streamed
+            try:
+                await publish_chat_message(
+                    redis_client_async=self.redis_client_async,
+                    chat_uuid=self.chat_metadata.chat_uuid,
+                    api_message=api_message,
+                    msg_type=self.message.msg_type,
+                )
+            except Exception as e:
+                logger.warning("Error streaming chat message: %s", str(e))
         try:
             assert self.chat_metadata.webhook_url
-            webhook_url = self.chat_metadata.webhook_url
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    headers={**self.chat_metadata.webhook_headers, "Content-Type": "application/json"},  # type: ignore
-                    url=webhook_url,
-                    data=api_message,
-                ) as response:
-                    if response.status != 200:
-                        logger.warning("Webhook status response: %s", response.status)
-                        logger.warning("Webhook status text: %s", response.text)
+            # Thoughts and partial responses are queued without waiting, everything else waits for delivery
+            await get_webhook_dispatcher().send(
+                queue_key=str(self.chat_metadata.chat_uuid),
+                url=self.chat_metadata.webhook_url,
+                headers=self.chat_metadata.webhook_headers or {},
+                payload=api_message,
+                msg_type=self.message.msg_type,
+                wait=self.message.msg_type not in [enums.MessageType.THOUGHT, enums.MessageType.PARTIAL],
+            )
         except AssertionError:
             logger.debug("No webhook URL found")
             logger.debug("Webhook header values %s", str(self.chat_metadata.webhook_headers))
@@ -268,40 +283,68 @@ class ChatMessageHandler(MessageHandler):
         assert isinstance(self.prompt_metadata, sch.PromptMetadata)
         # TODO: Performance could possibly be improved to not update the vector DB table every time
         # for the index_created flg
-        await crud_chat.index_chat_history(
+        chat_history_to_index = await crud_chat.get_chat_history_to_index(
+            db=db, chat_id=self.chat_metadata.chat_id, chat_history=self.chat_metadata.curr_chat_history
+        )
+        # The messages are marked as indexed by the background task once they are in the vector DB
+        await crud_chat.upsert_messages(
             db=db,
-            client_uuid=self.prompt_metadata.client_uuid,
-            chat_id=self.chat_metadata.chat_id,
-            chat_uuid=self.chat_metadata.chat_uuid,
-            vector_id=self.chat_metadata.vector_id,
-            chat_history=self.chat_metadata.curr_chat_history,
-            callback_manager=self.prompt_metadata.callback_manager,
-            vector_store=self.chat_metadata.vector_store,
-            embedding_model_info=self.chat_metadata.embedding_model_info,
+            messages=self.chat_metadata.curr_chat_history,
+            prompt_metadata=self.prompt_metadata,
+            chat_metadata=self.chat_metadata,
+            query_result=self.query_result,
         )
-        for api_message in self.chat_metadata.curr_chat_history:
-            await crud_chat.save_message(
-                db=db,
-                message=api_message,
-                prompt_metadata=self.prompt_metadata,
-                chat_metadata=self.chat_metadata,
-                query_result=self.query_result,
-                msg_in_index=True,
-            )
+        # Embedding and writing to the vector DB is done in the background so the reply isn't held up
+        assert isinstance(db.bind, AsyncEngine)
+        task = asyncio.create_task(
+            self._index_chat_messages(engine=db.bind, chat_history=chat_history_to_index),
+            name=f"index_chat_{self.chat_metadata.chat_uuid}",
+        )
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
         # Remove everything from current chat history
         self.chat_metadata.curr_chat_history = []
         # Remove extra chat history to prevent vector DB from getting too large
-        msg_uuids = await crud_chat.get_chat_history_for_chats(db=db, chat_ids=[self.chat_metadata.chat_id])
-        len_chats = len(msg_uuids)
-        if len_chats > constants.MAX_CHAT_HISTORY:
-            # Find the number of chat messages to remove
-            chat_num_to_remove = len_chats - constants.MAX_CHAT_HISTORY
-            await crud_chat.delete_chat_msgs_from_vector(
-                db=db,
-                client_id=self.prompt_metadata.client_id,
-                msg_uuids=msg_uuids[:chat_num_to_remove],
-                redis_client_async=self.redis_client_async,
+        # Chats are trimmed in batches per client, so a task is only started if one isn't pending already
+        if chat_history_trimmer.add(client_id=self.prompt_metadata.client_id, chat_id=self.chat_metadata.chat_id):
+            task = asyncio.create_task(
+                chat_history_trimmer.trim_later(
+                    client_id=self.prompt_metadata.client_id,
+                    engine=db.bind,
+                    redis_client_async=self.redis_client_async,
+                ),
+                name=f"trim_chat_history_{self.prompt_metadata.client_id}",
+            )
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+    async def _index_chat_messages(self, engine: AsyncEngine, chat_history: list[sch.APIMessage]) -> None:
+        """Index the messages and then mark them as indexed
+
+        If indexing fails or is cancelled, the messages stay unindexed and are indexed with the next prompt.
+
+        Parameters
+        ----------
+        engine
+            The engine for the client's schemas. The session used for the chat may be closed before this finishes.
+        """
+        assert isinstance(self.prompt_metadata, sch.PromptMetadata)
+        try:
+            await crud_chat.index_chat_messages(
+                client_uuid=self.prompt_metadata.client_uuid,
+                chat_uuid=self.chat_metadata.chat_uuid,
+                chat_history=chat_history,
+                callback_manager=self.prompt_metadata.callback_manager,
+                vector_store=self.chat_metadata.vector_store,
+                embedding_model_info=self.chat_metadata.embedding_model_info,
             )
+            session = async_sessionmaker(bind=engine, autocommit=False, autoflush=False, expire_on_commit=False)
+            async with session() as db:
+                await crud_chat.mark_chat_messages_indexed(
+                    db=db, chat_id=self.chat_metadata.chat_id, msg_uuids=[msg.msg_uuid for msg in chat_history]
+                )
+        except Exception as e:
+            logger.error("Error indexing chat history: %s", str(e))
 
     async def _send_solution_message(self, db: AsyncSession):
         try:
@@ -522,6 +565,37 @@ Don't structure your output with the keywords and keyphrases since they're only
         return chat_history
 
 
+class ResponseFilter:
+    """Removes the agent's reasoning from the final response one sentence at a time
+
+    Sentences mentioning "Option 1:" are dropped and the "Answer:" and "Thought:" prefixes are removed. Text is
+    buffered until a sentence is complete so the same filter works on a full response or a stream of tokens.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.has_output = False
+
+    def _filter_sentence(self, sentence: str) -> str:
+        if "Option 1:" in sentence:
+            return ""
+        # Add back the period the sentences were split on
+        prefix = "." if self.has_output else ""
+        self.has_output = True
+        return prefix + sentence.replace("Answer:", "").replace("Thought:", "")
+
+    def push(self, text: str) -> str:
+        """Add text and return the filtered content of any sentences it completed"""
+        self.buffer += text
+        *sentences, self.buffer = self.buffer.split(".")
+        return "".join(self._filter_sentence(sentence) for sentence in sentences)
+
+    def flush(self) -> str:
+        """Return the filtered content of the remaining text"""
+        sentence, self.buffer = self.buffer, ""
+        return self._filter_sentence(sentence)
+
+
 class BaseAgent(ABC):
     """Concrete class for agents
 
@@ -549,6 +623,7 @@ class BaseAgent(ABC):
         self.chat_history = chat_history or []
         self.max_iterations = max_iterations  # NOTE: This only works with streaming off
         self.sql_engine = sql_engine
+        self.redis_client_async = redis_client_async
 
     @abstractmethod
     def get_llm_type() -> enums.LLMType:  # type: ignore
@@ -679,21 +754,36 @@ instructions for the expected output format: \n{EXPECTED_OUTPUT_INSTRUCTIONS}\
         prompt
             The prompt to chat with the AI
         """
+        response_filter = ResponseFilter()
         if isinstance(self.agent, FunctionCallingAgent):
+            # NOTE: The function calling agent does not support streaming, so the response is always awaited
             agent_output = await self.agent.achat(
                 message=prompt, task=task, chat_history=chat_history, input=input, step=step
             )
+            response = response_filter.push(agent_output.response)
+        elif self._stream_response():
+            streaming_output = await self.agent.astream_chat(message=prompt)
+            response = ""
+            async for token in streaming_output.async_response_gen():
+                partial_response = response_filter.push(token)
+                if partial_response:
+                    response += partial_response
+                    await self._send_partial_response(content=partial_response)
         else:
             agent_output = await self.agent.achat(message=prompt)
-        response_list = []
-        for sentence in agent_output.response.split("."):
-            if "Option 1:" in sentence:
-                continue
-            else:
-                response_list.append(sentence)
-        response = ".".join(response_list).replace("Answer:", "").replace("Thought:", "")
+            response = response_filter.push(agent_output.response)
+        remaining_response = response_filter.flush()
+        if remaining_response and self._stream_response():
+            await self._send_partial_response(content=remaining_response)
+        response += remaining_response
         return await self._get_message(response=response)
 
+    def _stream_response(self) -> bool:
+        return False
+
+    async def _send_partial_response(self, content: str) -> None:
+        pass
+
     async def provide_input(self, input: str, chat_message: Optional[ChatMessage] = None) -> sch.Message:
         message = await self._chat_base(
             prompt=self.prompt_metadata.initial_prompt,
@@ -808,6 +898,21 @@ https://go.microsoft.com/fwlink/?linkid=2198766"""
             await handler.save_messages(db=self.db)
         return handler.message
 
+    def _stream_response(self) -> bool:
+        # Only send partial messages if there is somewhere to send them
+        return self.chat_metadata.stream_response and self.chat_metadata.send_message
+
+    async def _send_partial_response(self, content: str) -> None:
+        handler = ChatMessageHandler(
+            prompt_metadata=self.prompt_metadata,
+            chat_metadata=self.chat_metadata,
+            redis_client_async=self.redis_client_async,
+        )
+        await handler.create_message(
+            db=self.db, role=MessageRole.ASSISTANT, content=content, msg_type=enums.MessageType.PARTIAL
+        )
+        await handler.send_api_message()
+
     async def response_hook(self, text):
         # If already logged, then create a new message UUID since we are logging per SQL query execution
         # logger.info("Webhook messages: %s", text)
@@ -0,0 +1,75 @@
+"""Trimming of the chat history kept in the vector database"""
+
+import asyncio
+
+from basejump.core.common.config.logconfig import set_logging
+from basejump.core.database.crud import crud_chat
+from basejump.core.models import constants
+from redis.asyncio import Redis as RedisAsync
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+CHAT_HISTORY_TRIM_DELAY = 5  # seconds
+
+
+class ChatHistoryTrimmer:
+    """Removes the oldest messages from the vector database once a chat exceeds the max chat history
+
+    Chats are collected per client and trimmed together after a short delay, so one ranked query covers every
+    chat that had a turn in that time instead of running a query after each turn.
+
+    Parameters
+    ----------
+    delay
+        The number of seconds to collect chats before trimming them
+    max_chat_history
+        The max number of messages to keep in the vector database for each chat
+    """
+
+    def __init__(self, delay: float = CHAT_HISTORY_TRIM_DELAY, max_chat_history: int = constants.MAX_CHAT_HISTORY):
+        self.delay = delay
+        self.max_chat_history = max_chat_history
+        self.pending_chat_ids: dict[int, set[int]] = {}
+
+    def add(self, client_id: int, chat_id: int) -> bool:
+        """Add a chat to the next trim for the client
+
+        Returns
+        -------
+        True if there is no trim pending for the client yet and trim_later needs to be scheduled
+        """
+        chat_ids = self.pending_chat_ids.get(client_id)
+        if chat_ids is not None:
+            chat_ids.add(chat_id)
+            return False
+        self.pending_chat_ids[client_id] = {chat_id}
+        return True
+
+    async def trim_later(self, client_id: int, engine: AsyncEngine, redis_client_async: RedisAsync) -> None:
+        """Wait for more chats to be added and then trim all the chats pending for the client
+
+        Chats that aren't trimmed because this is cancelled or fails are trimmed with the next trim for the chat.
+        """
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            # Chats added after this are collected for a new trim
+            chat_ids = self.pending_chat_ids.pop(client_id, set())
+        try:
+            session = async_sessionmaker(bind=engine, autocommit=False, autoflush=False, expire_on_commit=False)
+            async with session() as db:
+                msg_uuids = await crud_chat.get_overflow_msg_uuids(
+                    db=db, chat_ids=list(chat_ids), max_chat_history=self.max_chat_history
+                )
+                if not msg_uuids:
+                    return
+                logger.info(f"Trimming {len(msg_uuids)} messages from {len(chat_ids)} chats")
+                await crud_chat.delete_chat_msgs_from_vector(
+                    db=db, client_id=client_id, msg_uuids=msg_uuids, redis_client_async=redis_client_async
+                )
+        except Exception as e:
+            logger.error("Error trimming chat history: %s", str(e))
+
+
+chat_history_trimmer = ChatHistoryTrimmer()
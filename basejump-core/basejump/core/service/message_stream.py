@@ -0,0 +1,104 @@
+"""Redis Streams transport for chat messages
+
+Every API message for a chat is appended to a per-chat Redis Stream so frontends and API gateways can
+tail it and resume from the last stream ID they saw after reconnecting.
+"""
+
+import uuid
+from typing import AsyncIterator, Optional, Union
+
+from basejump.core.common.config.logconfig import set_logging
+from basejump.core.models import enums
+from basejump.core.models import schemas as sch
+from redis.asyncio import Redis as RedisAsync
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+CHAT_STREAM_PREFIX = "chat_stream:"
+CHAT_STREAM_MAXLEN = 1000  # Approximate max number of messages kept per chat
+CHAT_STREAM_TTL = 60 * 60 * 24  # Expire idle chat streams after a day
+CHAT_STREAM_START_ID = "0-0"
+MESSAGE_FIELD = "message"
+MSG_TYPE_FIELD = "msg_type"
+
+
+def get_chat_stream_key(chat_uuid: Union[uuid.UUID, str]) -> str:
+    return CHAT_STREAM_PREFIX + str(chat_uuid)
+
+
+def _decode(value: Union[bytes, str]) -> str:
+    # The redis client may or may not be set up with decode_responses
+    return value.decode("UTF-8") if isinstance(value, bytes) else value
+
+
+async def publish_chat_message(
+    redis_client_async: RedisAsync,
+    chat_uuid: Union[uuid.UUID, str],
+    api_message: str,
+    msg_type: enums.MessageType,
+) -> str:
+    """Append a serialized APIMessage to the chat stream
+
+    Returns
+    -------
+    The stream ID of the message which can be used as an offset to resume reading from
+    """
+    stream_key = get_chat_stream_key(chat_uuid=chat_uuid)
+    async with redis_client_async.pipeline(transaction=False) as pipe:
+        pipe.xadd(
+            stream_key,
+            {MESSAGE_FIELD: api_message, MSG_TYPE_FIELD: msg_type.value},
+            maxlen=CHAT_STREAM_MAXLEN,
+            approximate=True,
+        )
+        pipe.expire(stream_key, CHAT_STREAM_TTL)
+        stream_id, _ = await pipe.execute()
+    return _decode(stream_id)
+
+
+async def read_chat_messages(
+    redis_client_async: RedisAsync,
+    chat_uuid: Union[uuid.UUID, str],
+    last_id: str = CHAT_STREAM_START_ID,
+    count: int = 100,
+    block_ms: Optional[int] = None,
+) -> list[tuple[str, sch.APIMessage]]:
+    """Read the chat messages after the provided stream ID
+
+    Parameters
+    ----------
+    last_id
+        The last stream ID the reader has seen. Use the default to read from the start of the stream.
+    block_ms
+        Wait up to this many milliseconds for new messages if there are none. None does not block.
+    """
+    stream_key = get_chat_stream_key(chat_uuid=chat_uuid)
+    response = await redis_client_async.xread({stream_key: last_id}, count=count, block=block_ms)
+    messages = []
+    for _, entries in response or []:
+        for stream_id, fields in entries:
+            fields = {_decode(key): _decode(value) for key, value in fields.items()}
+            messages.append((_decode(stream_id), sch.APIMessage.model_validate_json(fields[MESSAGE_FIELD])))
+    return messages
+
+
+async def tail_chat_messages(
+    redis_client_async: RedisAsync,
+    chat_uuid: Union[uuid.UUID, str],
+    last_id: str = CHAT_STREAM_START_ID,
+    block_ms: int = 5000,
+    stop_on_solution: bool = True,
+) -> AsyncIterator[tuple[str, sch.APIMessage]]:
+    """Yield chat messages as they arrive, starting after last_id
+
+    Stops after a solution message when stop_on_solution is set since that marks the end of a reply.
+    """
+    while True:
+        messages = await read_chat_messages(
+            redis_client_async=redis_client_async, chat_uuid=chat_uuid, last_id=last_id, block_ms=block_ms
+        )
+        for stream_id, message in messages:
+            last_id = stream_id
+            yield stream_id, message
+            if stop_on_solution and message.msg_type == enums.MessageType.SOLUTION:
+                return
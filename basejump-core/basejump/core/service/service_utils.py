@@ -2,13 +2,15 @@
 
 import asyncio
 import copy
+import csv
+import io
+import itertools
 import json
 import uuid
 from asyncio import Task
 from datetime import datetime
 from typing import Callable, Optional
 
-import boto3
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.database import query, upload
 from basejump.core.database.crud import crud_chat, crud_connection, crud_result
@@ -16,9 +18,12 @@ from basejump.core.database.db_connect import ConnectDB
 from basejump.core.database.db_utils import extract_visual_info
 from basejump.core.database.format_response import get_title_description
 from basejump.core.database.index import DBTableIndexer
+from basejump.core.database.response_cache import get_response_cache
+from basejump.core.database.result_store import get_result_store
+from basejump.core.database.storage_cache import boto_client_pool
 from basejump.core.database.upload import S3_PREFIX
 from basejump.core.database.vector_utils import get_index_name
-from basejump.core.models import enums, models
+from basejump.core.models import enums, errors, models
 from basejump.core.models import schemas as sch
 from basejump.core.models.prompts import get_sql_result_prompt
 from basejump.core.service.base import (
@@ -28,6 +33,7 @@ from basejump.core.service.base import (
     SimpleAgent,
 )
 from basejump.core.service.tools.visualize import VisTool
+from botocore.exceptions import ClientError
 from redis.asyncio import Redis as RedisAsync
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.orm.exc import NoResultFound
@@ -240,6 +246,7 @@ async def save_query_results(
         sql_query=sql_query,
         query_result=query_result_str,
         small_model_info=small_model_info,
+        response_cache=get_response_cache(redis_client_async=agent.redis_client_async),
     )
     # Save to the DB
     result_history = await crud_result.save_result_history(
@@ -263,7 +270,10 @@ async def update_agent_tokens(agent: BaseAgent, max_tokens: int = 500):
     # TODO: Update agent to be optional
     if not isinstance(agent, SimpleAgent):
         agent.agent.memory.token_limit = agent.memory.get_llm_token_limit(llm=agent.agent_llm)  # type: ignore
-        agent.agent.agent_worker._llm.max_tokens = max_tokens  # type: ignore
+        # NOTE: LLMs are shared through the AI client pool, so use a copy rather than updating it in place
+        agent.agent.agent_worker._llm = agent.agent.agent_worker._llm.model_copy(  # type: ignore
+            update={"max_tokens": max_tokens}
+        )
         logger.debug("Updated the agent to max_tokens = %s", max_tokens)
 
 
@@ -414,7 +424,7 @@ def stream_s3_file(file_path):
     s3_key, bucket = upload.get_s3_info_from_filepath(file_path)
     try:
         # Fetch the file from S3
-        s3_client = boto3.client("s3")
+        s3_client = boto_client_pool.get_client("s3")
         response = s3_client.get_object(Bucket=bucket, Key=s3_key)
         file_stream = response["Body"]
 
@@ -431,14 +441,74 @@ def stream_s3_file(file_path):
         return
 
 
+def stream_local_file(file_path):
+    """Generator to stream a result file saved to the local filesystem"""
+    result_store, key = get_result_store(file_path=file_path)
+    try:
+        yield from result_store.stream(key=key)
+    except FileNotFoundError:
+        logger.error(f"File not found: {file_path}")
+        raise errors.ResultDataDeleted
+
+
 def get_file_generator_func(file_path) -> Callable:
     if S3_PREFIX in file_path:
         stream_func = stream_s3_file
     else:
-        stream_func = streamfile
+        stream_func = stream_local_file
     return stream_func
 
 
+def read_result_file_bytes(file_path: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+    """Read a result file, or only the bytes from start to end with the end excluded"""
+    s3_client = boto_client_pool.get_client("s3") if S3_PREFIX in file_path else None
+    result_store, key = get_result_store(file_path=file_path, s3_client=s3_client)
+    return result_store.read_bytes(key=key, start=start, end=end)
+
+
+def get_result_page(file_path: str, start_row: int, end_row: int) -> sch.ResultPage:
+    """Read rows [start_row, end_row) of a result file
+
+    Only the bytes that contain the rows are read using the row index saved with the result. Results saved
+    before row indexes were added are read from the start of the file. Rows past the end of the result return
+    an empty page.
+    """
+    if start_row < 0:
+        raise ValueError(f"start_row must not be negative, got {start_row}")
+    try:
+        row_index = upload.RowOffsetIndex.from_json(read_result_file_bytes(upload.get_row_index_file_name(file_path)))
+    except (ClientError, FileNotFoundError):
+        logger.warning(f"No row index found for {file_path}, reading the result from the start")
+        return get_result_page_from_start(file_path=file_path, start_row=start_row, end_row=end_row)
+    end_row = min(end_row, row_index.row_ct)
+    rows: list[list[str]] = []
+    if start_row < end_row:
+        range_start, range_end, skip_row_ct = row_index.get_byte_range(start_row=start_row, end_row=end_row)
+        try:
+            data = read_result_file_bytes(file_path, range_start, range_end).decode("utf-8")
+        except FileNotFoundError:
+            logger.error(f"File not found: {file_path}")
+            raise errors.ResultDataDeleted
+        reader = csv.reader(io.StringIO(data, newline=""))
+        rows = list(itertools.islice(reader, skip_row_ct, skip_row_ct + end_row - start_row))
+    return sch.ResultPage(columns=row_index.columns, rows=rows, start_row=start_row, num_rows=row_index.row_ct)
+
+
+def get_result_page_from_start(file_path: str, start_row: int, end_row: int) -> sch.ResultPage:
+    parser = upload.CSVStreamParser()
+    rows: list[list[str]] = []
+    stream_gen = get_file_generator_func(file_path)(file_path)
+    for chunk in stream_gen:
+        rows += parser.feed(chunk)
+        # The header is the first row
+        if len(rows) > end_row:
+            break
+    else:
+        rows += parser.feed(b"", final=True)
+    columns = rows[0] if rows else []
+    return sch.ResultPage(columns=columns, rows=rows[1 + start_row : 1 + end_row], start_row=start_row)
+
+
 async def calc_trust_score(db: AsyncSession, number_of_days: int = 7) -> sch.TrustScore:
     try:
         row = await crud_chat.get_thumb_reaction_counts(db=db, number_of_days=number_of_days)
@@ -10,27 +10,31 @@ import redis
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.database import db_utils, query
 from basejump.core.database.aicatalog import AICatalog
+from basejump.core.database.catalog_cache import CatalogState, catalog_cache
 from basejump.core.database.crud import crud_connection, crud_table
 from basejump.core.database.db_connect import POOL_TIMEOUT, TableManager
 from basejump.core.database.format_response import JSONResponseFormatter
+from basejump.core.database.response_cache import get_response_cache
+from basejump.core.database.retrieval_cache import RetrievedTables, TableRetrievalCache
 from basejump.core.database.vector_utils import get_vector_idx
 from basejump.core.models import constants, enums, errors
 from basejump.core.models import pydantic_ai_formats as fmt
 from basejump.core.models import schemas as sch
-from basejump.core.models.prompts import DB_METADATA_PROMPT, ZERO_ROW_PROMPT
+from basejump.core.models.prompts import COMPACT_SCHEMA_LEGEND, DB_METADATA_PROMPT, ZERO_ROW_PROMPT
 from basejump.core.service import service_utils
 from basejump.core.service.base import BaseChatAgent, ChatMessageHandler
 from llama_index.core import VectorStoreIndex
 from llama_index.core.chat_engine import SimpleChatEngine
 from llama_index.core.indices.struct_store.sql_retriever import SQLTableRetriever
 from llama_index.core.objects import SQLTableNodeMapping, base
-from llama_index.core.schema import QueryBundle
+from llama_index.core.schema import NodeWithScore, QueryBundle
 from llama_index.core.tools import FunctionTool
 from llama_index.core.tools.function_tool import create_tool_metadata
 from llama_index.core.vector_stores import (
     FilterOperator,
     MetadataFilter,
     MetadataFilters,
+    VectorStoreQuery,
 )
 from llama_index.vector_stores.redis.base import NO_DOCS
 from redis.asyncio import Redis as RedisAsync
@@ -42,7 +46,40 @@ from sqlglot.dialects.dialect import Dialects
 logger = set_logging(handler_option="stream", name=__name__)
 TIMEOUT = 60 * 15
 RELEVANCE_THRESHOLD = 0.1
+COLUMN_PRUNE_TOP_K = 20  # Relevant columns kept for wide tables in addition to key columns
 STUCK_IN_LOOP_MAX_CT = 3
+# Complex prompt heuristics
+COMPLEX_PROMPT_MIN_SIGNALS = 2
+COMPLEX_PROMPT_MIN_CLAUSES = 3
+COMPLEX_PROMPT_MIN_CONJUNCTIONS = 2
+COMPLEX_PROMPT_MIN_WORDS = 30
+COMPLEX_PROMPT_SCORE_BAND = 0.02  # Tables scoring within this much of the top table are considered equally relevant
+COMPLEX_PROMPT_MIN_CLOSE_TABLES = 4
+CONJUNCTIONS_PATTERN = re.compile(r"\b(and|or|versus|vs|also|plus|as well as|along with)\b", flags=re.IGNORECASE)
+
+
+def is_complex_prompt(prompt: str, scores: list[float]) -> bool:
+    """Decide if a prompt should be broken out into sub-prompts to retrieve tables
+
+    Parameters
+    ----------
+    prompt
+        The prompt used to retrieve tables
+    scores
+        The relevance scores of the tables retrieved for the whole prompt. When many tables are about as
+        relevant as the top table, the prompt likely covers several subjects.
+    """
+    clauses = [clause for clause in re.split(r"[,;?\n]", prompt) if clause.strip()]
+    top_score = max(scores, default=0)
+    close_tables = [score for score in scores if score >= top_score - COMPLEX_PROMPT_SCORE_BAND]
+    signals = [
+        len(clauses) >= COMPLEX_PROMPT_MIN_CLAUSES,
+        len(CONJUNCTIONS_PATTERN.findall(prompt)) >= COMPLEX_PROMPT_MIN_CONJUNCTIONS,
+        prompt.count("?") > 1,
+        len(prompt.split()) >= COMPLEX_PROMPT_MIN_WORDS,
+        len(close_tables) >= COMPLEX_PROMPT_MIN_CLOSE_TABLES,
+    ]
+    return sum(signals) >= COMPLEX_PROMPT_MIN_SIGNALS
 
 
 class SQLTool:
@@ -92,31 +129,111 @@ class SQLTool:
         self.embedding_model_info = embedding_model_info
         self.sql_engine = sql_engine
         self.redis_client_async = redis_client_async
+        self.table_retrieval_cache = TableRetrievalCache(redis_client_async=redis_client_async)
         self.stuck_in_loop_ct = 0
 
-    async def post_init(self):
-        loaded_sql_tool = await self._get_sql_tables_tool()
+    async def post_init(self, db: Optional[AsyncSession] = None):
+        """Set up the tools for the connection
+
+        Parameters
+        ----------
+        db
+            The session to load the catalog with. Use a separate session for each tool when setting up
+            tools concurrently since a session can't be shared between tasks. Defaults to the tool session.
+        """
+        loaded_sql_tool = await self._get_sql_tables_tool(db=db or self.db)
         self.tools.append(loaded_sql_tool)
         self.tools.append(self._sql_execution_tool())
 
     # TODO: This would change to 'get sql' once we have a SQL specific model and
     # would take no input args
-    async def _get_sql_tables_tool(self) -> FunctionTool:
+    async def _get_sql_tables_tool(self, db: AsyncSession) -> FunctionTool:
+        self.schemas = self.client_conn_params.schemas or []
+        # Use the cached catalog state for this connection if neither the client's catalog nor the vector index
+        # it uses has changed
+        schemas_fingerprint = catalog_cache.get_schemas_fingerprint(schemas=self.schemas)
+        vector_client_id = catalog_cache.get_vector_client_id(
+            client_id=self.prompt_metadata.client_id, conn_id=self.conn_id, fingerprint=schemas_fingerprint
+        )
+        catalog_version = await catalog_cache.get_catalog_version(
+            redis_client_async=self.redis_client_async,
+            client_id=self.prompt_metadata.client_id,
+            vector_client_id=vector_client_id,
+        )
+        catalog_state = catalog_cache.get_catalog(
+            client_id=self.prompt_metadata.client_id,
+            conn_id=self.conn_id,
+            version=catalog_version,
+            fingerprint=schemas_fingerprint,
+        )
+        if catalog_state:
+            logger.debug("Using the cached catalog state for conn_id: %s", self.conn_id)
+        else:
+            catalog_state = await self.load_catalog_state(db=db)
+            if catalog_state.vector_client_id != vector_client_id:
+                # The vector client isn't known until the catalog is loaded the first time
+                vector_version = await catalog_cache.get_version(
+                    redis_client_async=self.redis_client_async, client_id=catalog_state.vector_client_id
+                )
+                catalog_version = (catalog_version[0], vector_version)
+            catalog_cache.set_catalog(
+                client_id=self.prompt_metadata.client_id,
+                conn_id=self.conn_id,
+                version=catalog_version,
+                fingerprint=schemas_fingerprint,
+                catalog_state=catalog_state,
+            )
+        self.vector_uuid = catalog_state.vector_uuid
+        self.index_name = catalog_state.index_name
+        self.is_demo = catalog_state.is_demo
+        self.vector_client_id = catalog_state.vector_client_id
+        self.all_tables = list(catalog_state.all_tables)
+        self.ignored_tables = list(catalog_state.ignored_tables)
+        self.db_cols, self.ignored_cols = catalog_state.copy_columns()
+        self.filters = catalog_state.filters
         # SQL Table Vector Index setup
-        vector_conn = await crud_connection.get_vector_connection_from_id(db=self.db, vector_id=self.vector_id)
-        self.vector_uuid = copy.copy(vector_conn.vector_uuid)
-        self.index_name = str(copy.copy(vector_conn.index_name))
+        self.table_index = await self.setup_sql_table_vector_index(
+            vector_id=self.vector_id,
+            client_id=catalog_state.vector_client_id,
+            vector_schema=catalog_state.vector_schema,
+        )
+        # Setup the SQL Retriever
+        self.sql_retriever = self.setup_sql_retriever(top_k=self.TABLES_TO_RETRIEVE)
+        self.sub_prompt_sql_retriever = self.setup_sql_retriever(top_k=self.TABLES_TO_RETRIEVE)
+        # TODO: See if I need varying names for different databases
+        func = self.get_sql_tables
+        name = constants.get_sql_tables_tool_nm(conn_id=self.conn_id)
+        assert func.__name__ in name
+        tool_metadata = create_tool_metadata(
+            fn=func,
+            name=name,
+            description="""This tool returns a list of database tables that are relevant \
+to your prompt that can be used in SQL queries. \
+Here is a description of the SQL database connection: """
+            + self.client_conn_params.data_source_desc,
+        )
+        sql_tool = FunctionTool.from_defaults(fn=func, async_fn=func, tool_metadata=tool_metadata)
+        await db.commit()  # NOTE: Closing transaction to avoid idle in transaction
+        return sql_tool
+
+    async def load_catalog_state(self, db: AsyncSession) -> CatalogState:
+        """Load the tables, columns and vector index info for the connection from the database"""
+        vector_conn = await crud_connection.get_vector_connection_from_id(db=db, vector_id=self.vector_id)
+        vector_uuid = copy.copy(vector_conn.vector_uuid)
+        index_name = str(copy.copy(vector_conn.index_name))
+        vector_schema = sch.VectorDBSchema.model_validate(vector_conn)
         # Check if the table is a demo table
-        demo_tbl_info = await crud_connection.get_demo_tbl_info(db=self.db, vector_id=self.vector_id)
+        demo_tbl_info = await crud_connection.get_demo_tbl_info(db=db, vector_id=self.vector_id)
         if demo_tbl_info:
             vector_db_uuid = demo_tbl_info.demo_db_uuid
             vector_client_id = str(demo_tbl_info.demo_client_id)
             vector_client_uuid = demo_tbl_info.demo_client_uuid
-            self.is_demo = True
+            is_demo = True
         else:
             vector_db_uuid = self.db_uuid
             vector_client_id = str(self.prompt_metadata.client_id)
             vector_client_uuid = self.prompt_metadata.client_uuid
+            is_demo = False
         logger.debug(
             f"""Using the following for vector indexes:
 vector_client_id: {vector_client_id}
@@ -124,24 +241,16 @@ vector_client_uuid: {str(vector_client_uuid)}
 vector_db_uuid: {str(vector_db_uuid)}
         """
         )
-        self.table_index = await self.setup_sql_table_vector_index(
-            vector_id=self.vector_id, client_id=int(vector_client_id)
-        )
-        self.schemas = self.client_conn_params.schemas or []
-        all_tables = await crud_table.get_all_tables(db=self.db)
-        self.all_tables: list = []
-        self.ignored_tables = []
-        for tbl in all_tables:
-            self.all_tables.append(
-                await TableManager.arender_query_jinja(jinja_str=tbl.table_name, schemas=self.schemas)
-            )
+        all_tables = []
+        ignored_tables = []
+        for tbl in await crud_table.get_all_tables(db=db):
+            table_name = await TableManager.arender_query_jinja(jinja_str=tbl.table_name, schemas=self.schemas)
+            all_tables.append(table_name)
             if tbl.ignore:
-                self.ignored_tables.append(
-                    await TableManager.arender_query_jinja(jinja_str=tbl.table_name, schemas=self.schemas)
-                )
-
-        db_cols = await crud_table.get_all_columns(db=self.db, conn_id=self.conn_id)
-        for col in db_cols:
+                ignored_tables.append(table_name)
+        db_cols = []
+        ignored_cols = []
+        for col in await crud_table.get_all_columns(db=db, conn_id=self.conn_id):
             table_name = await TableManager.arender_query_jinja(jinja_str=col.table_name, schemas=self.schemas)
             col_obj = sch.DBColumn(
                 column_name=col.column_name,
@@ -149,31 +258,26 @@ vector_db_uuid: {str(vector_db_uuid)}
                 schema_name=db_utils.get_table_schema(table_name=table_name),
                 quoted=col.quoted,
             )
-            self.ignored_cols = []
             if col.ignore:
-                self.ignored_cols.append(col_obj)
-            self.db_cols.append(col_obj)
-        self.filters = await self.get_table_metadata_filters(
-            conn_id=self.conn_id, db_uuid=vector_db_uuid, client_uuid=vector_client_uuid
+                ignored_cols.append(col_obj)
+            db_cols.append(col_obj)
+        # The metadata filter check for the indexing status uses the vector UUID
+        self.vector_uuid = vector_uuid
+        filters = await self.get_table_metadata_filters(
+            conn_id=self.conn_id, db_uuid=vector_db_uuid, client_uuid=vector_client_uuid, db=db
         )
-        # Setup the SQL Retriever
-        self.sql_retriever = self.setup_sql_retriever(top_k=self.TABLES_TO_RETRIEVE)
-        self.sub_prompt_sql_retriever = self.setup_sql_retriever(top_k=self.TABLES_TO_RETRIEVE)
-        # TODO: See if I need varying names for different databases
-        func = self.get_sql_tables
-        name = constants.get_sql_tables_tool_nm(conn_id=self.conn_id)
-        assert func.__name__ in name
-        tool_metadata = create_tool_metadata(
-            fn=func,
-            name=name,
-            description="""This tool returns a list of database tables that are relevant \
-to your prompt that can be used in SQL queries. \
-Here is a description of the SQL database connection: """
-            + self.client_conn_params.data_source_desc,
+        return CatalogState(
+            vector_uuid=vector_uuid,
+            index_name=index_name,
+            vector_schema=vector_schema,
+            vector_client_id=int(vector_client_id),
+            is_demo=is_demo,
+            all_tables=all_tables,
+            ignored_tables=ignored_tables,
+            db_cols=db_cols,
+            ignored_cols=ignored_cols,
+            filters=filters,
         )
-        sql_tool = FunctionTool.from_defaults(fn=func, async_fn=func, tool_metadata=tool_metadata)
-        await self.db.commit()  # NOTE: Closing transaction to avoid idle in transaction
-        return sql_tool
 
     def _sql_execution_tool(self) -> FunctionTool:
         func = self.run_sql
@@ -189,12 +293,15 @@ Here is a description of the SQL database connection: """
 
         return sql_exec_tool
 
-    async def setup_sql_table_vector_index(self, vector_id: int, client_id: int) -> VectorStoreIndex:
+    async def setup_sql_table_vector_index(
+        self, vector_id: int, client_id: int, vector_schema: Optional[sch.VectorDBSchema] = None
+    ) -> VectorStoreIndex:
         """Load the vector index"""
-        # Get the vector DB
-        vector_db = await crud_connection.get_vector_connection_from_id(db=self.db, vector_id=vector_id)
+        if not vector_schema:
+            # Get the vector DB
+            vector_db = await crud_connection.get_vector_connection_from_id(db=self.db, vector_id=vector_id)
+            vector_schema = sch.VectorDBSchema.model_validate(vector_db)
         # Initialize the environment
-        vector_schema = sch.VectorDBSchema.model_validate(vector_db)
         ai_catalog = AICatalog()
         settings = ai_catalog.get_settings(llm=self.agent.agent_llm, embedding_model_info=self.embedding_model_info)
         table_index = get_vector_idx(
@@ -746,6 +853,7 @@ After stating your plan, do one of the following:
             pydantic_format=fmt.CleanSQLFormat,
             max_tokens=1000,
             small_model_info=self.small_model_info,
+            response_cache=get_response_cache(redis_client_async=self.redis_client_async),
         )
         extract = await format_json_response.format()
         sql_query = extract.sql_query
@@ -870,7 +978,7 @@ Connection timed out. Please try again."""
         return query_result_str
 
     async def get_table_metadata_filters(
-        self, conn_id: int, db_uuid: uuid.UUID, client_uuid: uuid.UUID
+        self, conn_id: int, db_uuid: uuid.UUID, client_uuid: uuid.UUID, db: Optional[AsyncSession] = None
     ) -> MetadataFilters:
         """Get the tables for the connection based on the metadata filter
 
@@ -879,7 +987,7 @@ Connection timed out. Please try again."""
         filters
             Metadata filters for the index
         """
-        tables = await crud_table.get_conn_tables(db=self.db, conn_id=conn_id)
+        tables = await crud_table.get_conn_tables(db=db or self.db, conn_id=conn_id)
         if not tables:
             # Check if the DB is still indexing
             running_db_index_binary = await self.redis_client_async.hget(  # type: ignore
@@ -913,6 +1021,19 @@ Connection timed out. Please try again."""
         ]
         return MetadataFilters(filters=metadata_filters)
 
+    def get_column_metadata_filters(self, table_name: str) -> MetadataFilters:
+        """Get the filters for the column nodes of a table, using the same client and database as the tables"""
+        metadata_filters = [
+            metadata_filter
+            for metadata_filter in self.filters.filters
+            if isinstance(metadata_filter, MetadataFilter) and metadata_filter.key in ("db_uuid", "client_uuid")
+        ]
+        metadata_filters += [
+            MetadataFilter(key="name", value=table_name, operator=FilterOperator.EQ),
+            MetadataFilter(key="vector_type", value=enums.VectorSourceType.COLUMN.value, operator=FilterOperator.EQ),
+        ]
+        return MetadataFilters(filters=metadata_filters)
+
     def setup_sql_retriever(self, top_k: int) -> SQLTableRetriever:
         """Return the SQL engine"""
         index_table_retriever = self.table_index.as_retriever(similarity_top_k=top_k, filters=self.filters)
@@ -926,29 +1047,12 @@ Connection timed out. Please try again."""
         return sql_retriever
 
     async def use_sub_questions(self, prompt) -> list:
-        # Ask the agent to classify the prompt
-        # TODO: Add a callback manager to track token usage here
-        ai_catalog = AICatalog()
+        """Break the prompt into sub-prompts and retrieve the tables for each of them"""
+        # NOTE: This is the pooled agent LLM when the agent uses the large model
+        ai_catalog = AICatalog(callback_manager=self.prompt_metadata.callback_manager)
         agent_llm = ai_catalog.get_llm(model_info=self.large_model_info)
         agent = SimpleChatEngine.from_defaults(llm=agent_llm)
-        agent_prompt = f"""\
-Return True if the following is True, otherwise return False. If you consider the following prompt to be \
-multiple questions in one, uses many commas, requests many things which likely will require using multiple tables, or \
-is in general considered to be complex, return True. Otherwise return False. Here is the prompt: \
-{prompt}"""
-        agent_output = await agent.achat(message=agent_prompt)
-        # Extract the answer
-        format_json_response = JSONResponseFormatter(
-            response=agent_output.response,
-            pydantic_format=fmt.TrueFalseBool,
-            llm=agent_llm,  # NOTE: GPT 4o-mini selects sub-questions too often
-            small_model_info=self.small_model_info,
-        )
-        extract = await format_json_response.format()
-        logger.debug("Decision to use sub-question tool: %s", extract.true_false_bool)
-        if not extract.true_false_bool:
-            return []
-        logger.debug("Agent decided to use sub-questions to retrieve tables")
+        logger.debug("Using sub-questions to retrieve tables")
         # Ask the agent for the sub prompts
         agent_prompt = f"""\
 Take the following prompt and break it out into 2-3 more distinct sub-prompts. \
@@ -973,13 +1077,22 @@ Here is the prompt that needs to be broken out: \n\n\
         )
         extract = await format_json_response.format()
         # For each sub-prompt, get related tables
-        final_tables = set()
         logger.debug("Here are the sub_questions: \n-%s", "\n- ".join(extract.sub_prompts))
-        for sub_prompt in extract.sub_prompts:
-            retrieved_tables = await self.get_sql_tables_helper(
-                inquiry=sub_prompt, sql_retriever=self.sub_prompt_sql_retriever
-            )
-            final_tables.update(retrieved_tables)
+        results = await asyncio.gather(
+            *[
+                self.get_sql_tables_helper(inquiry=sub_prompt, sql_retriever=self.sub_prompt_sql_retriever)
+                for sub_prompt in extract.sub_prompts
+            ],
+            return_exceptions=True,
+        )
+        final_tables = set()
+        for result in results:
+            if isinstance(result, errors.NoRelevantTables):
+                # The tables for the whole prompt are used if none of the sub-prompts find any
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            final_tables.update(result)
         return list(final_tables)
 
     async def get_sql_tables(self, inquiry):
@@ -987,10 +1100,17 @@ Here is the prompt that needs to be broken out: \n\n\
         # Need more tokens for large SQL queries
         await service_utils.update_agent_tokens(agent=self.agent, max_tokens=1000)
         try:
-            tables = await self.use_sub_questions(prompt=inquiry)
+            retrieved_tables = await self.aget_table_context(inquiry=inquiry, sql_retriever=self.sql_retriever)
+            tables = []
+            if is_complex_prompt(prompt=inquiry, scores=retrieved_tables.scores):
+                tables = await self.use_sub_questions(prompt=inquiry)
             if not tables:
-                tables = await self.get_sql_tables_helper(inquiry=inquiry, sql_retriever=self.sql_retriever)
-            tables_str = "\n\n".join(tables)
+                tables = retrieved_tables.tables
+            if self.agent.chat_metadata.schema_format == enums.SchemaFormat.COMPACT:
+                tables = [TableManager.compact_table_info(table_info=table_info) for table_info in tables]
+                tables_str = COMPACT_SCHEMA_LEGEND + "\n\n".join(tables)
+            else:
+                tables_str = "\n\n".join(tables)
         except errors.NoRelevantTables as e:
             logger.warning("The AI was unable to find any relevant tables")
             return str(e)
@@ -1015,6 +1135,36 @@ Here is the prompt that needs to be broken out: \n\n\
         # (this is referring to within the _aget_table_context method)
 
     async def get_sql_tables_helper(self, inquiry: str, sql_retriever: SQLTableRetriever) -> list:
+        retrieved_tables = await self.aget_table_context(inquiry=inquiry, sql_retriever=sql_retriever)
+        return retrieved_tables.tables
+
+    async def aget_table_context(self, inquiry: str, sql_retriever: SQLTableRetriever) -> RetrievedTables:
+        """Get the table context for the inquiry, using the retrieval cache if it has been retrieved recently"""
+        cache_key = await self.table_retrieval_cache.get_key(
+            client_id=self.prompt_metadata.client_id,
+            vector_client_id=self.vector_client_id,
+            index_name=self.index_name,
+            conn_id=self.conn_id,
+            inquiry=inquiry,
+        )
+        retrieved_tables = await self.table_retrieval_cache.get(key=cache_key)
+        if not retrieved_tables:
+            nodes = await self.aretrieve_tables(inquiry=inquiry, sql_retriever=sql_retriever)
+            tables = self.get_table_context(nodes=nodes, sql_retriever=sql_retriever)
+            retrieved_tables = RetrievedTables(
+                tables=await self.prune_wide_tables(inquiry=inquiry, tables=tables),
+                scores=[node.score or 0 for node in nodes],
+            )
+            await self.table_retrieval_cache.set(key=cache_key, retrieved_tables=retrieved_tables)
+        if not retrieved_tables.tables:
+            raise errors.NoRelevantTables(
+                """No relevant tables found for this question. Please rephrase your question and try again \
+or check the underlying SQL database connection for misconfiguration."""
+            )
+        return retrieved_tables
+
+    async def aretrieve_tables(self, inquiry: str, sql_retriever: SQLTableRetriever) -> list[NodeWithScore]:
+        """Retrieve the table nodes and their relevance scores from the vector index"""
         query_bundle = QueryBundle(inquiry)
         try:
             # TODO: See if there is something more efficient than checking this every time
@@ -1026,9 +1176,7 @@ Here is the prompt that needs to be broken out: \n\n\
                 # TODO: This isn't resolving, but once triggered it is perpetually broken
                 # HACK: Commenting out for now
                 # raise Exception("Index update error")
-            tables = await sql_retriever._aget_table_context(
-                query_bundle=query_bundle, relevance_threshold=RELEVANCE_THRESHOLD
-            )
+            nodes = await sql_retriever.table_retriever.retriever.aretrieve(query_bundle)
         except Exception as e:
             logger.error(e)
             if isinstance(e, redis.exceptions.ResponseError) or NO_DOCS in str(e) or index_update_error:
@@ -1041,11 +1189,58 @@ Here is the prompt that needs to be broken out: \n\n\
                 raise errors.SQLIndexError(constants.REINDEXING_DB_ERROR_MSG)
             else:
                 raise e
-        if not tables:
-            raise errors.NoRelevantTables(
-                """No relevant tables found for this question. Please rephrase your question and try again \
-or check the underlying SQL database connection for misconfiguration."""
+        return nodes
+
+    async def prune_wide_tables(self, inquiry: str, tables: list[str]) -> list[str]:
+        """Trim wide tables to the columns most relevant to the inquiry along with their key columns
+
+        Tables are left as is if their columns haven't been indexed or the column retrieval fails.
+        """
+        wide_tables = {}
+        for idx, table_info in enumerate(tables):
+            table_dict = TableManager.load_table_info(table_info=table_info)
+            if table_dict and len(table_dict.get("columns") or []) > constants.WIDE_TABLE_COLUMN_CT:
+                wide_tables[idx] = table_dict
+        if not wide_tables:
+            return tables
+        try:
+            embed_model = AICatalog().get_embedding_model(model_info=self.embedding_model_info)
+            query_embedding = await embed_model.aget_query_embedding(inquiry)
+            results = await asyncio.gather(
+                *[
+                    self.table_index.vector_store.aquery(
+                        VectorStoreQuery(
+                            query_embedding=query_embedding,
+                            similarity_top_k=COLUMN_PRUNE_TOP_K,
+                            filters=self.get_column_metadata_filters(table_name=table_dict["table_name"]),
+                        )
+                    )
+                    for table_dict in wide_tables.values()
+                ]
             )
+        except Exception as e:
+            logger.warning("Unable to retrieve the relevant columns: %s", str(e))
+            return tables
+        pruned_tables = list(tables)
+        for (idx, table_dict), result in zip(wide_tables.items(), results):
+            column_names = [node.metadata["column_name"] for node in result.nodes or []]
+            if column_names:
+                pruned_tables[idx] = TableManager.prune_table_info(table_dict=table_dict, column_names=column_names)
+        return pruned_tables
+
+    @staticmethod
+    def get_table_context(nodes: list[NodeWithScore], sql_retriever: SQLTableRetriever) -> list:
+        """Get the table info for the relevant tables, same as SQLTableRetriever._aget_table_context"""
+        object_node_mapping = sql_retriever.table_retriever.object_node_mapping
+        tables = []
+        for node in nodes:
+            if not node.score or node.score <= RELEVANCE_THRESHOLD:
+                continue
+            table_schema_obj = object_node_mapping.from_node(node.node)
+            if table_schema_obj.table_info:
+                tables.append(table_schema_obj.table_info)
+            else:
+                logger.warning("Missing table info")
         return tables
 
     async def run_client_query(self, sql_query: str) -> sch.QueryResultDF:
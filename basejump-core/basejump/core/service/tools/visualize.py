@@ -1,34 +1,261 @@
+import asyncio
+import contextlib
+import csv
 import io
 import json
+import math
 import os
+import re
 import uuid
 from typing import Optional
 
 import aioboto3
+import numpy as np
 import pandas as pd
 from basejump.core.common.config.logconfig import set_logging
-from basejump.core.database import upload
+from basejump.core.database import query, upload
 from basejump.core.database.aicatalog import AICatalog
 from basejump.core.database.crud import crud_result
+from basejump.core.database.db_connect import TableManager
 from basejump.core.database.format_response import DateFormatter
+from basejump.core.database.response_cache import get_response_cache
+from basejump.core.database.result_cache import result_cache
 from basejump.core.models import constants, enums, errors, models
 from basejump.core.models import pydantic_ai_formats as fmt
 from basejump.core.models import schemas as sch
 from basejump.core.service import service_utils
 from basejump.core.service.base import BaseAgent, BaseChatAgent
 from chat2plot import chat2plot as cp
-from llama_index.core import Document, VectorStoreIndex
+from chat2plot.render import draw_plotly
+from chat2plot.schema import AggregationType, ChartType, PlotConfig
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.llms import LLM
-from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.tools import FunctionTool
 from llama_index.core.tools.function_tool import create_tool_metadata
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlglot import errors as sqlglot_errors
+from sqlglot import exp, parse_one
 
 bucket_name = "datasetsfromchat"
 
 
 logger = set_logging(handler_option="stream", name=__name__)
 TIMEOUT = 60 * 3
+VIS_MAX_FILE_BYTES = 5 * 1024 * 1024  # Larger results are sampled or aggregated in SQL
+VIS_SAMPLE_ROWS = 10000
+VIS_STREAM_CHUNK_BYTES = 1024 * 1024
+AGGREGATED_CHART_TYPES = [ChartType.BAR, ChartType.PIE, ChartType.SCALAR]
+SQL_AGGREGATIONS = {
+    AggregationType.SUM: exp.Sum,
+    AggregationType.AVG: exp.Avg,
+    AggregationType.MIN: exp.Min,
+    AggregationType.MAX: exp.Max,
+    AggregationType.COUNT: exp.Count,
+}
+RESULT_NOT_FOUND_MSG = """result_uuid {result_uuid} was not found. Unable to create a visualization since either the \
+result_uuid is incorrect or the originally created data has been deleted."""
+DATE_KEYWORDS = ["date", "time", "month", "year", "week", "quarter", "yearmo"]
+DATE_SIMILARITY_THRESHOLD = 0.6
+DATE_VALUE_SAMPLE_SIZE = 100
+DATE_VALUE_MIN_RATIO = 0.8  # The share of sampled values that need to look like dates
+DATE_PART_PATTERN = re.compile(
+    r"^(?:(?:fy)?\d{2,4}[-/ ]?)?"
+    r"(?:q[1-4]|jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?(?:[-/ ]?\d{2,4})?$",
+    flags=re.IGNORECASE,
+)
+
+
+def detect_date_col(series: pd.Series) -> Optional[bool]:
+    """Classify a column as a date using its type and values
+
+    Returns
+    -------
+    is_date
+        None if the values can't tell, such as numbers that could be years, months or quarters
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    values = series.dropna()
+    if values.empty:
+        return None
+    if pd.api.types.is_bool_dtype(series):
+        return False
+    if pd.api.types.is_numeric_dtype(series):
+        return None
+    sample = values.head(DATE_VALUE_SAMPLE_SIZE).map(str).str.strip()
+    parsed = pd.to_datetime(sample, errors="coerce", format="mixed")
+    if parsed.notna().mean() >= DATE_VALUE_MIN_RATIO:
+        return True
+    if sample.str.match(DATE_PART_PATTERN).mean() >= DATE_VALUE_MIN_RATIO:
+        return True
+    return False
+
+
+class CSVRowSampler:
+    """Keep the header and every nth row of a result file as it is read
+
+    Results exported by the database keep new lines in quoted values, so rows are parsed instead of being
+    split on new lines.
+    """
+
+    def __init__(self, row_num_total: int, max_rows: int = VIS_SAMPLE_ROWS):
+        self.step = max(math.ceil(row_num_total / max_rows), 1)
+        self.parser = upload.CSVStreamParser()
+        self.rows: list[list[str]] = []
+        self.row_idx = -1  # The header
+
+    def feed(self, chunk: bytes, final: bool = False) -> None:
+        for row in self.parser.feed(chunk, final=final):
+            if self.row_idx < 0 or self.row_idx % self.step == 0:
+                self.rows.append(row)
+            self.row_idx += 1
+
+    def to_df(self) -> pd.DataFrame:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(self.rows)
+        buffer.seek(0)
+        return pd.read_csv(buffer)
+
+
+def normalize_embeddings(embeddings: list[list[float]]) -> np.ndarray:
+    array = np.array(embeddings, dtype=np.float32)
+    return array / np.linalg.norm(array, axis=1, keepdims=True)
+
+
+def get_aggregate_query(sql_query: str, config: PlotConfig, dialect: Optional[str] = None) -> Optional[str]:
+    """Derive a query that aggregates the result of the SQL query the same way as the chart
+
+    Returns
+    -------
+    aggregate_query
+        None if the chart doesn't aggregate the data or the aggregation can't be done in SQL, such as
+        when the chart filters or bins the data
+    """
+    is_aggregated = config.chart_type in AGGREGATED_CHART_TYPES or (
+        config.chart_type in [ChartType.LINE, ChartType.AREA] and config.y.aggregation
+    )
+    if not is_aggregated or config.filters or (config.x and (config.x.bin_size or config.x.time_unit)):
+        return None
+    dimensions = list(
+        dict.fromkeys(column for column in [config.x.column if config.x else None, config.color] if column)
+    )
+    if config.y.column in dimensions:
+        return None
+    # Charts use the average when no aggregation is given
+    aggregation = config.y.aggregation or AggregationType.AVG
+    y_column = exp.column(config.y.column, quoted=True)
+    if aggregation == AggregationType.COUNTROWS:
+        aggregate: exp.Func = exp.Count(this=exp.Star())
+    elif aggregation == AggregationType.DISTINCT_COUNT:
+        aggregate = exp.Count(this=exp.Distinct(expressions=[y_column]))
+    else:
+        aggregate = SQL_AGGREGATIONS[aggregation](this=y_column)
+    try:
+        result_query = parse_one(sql_query, dialect=dialect)
+    except sqlglot_errors.ParseError:
+        return None
+    if not isinstance(result_query, exp.Query):
+        return None
+    # Not all databases support CTEs or an ORDER BY without a limit in a subquery
+    ctes = result_query.args.get("with")
+    result_query.set("with", None)
+    if not result_query.args.get("limit"):
+        result_query.set("order", None)
+    aggregate_query = exp.select(
+        *[exp.column(dimension, quoted=True) for dimension in dimensions],
+        exp.alias_(aggregate, config.y.column, quoted=True),
+    ).from_(result_query.subquery("result"))
+    if dimensions:
+        aggregate_query = aggregate_query.group_by(*[exp.column(dimension, quoted=True) for dimension in dimensions])
+    if ctes:
+        aggregate_query.set("with", ctes)
+    return aggregate_query.sql(dialect=dialect)
+
+
+def get_aggregated_plot_config(config: PlotConfig) -> PlotConfig:
+    """Update the chart config to plot the result of the aggregate query
+
+    The aggregate query returns a row per group, so summing each group returns the aggregated value.
+    """
+    aggregated_config = config.model_copy(deep=True)
+    aggregated_config.y.aggregation = AggregationType.SUM
+    return aggregated_config
+
+
+class DateKeywordEmbeddings:
+    """Embeddings of the date keywords, computed once per embedding model"""
+
+    def __init__(self):
+        self._embeddings: dict[tuple, np.ndarray] = {}
+
+    async def get(self, embed_model: BaseEmbedding, model_info: sch.AzureModelInfo) -> np.ndarray:
+        assert model_info.endpoint_info, "Missing endpoint info - the pydantic schema should be validating this"
+        key = (model_info.model_name.value, model_info.endpoint_info.deployment_name)
+        if key not in self._embeddings:
+            self._embeddings[key] = normalize_embeddings(await embed_model.aget_text_embedding_batch(DATE_KEYWORDS))
+        return self._embeddings[key]
+
+
+date_keyword_embeddings = DateKeywordEmbeddings()
+
+
+class ResultS3Client:
+    """A long-lived S3 client used to read results, shared by every plot in the process"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self._exit_stack = contextlib.AsyncExitStack()
+        self._client = None
+        self._lock = asyncio.Lock()
+        # asyncio.run cancels pending tasks before closing the loop, so this closes the client at shutdown
+        self._closer = asyncio.create_task(self._close_on_shutdown())
+
+    async def _close_on_shutdown(self) -> None:
+        try:
+            await asyncio.Future()
+        finally:
+            await self.close()
+
+    async def get_client(self):
+        async with self._lock:
+            if self._client is None:
+                session = aioboto3.Session(
+                    aws_access_key_id=os.environ["AWS_USER_ACCESS_KEY_ID"],
+                    aws_secret_access_key=os.environ["AWS_USER_SECRET_ACCESS_KEY"],
+                    region_name=os.environ["AWS_REGION"],
+                )
+                self._client = await self._exit_stack.enter_async_context(session.client("s3"))
+        return self._client
+
+    async def close(self) -> None:
+        await self._exit_stack.aclose()
+        self._client = None
+
+
+_result_s3_client: Optional[ResultS3Client] = None
+
+
+def get_result_s3_client() -> ResultS3Client:
+    """Get the S3 client for this process, creating a new one if the event loop has changed"""
+    global _result_s3_client
+    if _result_s3_client is None or _result_s3_client.loop is not asyncio.get_running_loop():
+        if _result_s3_client is not None and not _result_s3_client.loop.is_closed():
+            # Otherwise asyncio.run already closed the client when it shut down the old loop
+            _result_s3_client.loop.call_soon_threadsafe(_result_s3_client._closer.cancel)
+        _result_s3_client = ResultS3Client()
+    return _result_s3_client
+
+
+async def close_result_s3_client() -> None:
+    """Close the shared S3 client
+
+    The client is also closed when asyncio.run cancels the remaining tasks. Call this on application shutdown
+    when the loop is managed some other way.
+    """
+    global _result_s3_client
+    if _result_s3_client:
+        await _result_s3_client.close()
+        _result_s3_client = None
 
 
 class VisTool:
@@ -39,11 +266,21 @@ class VisTool:
         small_model_info: sch.ModelInfo,
         embedding_model_info: sch.AzureModelInfo,
         llm: Optional[LLM] = None,
+        db_conn_params: Optional[sch.SQLDBSchema] = None,
+        connections: Optional[list[sch.SQLConnSchema]] = None,
     ):
+        """
+        Parameters
+        ----------
+        connections
+            The connections that can be used to aggregate large results in SQL, otherwise they are sampled
+        """
         self.db = db
         self.agent: BaseAgent = agent
         self.small_model_info = small_model_info
         self.embedding_model_info = embedding_model_info
+        self.db_conn_params = db_conn_params
+        self.connections = connections or []
 
     def get_plot_tool(self) -> FunctionTool:
         func = self.get_plot
@@ -56,37 +293,34 @@ shown to the user to provide more insight into their data.""",
         plot_tool = FunctionTool.from_defaults(fn=func, async_fn=func, tool_metadata=tool_metadata)
         return plot_tool
 
-    async def select_date_cols(self, cols: list[str]) -> list[str]:
+    async def select_date_cols(self, df: pd.DataFrame) -> list[str]:
+        """Select the date columns, only using embeddings for columns that can't be classified by their values"""
         date_cols = []
-
-        documents = [
-            Document(text="date"),
-            Document(text="time"),
-            Document(text="month"),
-            Document(text="year"),
-            Document(text="week"),
-            Document(text="quarter"),
-            Document(text="yearmo"),
-        ]
-
-        # Build index
+        undecided_cols = []
+        for col in df.columns:
+            is_date = detect_date_col(series=df[col])
+            if is_date is None:
+                undecided_cols.append(col)
+            elif is_date:
+                date_cols.append(col)
+        if not undecided_cols:
+            return date_cols
+        # Compare the column names to the date keywords
         # TODO: Add a callback manager to track token usage
         ai_catalog = AICatalog()
         embed_model = ai_catalog.get_embedding_model(model_info=self.embedding_model_info)
-        index = VectorStoreIndex.from_documents(documents, embed_model=embed_model)
-
-        # Configure retriever
-        retriever = VectorIndexRetriever(index=index, similarity_top_k=1)  # Set to 1 to get the most similar result
-
-        # Perform similarity search
-        for col in cols:
-            nodes = await retriever.aretrieve(col)
-            # Get similarity score
-            similarity_score = nodes[0].score
-            logger.info(f"Cosine similarity: {similarity_score}")
-            if similarity_score > 0.6:  # type: ignore
+        keyword_embeddings = await date_keyword_embeddings.get(
+            embed_model=embed_model, model_info=self.embedding_model_info
+        )
+        col_embeddings = normalize_embeddings(
+            await embed_model.aget_text_embedding_batch([str(col) for col in undecided_cols])
+        )
+        similarity_scores = (col_embeddings @ keyword_embeddings.T).max(axis=1)
+        for col, similarity_score in zip(undecided_cols, similarity_scores):
+            logger.info(f"Cosine similarity for {col}: {similarity_score}")
+            if similarity_score > DATE_SIMILARITY_THRESHOLD:
                 date_cols.append(col)
-        return date_cols
+        return [col for col in df.columns if col in date_cols]
 
     async def format_date(self, cols) -> pd.DataFrame:
         date_prompt = f"""
@@ -95,9 +329,69 @@ shown to the user to provide more insight into their data.""",
             response=date_prompt,
             pydantic_format=fmt.DateData,
             small_model_info=self.small_model_info,
+            response_cache=get_response_cache(redis_client_async=self.agent.redis_client_async),
         )
         return await f.format()
 
+    @staticmethod
+    async def downsample_result(
+        s3_client, bucket: str, key: str, row_num_total: int, max_rows: int = VIS_SAMPLE_ROWS
+    ) -> pd.DataFrame:
+        """Keep every nth row of the result file in a single streaming pass"""
+        sampler = CSVRowSampler(row_num_total=row_num_total, max_rows=max_rows)
+        response = await s3_client.get_object(Bucket=bucket, Key=key)
+        async for chunk in response["Body"].iter_chunks(chunk_size=VIS_STREAM_CHUNK_BYTES):
+            sampler.feed(chunk)
+        sampler.feed(b"", final=True)
+        return sampler.to_df()
+
+    @staticmethod
+    def read_local_result(
+        file_path: str, row_num_total: int, max_rows: int = VIS_SAMPLE_ROWS
+    ) -> tuple[pd.DataFrame, bool]:
+        """Read a result saved to the local filesystem, keeping every nth row if the file is large
+
+        Returns
+        -------
+        df
+            The result or a sample of it
+        sampled
+            Whether the result was sampled
+        """
+        if os.path.getsize(file_path) <= VIS_MAX_FILE_BYTES:
+            return pd.read_csv(file_path), False
+        sampler = CSVRowSampler(row_num_total=row_num_total, max_rows=max_rows)
+        with open(file_path, "rb") as file:
+            while chunk := file.read(VIS_STREAM_CHUNK_BYTES):
+                sampler.feed(chunk)
+        sampler.feed(b"", final=True)
+        return sampler.to_df(), True
+
+    async def aggregate_result(self, result: models.ResultHistory, config) -> Optional[pd.DataFrame]:
+        """Run a query that aggregates the result the same way as the chart"""
+        connection = next((conn for conn in self.connections if conn.conn_id == result.result_conn_id), None)
+        if not connection or not self.db_conn_params or not isinstance(config, PlotConfig):
+            return None
+        conn_params = connection.conn_params
+        sql_query = await TableManager.arender_query_jinja(jinja_str=result.sql_query, schemas=conn_params.schemas)
+        aggregate_query = get_aggregate_query(
+            sql_query=sql_query,
+            config=config,
+            dialect=enums.DB_TYPE_TO_SQLGLOT_DIALECT_LKUP.get(conn_params.database_type),
+        )
+        if not aggregate_query:
+            return None
+        try:
+            async with asyncio.timeout(TIMEOUT):
+                mng_query = query.ClientQueryManager(
+                    db_conn_params=self.db_conn_params, client_conn_params=conn_params, sql_query=aggregate_query
+                )
+                query_result = await mng_query.run_client_query()
+        except Exception as e:
+            logger.warning("Unable to aggregate the result for the visual: %s", str(e))
+            return None
+        return query_result.output_df
+
     async def get_plot(self, result_uuid: uuid.UUID, prompt: str):
         await service_utils.update_agent_tokens(agent=self.agent)
         # Get the result
@@ -106,42 +400,61 @@ shown to the user to provide more insight into their data.""",
         )
         if not result:
             logger.error(errors.RESULT_UUID_NOT_FOUND)
-            return f"""result_uuid {result_uuid} was not found. Unable to create a visualization since either the \
-result_uuid is incorrect or the originally created data has been deleted."""
-        # Retrieve the result from S3
-        buffer = io.BytesIO()
-        session = aioboto3.Session(
-            aws_access_key_id=os.environ["AWS_USER_ACCESS_KEY_ID"],
-            aws_secret_access_key=os.environ["AWS_USER_SECRET_ACCESS_KEY"],
-            region_name=os.environ["AWS_REGION"],
-        )
-        async with session.client("s3") as s3_client:
+            return RESULT_NOT_FOUND_MSG.format(result_uuid=result_uuid)
+        # Use the result if it was uploaded by this process, otherwise retrieve it from S3
+        df = result_cache.get(result_uuid=result.result_uuid, result_file_path=result.result_file_path)
+        sampled = False
+        if df is None and not result.result_file_path.startswith(upload.S3_PREFIX):
+            try:
+                df, sampled = await asyncio.to_thread(
+                    self.read_local_result, file_path=result.result_file_path, row_num_total=result.row_num_total
+                )
+            except FileNotFoundError:
+                logger.error(errors.RESULT_DATA_DELETED)
+                return RESULT_NOT_FOUND_MSG.format(result_uuid=result_uuid)
+        if df is None:
+            s3_client = await get_result_s3_client().get_client()
             key, bucket = upload.get_s3_info_from_filepath(filepath=result.result_file_path)
             response = await s3_client.head_object(Bucket=bucket, Key=key)
             file_size = response["ContentLength"]
-            if file_size > 5 * 1024 * 1024:
-                return """File size is larger than 5 MB. Make sure to aggregate the data using SQL before attempting \
-to visualize."""
-            await s3_client.download_fileobj(bucket, key, buffer)
-        buffer.seek(0)
+            if file_size > VIS_MAX_FILE_BYTES:
+                # The chart is chosen using a sample and then drawn from the result aggregated in SQL if possible
+                df = await self.downsample_result(
+                    s3_client=s3_client, bucket=bucket, key=key, row_num_total=result.row_num_total
+                )
+                sampled = True
+            else:
+                buffer = io.BytesIO()
+                await s3_client.download_fileobj(bucket, key, buffer)
+                buffer.seek(0)
+                df = pd.read_csv(buffer)
         # Create the visual
-        df = pd.read_csv(buffer)
-        dates = await self.select_date_cols(df.columns.to_list())
+        dates = await self.select_date_cols(df=df)
         if dates:
             formatted = await self.format_date(cols=df[dates])
             df[dates] = pd.DataFrame(formatted.dates)
         c2p = cp(df, chat=self.agent.agent_llm)
         visual = c2p(prompt)
+        visual_figure = visual.figure
+        visual_explanation = visual.explanation
+        if sampled:
+            aggregated_df = await self.aggregate_result(result=result, config=visual.config)
+            if aggregated_df is not None:
+                visual_figure = draw_plotly(aggregated_df, get_aggregated_plot_config(visual.config), show=False)
+            else:
+                visual_explanation += (
+                    f"\n\nThis chart uses a sample of {len(df)} of the {result.row_num_total} rows in the result."
+                )
         # Save and send back to the user
         # TODO: Sometimes visual is None
         # Add some error handling for this
-        visual_json = visual.figure.to_json()
+        visual_json = visual_figure.to_json()
         visual_result_uuid = uuid.uuid4()
         if not self.agent.query_result:
             self.agent.query_result = sch.MessageQueryResult()
         self.agent.query_result.visual_result_uuid = visual_result_uuid
         self.agent.query_result.visual_json = json.loads(visual_json)
-        self.agent.query_result.visual_explanation = visual.explanation
+        self.agent.query_result.visual_explanation = visual_explanation
         if not self.agent.query_result.result_uuid:
             self.agent.query_result.result_uuid = result.result_uuid
             self.agent.query_result.sql_query = result.sql_query
@@ -156,7 +469,7 @@ to visualize."""
             result_id=result.result_id,
             result_uuid=result.result_uuid,
             visual_json=visual_json,
-            visual_explanation=visual.explanation,
+            visual_explanation=visual_explanation,
         )
         self.db.add(visual_result_hist)
         await self.db.commit()
@@ -0,0 +1,233 @@
+"""Per-process webhook delivery
+
+A single long-lived aiohttp session (with a pooled connector) is shared by every chat in the process.
+Messages are delivered through an ordered queue per chat so that thoughts, responses and solutions
+arrive in the order they were created. Bursts of thought messages are coalesced into one payload.
+"""
+
+import asyncio
+import json
+import time
+from typing import Optional
+
+import aiohttp
+from basejump.core.common.config.logconfig import set_logging
+from basejump.core.models import enums
+
+logger = set_logging(handler_option="stream", name=__name__)
+
+WEBHOOK_CONN_LIMIT = 100
+WEBHOOK_CONN_LIMIT_PER_HOST = 20
+WEBHOOK_TIMEOUT = 30  # seconds
+WEBHOOK_MAX_ATTEMPTS = 4
+WEBHOOK_BACKOFF_BASE = 0.25  # seconds, doubled on every retry
+WEBHOOK_COALESCE_WINDOW = 0.15  # seconds to wait for more thoughts before sending
+WEBHOOK_QUEUE_IDLE_TIMEOUT = 60  # seconds before an idle chat queue worker exits
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class WebhookItem:
+    def __init__(
+        self,
+        url: str,
+        headers: dict,
+        payload: str,
+        msg_type: enums.MessageType,
+        future: Optional[asyncio.Future] = None,
+    ):
+        self.url = url
+        self.headers = headers
+        self.payload = payload
+        self.msg_type = msg_type
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+    @property
+    def is_thought(self) -> bool:
+        return self.msg_type == enums.MessageType.THOUGHT
+
+
+class WebhookDispatcher:
+    """Delivers webhook messages using a pooled session and an ordered queue per chat"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._workers: set[asyncio.Task] = set()
+        # asyncio.run cancels pending tasks before closing the loop, so this closes the session at shutdown
+        self._closer = asyncio.create_task(self._close_on_shutdown())
+
+    async def _close_on_shutdown(self) -> None:
+        try:
+            await asyncio.Future()
+        finally:
+            await self.close_session()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=WEBHOOK_CONN_LIMIT, limit_per_host=WEBHOOK_CONN_LIMIT_PER_HOST)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=WEBHOOK_TIMEOUT)
+            )
+        return self._session
+
+    async def send(
+        self,
+        queue_key: str,
+        url: str,
+        headers: dict,
+        payload: str,
+        msg_type: enums.MessageType,
+        wait: bool = True,
+    ) -> None:
+        """Queue a message for delivery
+
+        Parameters
+        ----------
+        queue_key
+            Messages sharing a key are delivered in order (typically the chat UUID)
+        wait
+            Wait for the message to be delivered before returning
+        """
+        future = self.loop.create_future() if wait else None
+        item = WebhookItem(url=url, headers=headers, payload=payload, msg_type=msg_type, future=future)
+        queue = self._queues.get(queue_key)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[queue_key] = queue
+            worker = asyncio.create_task(self._worker(queue_key=queue_key, queue=queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        queue.put_nowait(item)
+        if future:
+            await future
+
+    async def _worker(self, queue_key: str, queue: asyncio.Queue) -> None:
+        pending: Optional[WebhookItem] = None
+        try:
+            while True:
+                if pending:
+                    item, pending = pending, None
+                else:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout=WEBHOOK_QUEUE_IDLE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        if queue.empty():
+                            return
+                        continue
+                items = [item]
+                try:
+                    if item.is_thought:
+                        pending = await self._collect_thoughts(queue=queue, items=items)
+                    await self._deliver(items=items)
+                except Exception as e:
+                    logger.error(f"Webhook delivery failed: {str(e)}")
+                finally:
+                    self.resolve(items=items)
+        finally:
+            # Nothing can be enqueued between the check and the delete since there is no await, so later
+            # messages start a new worker instead of waiting on a queue that nobody reads
+            if self._queues.get(queue_key) is queue:
+                del self._queues[queue_key]
+            dropped = [pending] if pending else []
+            while not queue.empty():
+                dropped.append(queue.get_nowait())
+            if dropped:
+                logger.warning(f"Dropped {len(dropped)} webhook message(s) for {queue_key}")
+                self.resolve(items=dropped)
+
+    async def _collect_thoughts(self, queue: asyncio.Queue, items: list[WebhookItem]) -> Optional[WebhookItem]:
+        """Gather thoughts that arrive within the coalesce window. Returns the first non-thought item, if any."""
+        deadline = time.perf_counter() + WEBHOOK_COALESCE_WINDOW
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            if not item.is_thought or item.url != items[0].url:
+                return item
+            items.append(item)
+
+    @staticmethod
+    def coalesce(items: list[WebhookItem]) -> str:
+        """Merge thought payloads into the latest payload with the content joined together"""
+        if len(items) == 1:
+            return items[0].payload
+        messages = [json.loads(item.payload) for item in items]
+        merged = messages[-1]
+        merged["content"] = " ".join(message["content"].strip() for message in messages if message["content"])
+        return json.dumps(merged)
+
+    async def _deliver(self, items: list[WebhookItem]) -> None:
+        last = items[-1]
+        payload = self.coalesce(items=items)
+        headers = {**last.headers, "Content-Type": "application/json"}
+        error: Optional[Exception] = None
+        attempt = 0
+        for attempt in range(1, WEBHOOK_MAX_ATTEMPTS + 1):
+            try:
+                async with self.session.post(url=last.url, headers=headers, data=payload) as response:
+                    if response.status in RETRY_STATUSES and attempt < WEBHOOK_MAX_ATTEMPTS:
+                        logger.warning("Webhook status response: %s. Retrying.", response.status)
+                    else:
+                        if response.status != 200:
+                            logger.warning("Webhook status response: %s", response.status)
+                            logger.warning("Webhook status text: %s", await response.text())
+                        error = None
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Webhook delivery attempt {attempt} failed: {str(e)}")
+                error = e
+            if attempt < WEBHOOK_MAX_ATTEMPTS:
+                await asyncio.sleep(WEBHOOK_BACKOFF_BASE * 2 ** (attempt - 1))
+        latency = time.perf_counter() - items[0].enqueued_at
+        if error:
+            logger.error(f"Webhook delivery failed after {attempt} attempts in {latency:.3f}s: {str(error)}")
+        else:
+            logger.debug(f"Webhook delivered {len(items)} message(s) in {latency:.3f}s after {attempt} attempt(s)")
+
+    @staticmethod
+    def resolve(items: list[WebhookItem]) -> None:
+        for item in items:
+            if item.future and not item.future.done():
+                # Delivery failures are logged rather than raised, same as before the dispatcher existed
+                item.future.set_result(None)
+
+    async def close_session(self) -> None:
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def close(self) -> None:
+        for worker in list(self._workers):
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._closer.cancel()
+        await self.close_session()
+
+
+_dispatcher: Optional[WebhookDispatcher] = None
+
+
+def get_webhook_dispatcher() -> WebhookDispatcher:
+    """Get the dispatcher for this process, creating a new one if the event loop has changed"""
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.loop is not asyncio.get_running_loop():
+        _dispatcher = WebhookDispatcher()
+    return _dispatcher
+
+
+async def close_webhook_dispatcher() -> None:
+    """Close the shared webhook session
+
+    The session is also closed when asyncio.run cancels the remaining tasks. Call this on application shutdown
+    when the loop is managed some other way.
+    """
+    global _dispatcher
+    if _dispatcher:
+        await _dispatcher.close()
+        _dispatcher = None
@@ -261,6 +261,9 @@ async def chat(
     agent_setup = AgentSetup.load_from_prompt_metadata(
         prompt_metadata_base=prompt_metadata_base
     )
+    # Use the client's settings for the chat
+    client = await crud_main.get_client(db=db, client_uuid=client_user.client_uuid)
+    assert client
     chat_metadata = sch.ChatMetadata(
         chat_id=chat_id,
         chat_uuid=chat_uuid,
@@ -270,6 +273,7 @@ async def chat(
         team_id=team_id,
         parent_msg_uuid=uuid.uuid4(),
         curr_chat_history=[],
+        schema_format=client.schema_format,
         vector_store=vector_store,
         embedding_model_info=embedding_model_info,
     )
@@ -5,6 +5,7 @@ from basejump.core.models import enums
 from basejump.core.common.config.logconfig import set_logging
 from basejump.core.models import schemas as sch
 from basejump.core.database.vector_utils import get_index_name
+from basejump.core.service.webhook import close_webhook_dispatcher
 
 logger = set_logging(handler_option="stream", name=__name__)
 
@@ -122,5 +123,12 @@ async def run_main():
         logger.info(chat_result.query_result.result_uuid)
 
 
+async def main():
+    try:
+        await run_main()
+    finally:
+        await close_webhook_dispatcher()
+
+
 if __name__ == "__main__":
-    asyncio.run(run_main())
+    asyncio.run(main())
@@ -22,6 +22,20 @@ logger = set_logging(handler_option="stream", name=__name__)
 # TODO: Make more DRY with the basejump.demo package
 
 
+def pytest_addoption(parser):
+    parser.addoption("--run-benchmarks", action="store_true", help="run the benchmark tests")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the benchmarks unless they are requested since they write a lot of rows to the database"""
+    if config.getoption("--run-benchmarks"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="use --run-benchmarks to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 @asynccontextmanager
 async def get_session(test_env: schemas.PyTestEnv) -> schemas.PyTestEnv:
     """Manages objects that cannot be shared across tests due to pytest
@@ -1,9 +1,17 @@
+import asyncio
+
+import pandas as pd
 import pytest
 
 from basejump.core.database.crud import crud_chat
 from basejump.demo import settings, service
 from basejump.core.database.vector_utils import get_index_name
 from basejump.core.service import service_utils
+from basejump.core.service.base import ResponseFilter
+from basejump.core.service.chat_history import ChatHistoryTrimmer
+from basejump.core.service.tools.sql import is_complex_prompt
+from basejump.core.service.tools.visualize import CSVRowSampler, detect_date_col, get_aggregate_query
+from chat2plot.schema import PlotConfig
 
 
 @pytest.mark.chat
@@ -97,3 +105,96 @@ async def test_get_trust_score(chat_session):
     """Test getting a trust score"""
     result = await service_utils.calc_trust_score(db=chat_session.db)
     assert result
+
+
+@pytest.mark.chat
+def test_response_filter():
+    """Confirm the streamed response is filtered the same as the full response"""
+    response = "Thought: I can answer now. Option 1: use the teams table. Answer: There are 6 teams."
+    full_filter = ResponseFilter()
+    full_response = full_filter.push(response) + full_filter.flush()
+    assert full_response == " I can answer now.  There are 6 teams."
+
+    stream_filter = ResponseFilter()
+    tokens = [response[idx : idx + 3] for idx in range(0, len(response), 3)]
+    streamed_response = "".join(stream_filter.push(token) for token in tokens) + stream_filter.flush()
+    assert streamed_response == full_response
+
+
+@pytest.mark.chat
+async def test_chat_history_trimmer():
+    """Confirm chats are trimmed in one batch per client and a cancelled trim doesn't block the next one"""
+    trimmer = ChatHistoryTrimmer(delay=60)
+    assert trimmer.add(client_id=1, chat_id=1)
+    assert not trimmer.add(client_id=1, chat_id=2)
+    assert trimmer.add(client_id=2, chat_id=3)
+    assert trimmer.pending_chat_ids[1] == {1, 2}
+
+    task = asyncio.create_task(trimmer.trim_later(client_id=1, engine=None, redis_client_async=None))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert 1 not in trimmer.pending_chat_ids
+    assert trimmer.add(client_id=1, chat_id=1)
+
+
+@pytest.mark.chat
+def test_is_complex_prompt():
+    """Confirm only prompts covering several subjects are broken out into sub-prompts"""
+    assert not is_complex_prompt(prompt="How many teams are there?", scores=[0.91, 0.84, 0.8])
+    prompt = "Get me a report with users, teams, and clients along with their total purchases by month"
+    assert is_complex_prompt(prompt=prompt, scores=[0.91, 0.84, 0.8])
+    # Many tables that are equally relevant suggest the prompt covers several subjects
+    assert is_complex_prompt(prompt="Show the users and their teams or clients", scores=[0.85, 0.845, 0.84, 0.835])
+
+
+@pytest.mark.chat
+def test_detect_date_col():
+    """Confirm date columns are classified by their values without using embeddings"""
+    assert detect_date_col(pd.Series(["2024-01-05", "2024-02-05 10:00:00"]))
+    assert detect_date_col(pd.Series(["January", "Feb", "Q1 2024"]))
+    assert detect_date_col(pd.Series(["West", "East"])) is False
+    assert detect_date_col(pd.Series([True, False])) is False
+    # Numbers could be years, months or quarters, so the column name decides
+    assert detect_date_col(pd.Series([2023, 2024])) is None
+    assert detect_date_col(pd.Series([202401, 202402])) is None
+    assert detect_date_col(pd.Series([1, 6, 12])) is None
+    assert detect_date_col(pd.Series([2023.0, None])) is None
+
+
+@pytest.mark.chat
+def test_csv_row_sampler():
+    """Confirm rows with new lines in quoted values are sampled as one row"""
+    data = b'id,note\n0,"a\nb"\n1,c\n2,"d\ne"\n3,f\n4,g\n'
+    sampler = CSVRowSampler(row_num_total=5, max_rows=3)
+    for idx in range(0, len(data), 4):
+        sampler.feed(data[idx : idx + 4])
+    sampler.feed(b"", final=True)
+    df = sampler.to_df()
+    assert df["id"].tolist() == [0, 2, 4]
+    assert df["note"].tolist() == ["a\nb", "d\ne", "g"]
+
+
+@pytest.mark.chat
+def test_get_aggregate_query():
+    """Confirm large results are aggregated in SQL by the dimensions of the chart"""
+    config = PlotConfig.model_validate(
+        {
+            "chart_type": "bar",
+            "x": {"column": "region", "label": None},
+            "y": {"column": "sales", "aggregation": "SUM", "label": None},
+            "color": "year",
+            "filters": [],
+        }
+    )
+    aggregate_query = get_aggregate_query(
+        sql_query="SELECT region, year, sales FROM orders ORDER BY region", config=config, dialect="postgres"
+    )
+    assert aggregate_query == (
+        'SELECT "region", "year", SUM("sales") AS "sales" FROM (SELECT region, year, sales FROM orders) AS result '
+        'GROUP BY "region", "year"'
+    )
+    # Scatter plots don't aggregate the data
+    config.chart_type = "scatter"
+    assert not get_aggregate_query(sql_query="SELECT region, year, sales FROM orders", config=config)
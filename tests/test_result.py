@@ -1,6 +1,26 @@
+import io
+import os
+from itertools import islice
+
 import pytest
 
+from basejump.core.database.athena_jobs import get_poll_delays
 from basejump.core.database.crud import crud_result
+from basejump.core.database.result_store import LocalResultStore
+from basejump.core.database.storage_cache import (
+    BotoClientPool,
+    StorageConnCache,
+    StorageConnection,
+    get_storage_provider,
+)
+from basejump.core.database.upload import (
+    CSVRowCounter,
+    CSVStreamParser,
+    MemoryViewReader,
+    RowOffsetIndex,
+    convert_csv_rows,
+)
+from basejump.core.models import enums
 
 
 @pytest.mark.result
@@ -18,3 +38,133 @@ async def test_get_results(chat_session):
         db=chat_session.db,
         result_uuid=chat_session.result_uuid,
     )
+
+
+@pytest.mark.result
+def test_csv_stream_parser():
+    """Test parsing rows and characters that are split across chunks"""
+    data = 'id,note\n1,"multi\nline, ""quoted"""\n2,café\n'.encode("utf-8")
+    parser = CSVStreamParser()
+    rows = []
+    for idx in range(0, len(data), 3):
+        rows += parser.feed(data[idx : idx + 3])
+    rows += parser.feed(b"", final=True)
+    assert rows == [["id", "note"], ["1", 'multi\nline, "quoted"'], ["2", "café"]]
+
+
+@pytest.mark.result
+def test_convert_csv_rows_widens_types():
+    """Test values that don't match the inferred type widen the column instead of being set to null"""
+    rows = [["2.5", "N/A", "true", "7", ""], ["3", "1.5", "maybe", "8", "x"]]
+    dtypes = {"a": "Int64", "b": "float64", "c": "boolean", "d": "Int64", "e": "datetime64[ns]"}
+    df, new_dtypes = convert_csv_rows(rows=rows, dtypes=dtypes)
+    assert new_dtypes == {"a": "float64", "b": "string", "c": "string", "d": "Int64", "e": "string"}
+    assert df["a"].tolist() == [2.5, 3.0]
+    assert df["b"].tolist() == ["N/A", "1.5"]
+    assert df["d"].tolist() == [7, 8]
+    assert df["e"].isna().tolist() == [True, False]
+
+
+@pytest.mark.result
+def test_csv_row_counter():
+    """Test counting exported rows with quoted new lines that are split across chunks"""
+    counter = CSVRowCounter(head_row_ct=3)
+    for chunk in [b'id,note\n1,"multi\n', b'line"\n2,', b"b\n3,c\n"]:
+        counter.feed(chunk)
+    assert counter.row_ct == 4
+    assert counter.get_head_rows() == [["id", "note"], ["1", "multi\nline"], ["2", "b"]]
+
+
+@pytest.mark.result
+def test_row_offset_index():
+    """Test reading a page of rows using the offsets recorded while counting the rows"""
+    data = b'id,note\n0,a\n1,"b\nc"\n2,d\n3,e\n4,f\n'
+    row_index = RowOffsetIndex(interval=2)
+    counter = CSVRowCounter(head_row_ct=1, row_index=row_index)
+    for idx in range(0, len(data), 4):
+        counter.feed(data[idx : idx + 4])
+    row_index.file_size = counter.byte_ct
+    assert row_index.offsets == [8, 20, 28]
+    range_start, range_end, skip_row_ct = row_index.get_byte_range(start_row=1, end_row=3)
+    assert data[range_start:range_end] == b'0,a\n1,"b\nc"\n2,d\n3,e\n'
+    assert skip_row_ct == 1
+    assert row_index.get_byte_range(start_row=10, end_row=12) == (row_index.file_size, row_index.file_size, 0)
+    with pytest.raises(ValueError):
+        row_index.get_byte_range(start_row=-1, end_row=3)
+
+
+@pytest.mark.result
+def test_memory_view_reader():
+    """Test closing the reader after an upload leaves the buffer usable"""
+    buffer = io.BytesIO(b"id\n1\n")
+    with MemoryViewReader(buffer.getbuffer()) as reader:
+        assert reader.read(3) == b"id\n"
+        reader.seek(0)
+        assert reader.read() == b"id\n1\n"
+    buffer.seek(0, io.SEEK_END)
+    buffer.write(b"2\n")
+    assert buffer.getvalue() == b"id\n1\n2\n"
+
+
+@pytest.mark.result
+def test_storage_conn_cache():
+    """Test storage connections expire and clients are shared for the same credentials"""
+    storage_conn_cache = StorageConnCache(ttl=60)
+    storage_conn = StorageConnection(
+        region="us-east-2", bucket_name="bucket", prefix="prefix/", access_key="key", secret_access_key="secret"
+    )
+    storage_conn_cache.set(client_id=1, storage_conn=storage_conn)
+    assert storage_conn_cache.get(client_id=1) is storage_conn
+    storage_conn.created_at -= 60
+    assert storage_conn_cache.get(client_id=1) is None
+
+    boto_client_pool = BotoClientPool()
+    credentials = {"region": "us-east-2", "access_key": "key", "secret_access_key": "secret"}
+    s3_client = boto_client_pool.get_client("s3", **credentials)
+    assert boto_client_pool.get_client("s3", **credentials) is s3_client
+    assert boto_client_pool.get_client("s3", **{**credentials, "access_key": "key2"}) is not s3_client
+
+    assert get_storage_provider(" local ") == enums.StorageProvider.LOCAL
+    assert get_storage_provider("aws-s3") == enums.StorageProvider.AWS_S3
+    assert get_storage_provider("S3") == enums.StorageProvider.AWS_S3
+    assert get_storage_provider("gcs") == enums.StorageProvider.AWS_S3
+
+
+@pytest.mark.result
+def test_get_poll_delays():
+    """Test the Athena poll delays back off up to the max delay"""
+    assert list(islice(get_poll_delays(initial_delay=0.25, max_delay=2), 6)) == [0.25, 0.5, 1, 2, 2, 2]
+
+
+@pytest.mark.result
+def test_local_result_store(tmp_path):
+    """Test parts are combined in order, ranges are read and the oldest results are evicted"""
+    result_store = LocalResultStore(root_dir=str(tmp_path), max_bytes=18)
+    upload_id = result_store.create_multipart_upload(key="prefix/result.csv")
+    etags = [
+        result_store.upload_part(
+            key="prefix/result.csv", upload_id=upload_id, part_number=idx + 1, body=io.BytesIO(part)
+        )
+        for idx, part in enumerate([b"id\n1\n", b"2\n3\n"])
+    ]
+    result_store.complete_multipart_upload(key="prefix/result.csv", upload_id=upload_id, etags=etags)
+    assert result_store.read_bytes(key="prefix/result.csv") == b"id\n1\n2\n3\n"
+    assert result_store.read_bytes(key="prefix/result.csv", start=3, end=7) == b"1\n2\n"
+    assert b"".join(result_store.stream(key="prefix/result.csv", chunk_size=4)) == b"id\n1\n2\n3\n"
+    assert not (tmp_path / ".multipart" / upload_id).exists()
+
+    # Reading a result marks it as recently used, so the older result is evicted first
+    result_store.put_object(key="prefix/result_row_index.json", body=b"{}")
+    result_store.put_object(key="prefix/other.csv", body=b"id\n1\n")
+    result_store.read_bytes(key="prefix/result.csv")
+    result_store.put_object(key="prefix/new.csv", body=b"id\n1\n")
+    assert not (tmp_path / "prefix" / "other.csv").exists()
+    assert (tmp_path / "prefix" / "result.csv").exists()
+    assert (tmp_path / "prefix" / "new.csv").exists()
+
+    # A result is evicted along with its row index, but not while its own files are being saved
+    result_store.put_object(key="prefix/new_preview.csv", body=b"id\n1\n2\n3\n")
+    assert not (tmp_path / "prefix" / "result.csv").exists()
+    assert not (tmp_path / "prefix" / "result_row_index.json").exists()
+    assert (tmp_path / "prefix" / "new.csv").exists()
+    assert (tmp_path / "prefix" / "new_preview.csv").exists()
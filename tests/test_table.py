@@ -1,6 +1,22 @@
+import time
+import uuid
+
 import pytest
+from llama_index.core.utils import get_tokenizer
+from sqlalchemy import delete, select
+
+from basejump.core.common.config.logconfig import set_logging
+from basejump.core.database.crud import crud_table, crud_utils
+from basejump.core.database.db_connect import TableManager
+from basejump.core.models import enums
+from basejump.core.models import schemas as sch
+from basejump.core.models.models import ConnTableAssociation, DBTableColumns, DBTables
+
+logger = set_logging(handler_option="stream", name=__name__)
 
-from basejump.core.database.crud import crud_table
+BENCHMARK_TABLE_CT = 500
+BENCHMARK_COLUMN_CT = 20
+SCHEMA_FORMAT_COLUMN_CT = 200
 
 
 @pytest.mark.table
@@ -24,3 +40,146 @@ async def test_get_tables(db_session):
     await crud_table.get_tables_from_uuid(
         db=db_session.db, tbl_uuids=[table.tbl_uuid for table in tables]
     )
+
+
+def get_synthetic_catalog(prefix: str) -> list[sch.SQLTable]:
+    return [
+        sch.SQLTable(
+            table_name=f"table_{tbl_idx}",
+            table_schema=prefix,
+            full_table_name=f"{prefix}.table_{tbl_idx}",
+            columns=[
+                sch.SQLTableColumn(column_name=f"column_{col_idx}", column_type="VARCHAR")
+                for col_idx in range(BENCHMARK_COLUMN_CT)
+            ],
+        )
+        for tbl_idx in range(BENCHMARK_TABLE_CT)
+    ]
+
+
+async def upload_table_names_per_row(db, client_id: int, db_id: int, conn_id: int, tables: list[sch.SQLTable]):
+    """The prior implementation of upload_table_names used as the benchmark baseline"""
+    for table in tables:
+        tbl_id = await crud_utils.get_next_val(db=db, full_table_nm=str(DBTables.__table__), column_nm="tbl_id")
+        db.add(
+            DBTables(
+                tbl_id=tbl_id,
+                tbl_uuid=uuid.uuid4(),
+                db_id=db_id,
+                client_id=client_id,
+                table_name=table.full_table_name,
+                context=table.context_str,
+            )
+        )
+        db.add(ConnTableAssociation(client_id=client_id, conn_id=conn_id, tbl_id=tbl_id))
+        for column in table.columns:
+            db.add(
+                DBTableColumns(
+                    client_id=client_id,
+                    tbl_id=tbl_id,
+                    column_name=column.column_name,
+                    column_type=column.column_type,
+                    description=column.description,
+                    foreign_key_column_name=column.foreign_key_column_name,
+                    foreign_key_table_name=column.foreign_key_table_name,
+                    quoted=column.quoted,
+                )
+            )
+    await db.commit()
+
+
+@pytest.mark.table
+@pytest.mark.benchmark
+async def test_upload_table_names_benchmark(db_session):
+    """Compare rows per second for the per row and bulk table uploads on a synthetic catalog"""
+    row_ct = BENCHMARK_TABLE_CT * (BENCHMARK_COLUMN_CT + 2)
+    try:
+        tables = get_synthetic_catalog(prefix="benchmark_per_row")
+        start = time.perf_counter()
+        await upload_table_names_per_row(
+            db=db_session.db,
+            client_id=db_session.client_id,
+            db_id=db_session.db_id,
+            conn_id=db_session.conn_id,
+            tables=tables,
+        )
+        per_row_rate = row_ct / (time.perf_counter() - start)
+
+        tables = get_synthetic_catalog(prefix="benchmark_bulk")
+        start = time.perf_counter()
+        await crud_table.upload_table_names(
+            db=db_session.db,
+            client_id=db_session.client_id,
+            db_id=db_session.db_id,
+            conn_id=db_session.conn_id,
+            tables=tables,
+            permitted_tables=tables,
+        )
+        bulk_rate = row_ct / (time.perf_counter() - start)
+        logger.info(f"Per row upload: {per_row_rate:.0f} rows/s, bulk upload: {bulk_rate:.0f} rows/s")
+
+        uploaded_tables = await crud_table.get_tables_from_nms(
+            db=db_session.db, table_names=[table.full_table_name for table in tables], db_id=db_session.db_id
+        )
+        assert len(uploaded_tables) == BENCHMARK_TABLE_CT
+        assert all(table.tbl_uuid for table in tables)
+    finally:
+        benchmark_tbl_ids = select(DBTables.tbl_id).where(
+            DBTables.db_id == db_session.db_id, DBTables.table_name.like("benchmark_%")
+        )
+        for model in [DBTableColumns, ConnTableAssociation, DBTables]:
+            await db_session.db.execute(delete(model).where(model.tbl_id.in_(benchmark_tbl_ids)))
+        await db_session.db.commit()
+
+
+def get_wide_table() -> sch.SQLTable:
+    columns = [sch.SQLTableColumn(column_name="id", column_type="INTEGER", primary_key=True)]
+    for col_idx in range(SCHEMA_FORMAT_COLUMN_CT):
+        columns.append(
+            sch.SQLTableColumn(
+                column_name=f"column_{col_idx}",
+                column_type="CHARACTER VARYING(255)" if col_idx % 2 else "TIMESTAMP WITHOUT TIME ZONE",
+                description=f"Description of column {col_idx}" if col_idx % 5 == 0 else None,
+                foreign_key_table_name="public.other_table" if col_idx % 20 == 0 else None,
+                foreign_key_column_name="id" if col_idx % 20 == 0 else None,
+            )
+        )
+    return sch.SQLTable(
+        table_name="wide_table",
+        table_schema="public",
+        full_table_name="public.wide_table",
+        context_str="A wide table used to benchmark schema formats",
+        columns=columns,
+    )
+
+
+@pytest.mark.table
+def test_compact_schema_format_benchmark():
+    """Compare the tokens used by the compact schema format and the YAML schema format"""
+    tokenizer = get_tokenizer()
+    table = get_wide_table()
+    yaml_table_info = TableManager.format_table_info(table=table)
+    compact_table_info = TableManager.format_table_info(table=table, schema_format=enums.SchemaFormat.COMPACT)
+    # Table info already saved as YAML is converted to the same compact format
+    assert TableManager.compact_table_info(table_info=yaml_table_info) == compact_table_info
+    assert "id int PK" in compact_table_info
+    assert "column_0 timestamp -> public.other_table.id -- Description of column 0" in compact_table_info
+    yaml_tokens = len(tokenizer(yaml_table_info))
+    compact_tokens = len(tokenizer(compact_table_info))
+    logger.info(f"YAML schema tokens: {yaml_tokens}, compact schema tokens: {compact_tokens}")
+    assert compact_tokens < yaml_tokens / 2
+
+
+@pytest.mark.table
+def test_prune_wide_table_info():
+    """Test pruning a wide table down to the relevant columns and its keys"""
+    table = get_wide_table()
+    table_dict = TableManager.load_table_info(table_info=TableManager.format_table_info(table=table))
+    pruned_table_info = TableManager.prune_table_info(table_dict=table_dict, column_names=["column_7", "column_9"])
+    pruned_column_names = [
+        column["column_name"] for column in TableManager.load_table_info(table_info=pruned_table_info)["columns"]
+    ]
+    # Keep the relevant columns along with the primary and foreign keys
+    foreign_key_column_names = [f"column_{col_idx}" for col_idx in range(0, SCHEMA_FORMAT_COLUMN_CT, 20)]
+    assert sorted(pruned_column_names) == sorted(["id", "column_7", "column_9", *foreign_key_column_names])
+    assert "A wide table used to benchmark schema formats" in pruned_table_info